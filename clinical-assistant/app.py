@@ -70,6 +70,13 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
     st.session_state.greetings = False
 
+@st.cache_resource(show_spinner="Connecting to the MCP healthcare server...")
+def load_shared_resources():
+    """Process-wide tracing setup, MCP session pool and tool definitions, shared by all sessions."""
+    return health_agent_async.warm_up()
+
+load_shared_resources()
+
 if "health_agent" not in st.session_state:
     print("🆕 Creating new agent instance")
     agent, mcp = health_agent_async.create_health_agent()
@@ -121,7 +128,9 @@ if clear_button or "messages" not in st.session_state:
     st.session_state.messages = []
     st.session_state.greetings = False
     st.session_state.pop("health_agent", None)
-    st.session_state.pop("mcp_client", None)
+    pinned_client = st.session_state.pop("mcp_client", None)
+    if pinned_client is not None:
+        pinned_client.release()
     st.rerun()
 
 # Always show the chat input
@@ -0,0 +1,256 @@
+"""Offline benchmarks of the MCP server's tool functions on synthetic data.
+
+    python benchmark.py run --scales 1000,100000,1000000 --output bench-graviton.json
+    python benchmark.py compare bench-x86.json bench-graviton.json --threshold 10
+
+"run" benchmarks search_patients, get_lab_results, get_patient_summary and
+_generate_risk_factors at each scale (number of patients), calling the tool
+bodies directly with no MCP transport in between. Every scale runs in a fresh
+process that loads a synthetic data set (see synthetic_data.py; generated
+once and reused from --data-dir), so its RSS measures that scale alone. Per
+scale the report has load time and RSS after loading, and per function the
+latency percentiles, single-thread throughput and peak RSS.
+
+"compare" prints the same function and scale from several reports side by
+side, e.g. one commit against the next or an ARM64 run against an x86 run.
+With --threshold it exits 1 when the last report's p50 latency is more than
+that many percent above the first's, so CI can fail on regressions.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from loadtest import percentile
+
+DEFAULT_SCALES = "1000,10000,100000"
+FUNCTIONS = ("search_patients", "get_lab_results", "get_patient_summary", "_generate_risk_factors")
+SEARCH_TERMS = ("diabetes", "hypertension", "john", "smith", "garcia", "kidney", "mari")
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def dataset_dir(args, patients: int) -> str:
+    """Directory holding the synthetic data set for a scale, generated on first use."""
+    from synthetic_data import write_dataset
+
+    path = os.path.join(args.data_dir, f"{patients}-seed{args.seed}-labs{args.mean_labs:g}-skew{args.lab_skew:g}")
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        print(f"🧪 Generating {patients} synthetic patients in {path}", file=sys.stderr, flush=True)
+        started = time.perf_counter()
+        counts = write_dataset(path, patients, args.seed, mean_labs=args.mean_labs, lab_skew=args.lab_skew)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({**counts, "generate_s": round(time.perf_counter() - started, 2)}, f)
+    return path
+
+
+def measure(call: Callable[[int], object], iterations: int, max_seconds: float, warmup: int = 10) -> Dict:
+    """Latency percentiles and throughput of ``call(i)``, run up to ``iterations`` times or ``max_seconds``."""
+    for i in range(warmup):
+        call(i)
+    samples = []
+    started = time.perf_counter()
+    deadline = started + max_seconds
+    for i in range(iterations):
+        begin = time.perf_counter()
+        call(i)
+        samples.append(time.perf_counter() - begin)
+        if begin > deadline:
+            break
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "count": len(samples),
+        "ops_per_s": round(len(samples) / elapsed, 1),
+        "mean_ms": round(1000 * sum(samples) / len(samples), 4),
+        "p50_ms": round(1000 * percentile(samples, 50), 4),
+        "p95_ms": round(1000 * percentile(samples, 95), 4),
+        "p99_ms": round(1000 * percentile(samples, 99), 4),
+        "max_ms": round(1000 * samples[-1], 4),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def benchmark_scale(data_dir: str, iterations: int, max_seconds: float, seed: int) -> Dict:
+    """Load one data set into the MCP server module and benchmark its functions (run in a fresh process)."""
+    os.environ["PATIENT_DATA_DIR"] = data_dir
+    # Time the computation rather than summary cache hits
+    os.environ["SUMMARY_CACHE_TTL"] = "0"
+    import mcpserver
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    mcpserver.init_data()
+    load_s = time.perf_counter() - started
+    rss_loaded = rss_mb()
+    store = mcpserver.store
+
+    rng = random.Random(seed)
+    patient_ids = list(store.patient_ids())
+    # Uniform picks, so the few patients with hundreds of labs show up in the tail as they would in traffic
+    sample = [rng.choice(patient_ids) for _ in range(min(iterations, 10000))]
+    # Tool bodies, without the thread pool offload and metrics wrappers
+    search_patients = inspect.unwrap(mcpserver.search_patients)
+    get_lab_results = inspect.unwrap(mcpserver.get_lab_results)
+    get_patient_summary = inspect.unwrap(mcpserver.get_patient_summary)
+    since_day = mcpserver._cutoff_day(365)
+    risk_inputs = [
+        ([c for c in store.get_conditions(pid) if c["status"].lower() == "active"],
+         store.labs_since(pid, since_day)[0])
+        for pid in sample[:1000]
+    ]
+
+    calls = {
+        "search_patients": lambda i: search_patients(SEARCH_TERMS[i % len(SEARCH_TERMS)]),
+        "get_lab_results": lambda i: get_lab_results(sample[i % len(sample)]),
+        "get_patient_summary": lambda i: get_patient_summary(sample[i % len(sample)]),
+        "_generate_risk_factors": lambda i: mcpserver._generate_risk_factors(*risk_inputs[i % len(risk_inputs)]),
+    }
+    results = {}
+    for name in FUNCTIONS:
+        results[name] = measure(calls[name], iterations, max_seconds)
+        print(f"  {name:<24}p50 {results[name]['p50_ms']:>9} ms  {results[name]['ops_per_s']:>10} ops/s",
+              file=sys.stderr, flush=True)
+    return {
+        "patients": len(store),
+        "load_s": round(load_s, 2),
+        "rss_after_load_mb": round(rss_loaded, 1),
+        "rss_data_mb": round(rss_loaded - rss_before, 1),
+        "functions": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> Dict:
+    report = {
+        "label": args.label,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "commit": git_commit(),
+        "config": {"iterations": args.iterations, "max_seconds": args.max_seconds, "seed": args.seed,
+                   "mean_labs": args.mean_labs, "lab_skew": args.lab_skew},
+        "scales": {},
+    }
+    for patients in (int(scale) for scale in args.scales.split(",")):
+        path = dataset_dir(args, patients)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        print(f"⏱️  {patients} patients, {meta['labs']} lab results", file=sys.stderr, flush=True)
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "scale", os.path.abspath(path),
+             "--iterations", str(args.iterations), "--max-seconds", str(args.max_seconds), "--seed", str(args.seed)],
+            stdout=subprocess.PIPE, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        report["scales"][str(patients)] = {"labs": meta["labs"], "conditions": meta["conditions"],
+                                           **json.loads(completed.stdout.strip().splitlines()[-1])}
+    return report
+
+
+def print_report(report: Dict):
+    print(f"\n{report['label']} ({report['machine']}, {report['cpu_count']} CPUs, Python {report['python']}, "
+          f"commit {report['commit']})")
+    print(f"{'patients':>10}  {'function':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'RSS MB':>9}")
+    for patients, scale in report["scales"].items():
+        for name, stats in scale["functions"].items():
+            print(f"{patients:>10}  {name:<24}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}"
+                  f"{stats['ops_per_s']:>12}{stats['peak_rss_mb']:>9}")
+        print(f"{'':>10}  load {scale['load_s']} s, {scale['rss_after_load_mb']} MB RSS after load")
+
+
+def compare(paths: List[str], threshold: Optional[float]) -> bool:
+    """Print reports side by side; False when the last regressed past ``threshold`` percent against the first."""
+    reports = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            reports.append(json.load(f))
+    first, last = reports[0], reports[-1]
+    regressions = []
+    scales = dict.fromkeys(scale for report in reports for scale in report["scales"])
+    for patients in scales:
+        for name in FUNCTIONS:
+            print(f"\n{name} at {patients} patients")
+            print(f"  {'run':<36}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'RSS MB':>9}{'p50 change':>12}")
+            base = first["scales"].get(patients, {}).get("functions", {}).get(name)
+            for report in reports:
+                stats = report["scales"].get(patients, {}).get("functions", {}).get(name)
+                if stats is None:
+                    continue
+                change = 100 * (stats["p50_ms"] - base["p50_ms"]) / base["p50_ms"] if base and base["p50_ms"] else None
+                label = f"{report['label']} ({report['machine']}, {report['commit']})"
+                print(f"  {label:<36}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['ops_per_s']:>12}"
+                      f"{stats['peak_rss_mb']:>9}{'' if change is None else f'{change:+.1f}%':>12}")
+                if report is last and threshold is not None and change is not None and change > threshold:
+                    regressions.append(f"{name} at {patients} patients: p50 {change:+.1f}%")
+    for regression in regressions:
+        print(f"❌ Regression: {regression}")
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the MCP server's tool functions")
+    modes = parser.add_subparsers(dest="mode", required=True)
+    runner = modes.add_parser("run")
+    runner.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated patient counts, e.g. 1000,1000000")
+    runner.add_argument("--data-dir", default="bench-data", help="where synthetic data sets are generated and reused")
+    runner.add_argument("--mean-labs", type=float, default=8.0)
+    runner.add_argument("--lab-skew", type=float, default=1.5)
+    runner.add_argument("--label", default=platform.node())
+    runner.add_argument("--output", help="write the report as JSON")
+    scale = modes.add_parser("scale", help="benchmark one data set in this process (used by run)")
+    scale.add_argument("data_dir")
+    for sub in (runner, scale):
+        sub.add_argument("--iterations", type=int, default=2000, help="calls per function, at most")
+        sub.add_argument("--max-seconds", type=float, default=10, help="time per function, at most")
+        sub.add_argument("--seed", type=int, default=0)
+    comparison = modes.add_parser("compare")
+    comparison.add_argument("reports", nargs="+")
+    comparison.add_argument("--threshold", type=float, help="fail when p50 grows by more than this many percent")
+    args = parser.parse_args()
+
+    if args.mode == "compare":
+        sys.exit(0 if compare(args.reports, args.threshold) else 1)
+    if args.mode == "scale":
+        # Data loading prints progress; the result is the last stdout line
+        print(json.dumps(benchmark_scale(args.data_dir, args.iterations, args.max_seconds, args.seed)))
+        return
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import inspect
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Tuple
+
+import pydantic_core
+from mcp.types import CallToolResult, TextContent
+
+
+def serialized(result: Any) -> Any:
+    """A dict tool result rendered once into the CallToolResult FastMCP would build from it.
+
+    FastMCP renders a returned dict to text (and validates it) again for every
+    call; a CallToolResult is passed through as-is, so callers sharing one
+    result share its rendering too. Error results stay plain dicts, which the
+    tool metrics count as errors.
+    """
+    if not isinstance(result, dict) or "error" in result:
+        return result
+    text = pydantic_core.to_json(result, fallback=str, indent=2).decode()
+    return CallToolResult(content=[TextContent(type="text", text=text)], structuredContent={"result": result})
+
+
+class _KeyStats:
+    __slots__ = ("calls", "executions", "waiting", "peak_waiting")
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls of an async function with identical arguments.
+
+    The first call for a key starts the computation; calls with the same key
+    arriving before it finishes wait for that computation and receive the
+    same result object. Nothing is kept once it finishes, so this collapses
+    bursts (many clinicians opening one patient) without caching anything.
+    The computation runs as its own task, so a caller that is cancelled (a
+    client that disconnected) does not cancel it for the others.
+
+    Per-key call, execution and concurrency counts are kept for the most
+    recently used ``max_keys`` keys; per-tool totals are kept for all.
+    """
+
+    def __init__(self, max_keys: int = 1024):
+        self.max_keys = max_keys
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._keys: "OrderedDict[Tuple[str, str], _KeyStats]" = OrderedDict()
+        self._tools: Dict[str, Dict[str, int]] = {}
+
+    def coalesced(self, func):
+        """Wrap an async tool function; its arguments, defaults applied, form the key."""
+        name = func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (name, json.dumps(bound.arguments, sort_keys=True, default=str, separators=(",", ":")))
+            # Only the event loop thread touches the in-flight table, so it needs no lock
+            stats = self._key_stats(key)
+            totals = self._tools.setdefault(name, {"calls": 0, "executions": 0, "coalesced": 0})
+            stats.calls += 1
+            totals["calls"] += 1
+            task = self._inflight.get(key)
+            if task is None:
+                stats.executions += 1
+                totals["executions"] += 1
+                task = asyncio.ensure_future(self._run(func, args, kwargs))
+                self._inflight[key] = task
+                task.add_done_callback(functools.partial(self._finished, key))
+            else:
+                totals["coalesced"] += 1
+            stats.waiting += 1
+            stats.peak_waiting = max(stats.peak_waiting, stats.waiting)
+            try:
+                return await asyncio.shield(task)
+            finally:
+                stats.waiting -= 1
+        return wrapper
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller was cancelled before it arrived
+            task.exception()
+
+    @staticmethod
+    async def _run(func, args, kwargs):
+        return serialized(await func(*args, **kwargs))
+
+    def _key_stats(self, key: Tuple[str, str]) -> _KeyStats:
+        stats = self._keys.get(key)
+        if stats is None:
+            stats = self._keys[key] = _KeyStats()
+            if len(self._keys) > self.max_keys:
+                # Drop the least recently used key that has no call in flight
+                for old_key, old in self._keys.items():
+                    if old.waiting == 0 and old_key != key:
+                        del self._keys[old_key]
+                        break
+        else:
+            self._keys.move_to_end(key)
+        return stats
+
+    def tool_totals(self) -> Dict[str, Dict[str, int]]:
+        """Calls, executions and coalesced calls per tool, plus calls in flight and executions running."""
+        totals = {name: dict(counts) for name, counts in self._tools.items()}
+        for (name, _), task in self._inflight.items():
+            totals[name]["executions_in_flight"] = totals[name].get("executions_in_flight", 0) + 1
+        for (name, _), stats in self._keys.items():
+            totals[name]["calls_in_flight"] = totals[name].get("calls_in_flight", 0) + stats.waiting
+        return totals
+
+    def hot_keys(self, limit: int = 20) -> List[Dict]:
+        """Keys with the most coalesced calls, with their call, execution and peak concurrency counts."""
+        ranked = sorted(self._keys.items(), key=lambda item: item[1].calls - item[1].executions, reverse=True)
+        return [
+            {"tool": name, "arguments": json.loads(arguments), "calls": stats.calls, "executions": stats.executions,
+             "coalesced": stats.calls - stats.executions, "in_flight": stats.waiting,
+             "peak_concurrency": stats.peak_waiting}
+            for (name, arguments), stats in ranked[:limit]
+        ]
@@ -0,0 +1,317 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lab_trends import FLAG_NAMES, flag_code, parse_value
+from patient_store import day_ordinal
+
+
+def _container(rows: np.ndarray, size: int) -> np.ndarray:
+    """Patient row numbers as sorted int32s, or as a packed bitmap when that is smaller.
+
+    This is the container choice of roaring bitmaps: 4 bytes per member for
+    rare attributes, one bit per patient for common ones.
+    """
+    rows = np.unique(rows).astype(np.int32)
+    if len(rows) * 32 <= size:
+        return rows
+    mask = np.zeros(size, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask)
+
+
+def _or_into(mask: np.ndarray, container: np.ndarray):
+    if container.dtype == np.uint8:
+        bits = np.unpackbits(container, count=min(len(container) * 8, len(mask))).view(bool)
+        mask[:len(bits)] |= bits
+    else:
+        # Members added after ``mask`` was sized are not part of this query
+        mask[container[:np.searchsorted(container, len(mask))]] = True
+
+
+def _with_row(container: Optional[np.ndarray], row: int) -> np.ndarray:
+    """A copy of ``container`` with ``row`` added; published containers are never modified."""
+    if container is None:
+        return np.array([row], dtype=np.int32)
+    if container.dtype != np.uint8:
+        return np.union1d(container, np.array([row], dtype=np.int32)).astype(np.int32)
+    grown = np.zeros(max(len(container), row // 8 + 1), dtype=np.uint8)
+    grown[:len(container)] = container
+    grown[row // 8] |= 0x80 >> (row % 8)
+    return grown
+
+
+def _codes(values: Iterable[str], table: Dict[str, int], names: List[str], count: int) -> np.ndarray:
+    def code(value: str) -> int:
+        found = table.get(value)
+        if found is None:
+            found = table[value] = len(names)
+            names.append(value)
+        return found
+    return np.fromiter((code(value) for value in values), dtype=np.int32, count=count)
+
+
+class _LabRows:
+    """Lab rows reduced to what cohort predicates read, as parallel NumPy columns."""
+
+    __slots__ = ("test", "patient", "day", "flag", "value")
+
+    def __init__(self, test, patient, day, flag, value):
+        self.test, self.patient, self.day, self.flag, self.value = test, patient, day, flag, value
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    def take(self, index) -> "_LabRows":
+        return _LabRows(*(getattr(self, name)[index] for name in self.__slots__))
+
+
+class CohortIndex:
+    """Per-attribute patient bitmaps for multi-predicate cohort queries.
+
+    Patients are numbered in store order. Every distinct (condition,
+    status, severity) of a condition row and every (lab test, abnormal flag)
+    of a lab row maps to the set of patients having one, so condition and
+    "ever had" lab predicates are unions and intersections of precomputed
+    sets. Predicates on when a lab was collected or on its value scan the
+    lab rows of the requested tests, held sorted by test then day so a date
+    window is a contiguous slice.
+
+    Patient data is append-only, so updates only ever add patients to sets.
+    Labs added after the build are appended to extra rows that every lab scan
+    also reads, until the index is rebuilt from a compacted base.
+    """
+
+    def __init__(self):
+        self._patients: Dict[str, int] = {}
+        self._patient_ids: List[str] = []
+        self._condition_codes: Dict[str, int] = {}
+        self._condition_names: List[str] = []
+        self._status_codes: Dict[str, int] = {}
+        self._status_names: List[str] = []
+        self._severity_codes: Dict[str, int] = {}
+        self._severity_names: List[str] = []
+        self._test_codes: Dict[str, int] = {}
+        self._test_names: List[str] = []
+        # (condition, status, severity) -> patients; (test, flag) -> patients
+        self._condition_sets: Dict[Tuple[int, int, int], np.ndarray] = {}
+        self._lab_sets: Dict[Tuple[int, int], np.ndarray] = {}
+        self._labs = _LabRows(*(np.empty(0, dtype) for dtype in (np.int32, np.int32, np.int32, np.int8, np.float32)))
+        # Rows of test t are [_test_bounds[t], _test_bounds[t + 1]), sorted by day
+        self._test_bounds = np.zeros(1, dtype=np.int64)
+        # Extra rows live in a buffer with spare capacity; _extra is the published prefix
+        self._extra_buffer = self._labs
+        self._extra = self._labs
+        # Patient row -> labs of the patient's delta already in the extra rows
+        self._extra_counts: Dict[int, int] = {}
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store) -> "CohortIndex":
+        """Build from a PatientStore's columns without materializing row dicts."""
+        index = cls()
+        for patient_id in store.patient_ids():
+            index._patients[patient_id] = len(index._patient_ids)
+            index._patient_ids.append(patient_id)
+        size = len(index._patient_ids)
+
+        columns, offsets = store.condition_columns(("condition", "status", "severity"))
+        count = offsets[-1] if len(offsets) else 0
+        owners = np.repeat(np.arange(size, dtype=np.int32), np.diff(np.asarray(offsets, dtype=np.int64)))
+        keys = np.stack([
+            _codes((columns["condition"][i] for i in range(count)), index._condition_codes,
+                   index._condition_names, count),
+            _codes((columns["status"][i].lower() for i in range(count)), index._status_codes,
+                   index._status_names, count),
+            _codes((columns["severity"][i].lower() for i in range(count)), index._severity_codes,
+                   index._severity_names, count),
+        ], axis=1)
+        index._condition_sets = _group_sets(keys, owners, size)
+
+        columns, offsets, days = store.lab_columns(("test_name", "value", "abnormal_flag"))
+        count = len(days)
+        parsed: Dict[str, float] = {}
+        labs = _LabRows(
+            _codes((columns["test_name"][i] for i in range(count)), index._test_codes, index._test_names, count),
+            np.repeat(np.arange(size, dtype=np.int32), np.diff(np.asarray(offsets, dtype=np.int64))),
+            np.array(days, dtype=np.int32),
+            np.fromiter((flag_code(columns["abnormal_flag"][i]) for i in range(count)), dtype=np.int8, count=count),
+            np.fromiter((parsed[v] if v in parsed else parsed.setdefault(v, parse_value(v))
+                         for v in (columns["value"][i] for i in range(count))), dtype=np.float32, count=count),
+        )
+        index._lab_sets = _group_sets(np.stack([labs.test, labs.flag.astype(np.int32)], axis=1), labs.patient, size)
+        order = np.lexsort((labs.day, labs.test))
+        index._labs = labs.take(order)
+        index._test_bounds = np.searchsorted(index._labs.test, np.arange(len(index._test_names) + 1)).astype(np.int64)
+        index._extra_buffer = index._extra = index._labs.take(slice(0, 0))
+        return index
+
+    # ---------- Updates ----------
+
+    def add_patient(self, patient_id: str) -> int:
+        with self._write_lock:
+            return self._add_patient(patient_id)
+
+    def _add_patient(self, patient_id: str) -> int:
+        row = self._patients.get(patient_id)
+        if row is None:
+            # Row numbers are appended before the ID is visible, so readers never see an unnumbered patient
+            self._patient_ids.append(patient_id)
+            row = self._patients[patient_id] = len(self._patient_ids) - 1
+        return row
+
+    def refresh_conditions(self, patient_id: str, conditions: Sequence[Dict]):
+        """Add a patient's conditions (all of them; ones already indexed change nothing)."""
+        with self._write_lock:
+            row = self._add_patient(patient_id)
+            sets = dict(self._condition_sets)
+            for condition in conditions:
+                key = (
+                    int(_codes([condition.get("condition", "")], self._condition_codes, self._condition_names, 1)[0]),
+                    int(_codes([condition.get("status", "").lower()], self._status_codes, self._status_names, 1)[0]),
+                    int(_codes([condition.get("severity", "").lower()], self._severity_codes,
+                               self._severity_names, 1)[0]),
+                )
+                sets[key] = _with_row(sets.get(key), row)
+            # One assignment, so concurrent readers see either the old or the new sets
+            self._condition_sets = sets
+
+    def refresh_labs(self, patient_id: str, labs: Sequence[Dict]):
+        """Index a patient's labs missing from the base the index was built from, in arrival order.
+
+        Pass all of them each time; only those past the ones already indexed are added.
+        """
+        with self._write_lock:
+            row = self._add_patient(patient_id)
+            indexed = self._extra_counts.get(row, 0)
+            labs = labs[indexed:]
+            count = len(labs)
+            if count == 0:
+                return
+            rows = _LabRows(
+                _codes((lab.get("test_name", "") for lab in labs), self._test_codes, self._test_names, count),
+                np.full(count, row, dtype=np.int32),
+                np.fromiter((day_ordinal(str(lab.get("collection_date") or "")) for lab in labs),
+                            dtype=np.int32, count=count),
+                np.fromiter((flag_code(lab.get("abnormal_flag", "")) for lab in labs), dtype=np.int8, count=count),
+                np.fromiter((parse_value(lab.get("value", "")) for lab in labs), dtype=np.float32, count=count),
+            )
+            sets = dict(self._lab_sets)
+            for test, flag in set(zip(rows.test.tolist(), rows.flag.tolist())):
+                sets[(test, flag)] = _with_row(sets.get((test, flag)), row)
+            self._append_extra(rows)
+            self._extra_counts[row] = indexed + count
+            self._lab_sets = sets
+
+    def _append_extra(self, rows: _LabRows):
+        """Publish the extra rows with ``rows`` appended, growing the buffer geometrically."""
+        size = len(self._extra)
+        needed = size + len(rows)
+        buffer = self._extra_buffer
+        if needed > len(buffer):
+            capacity = max(needed, 2 * len(buffer), 1024)
+            grown = _LabRows(*(np.empty(capacity, getattr(buffer, name).dtype) for name in _LabRows.__slots__))
+            for name in _LabRows.__slots__:
+                getattr(grown, name)[:size] = getattr(buffer, name)[:size]
+            buffer = self._extra_buffer = grown
+        # Readers only see up to the published length, so writing past it is safe
+        for name in _LabRows.__slots__:
+            getattr(buffer, name)[size:needed] = getattr(rows, name)
+        self._extra = buffer.take(slice(0, needed))
+
+    # ---------- Queries ----------
+
+    def __len__(self) -> int:
+        return len(self._patient_ids)
+
+    def query(self, conditions: Optional[Iterable[str]] = None, status: Optional[str] = None,
+              severity: Optional[str] = None, lab_tests: Optional[Iterable[str]] = None,
+              flags: Optional[Iterable[str]] = None, since_day: Optional[int] = None,
+              value_min: Optional[float] = None, value_max: Optional[float] = None) -> np.ndarray:
+        """Boolean mask over patient rows of the patients matching every given predicate.
+
+        A patient matches the condition predicates through one condition row
+        (names containing any of ``conditions``, case-insensitive, with the given
+        status and severity) and the lab predicates through one lab row.
+        """
+        mask = np.ones(len(self._patient_ids), dtype=bool)
+        if conditions is not None or status is not None or severity is not None:
+            mask &= self._condition_mask(conditions, status, severity, len(mask))
+        if lab_tests is not None or flags is not None or since_day is not None \
+                or value_min is not None or value_max is not None:
+            mask &= self._lab_mask(lab_tests, flags, since_day, value_min, value_max, len(mask))
+        return mask
+
+    def patient_ids(self, mask: np.ndarray, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        rows = np.flatnonzero(mask)
+        rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+        return [self._patient_ids[row] for row in rows.tolist()]
+
+    def _condition_mask(self, conditions, status, severity, size: int) -> np.ndarray:
+        matches = _matching(self._condition_names, conditions)
+        statuses = None if status is None else {self._status_codes.get(status.lower(), -1)}
+        severities = None if severity is None else {self._severity_codes.get(severity.lower(), -1)}
+        mask = np.zeros(size, dtype=bool)
+        for (condition, status_code, severity_code), patients in self._condition_sets.items():
+            if (matches is None or condition in matches) and (statuses is None or status_code in statuses) \
+                    and (severities is None or severity_code in severities):
+                _or_into(mask, patients)
+        return mask
+
+    def _lab_mask(self, lab_tests, flags, since_day, value_min, value_max, size: int) -> np.ndarray:
+        tests = _matching(self._test_names, lab_tests)
+        flag_codes = None if flags is None else {FLAG_NAMES.index(flag) for flag in flags}
+        mask = np.zeros(size, dtype=bool)
+        if since_day is None and value_min is None and value_max is None:
+            # "Ever had" predicates are answered from the sets alone
+            for (test, flag), patients in self._lab_sets.items():
+                if (tests is None or test in tests) and (flag_codes is None or flag in flag_codes):
+                    _or_into(mask, patients)
+            return mask
+
+        blocks = []
+        labs, bounds = self._labs, self._test_bounds
+        for test in (range(len(bounds) - 1) if tests is None else tests):
+            if test + 1 < len(bounds):
+                start, end = int(bounds[test]), int(bounds[test + 1])
+                if since_day is not None:
+                    start += int(np.searchsorted(labs.day[start:end], since_day))
+                blocks.append(labs.take(slice(start, end)))
+        extra = self._extra
+        keep = np.ones(len(extra), dtype=bool) if tests is None else np.isin(extra.test, list(tests))
+        if since_day is not None:
+            keep &= extra.day >= since_day
+        blocks.append(extra.take(keep))
+        for rows in blocks:
+            keep = np.ones(len(rows), dtype=bool)
+            if flag_codes is not None:
+                keep &= np.isin(rows.flag, list(flag_codes))
+            # Text results have nan values, which no bound matches
+            # Bounds are compared at the column's float32 precision, so "7.2" matches a stored 7.2
+            if value_min is not None:
+                keep &= rows.value >= np.float32(value_min)
+            if value_max is not None:
+                keep &= rows.value <= np.float32(value_max)
+            patients = rows.patient[keep]
+            mask[patients[patients < size]] = True
+        return mask
+
+
+def _matching(names: List[str], needles: Optional[Iterable[str]]) -> Optional[set]:
+    """Codes of names containing any needle (case-insensitive); None matches everything."""
+    if needles is None:
+        return None
+    needles = [needle.lower() for needle in needles]
+    return {code for code, name in enumerate(list(names)) if any(needle in name.lower() for needle in needles)}
+
+
+def _group_sets(keys: np.ndarray, owners: np.ndarray, size: int) -> Dict[Tuple[int, ...], np.ndarray]:
+    """Patient set per distinct key row."""
+    if len(owners) == 0:
+        return {}
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind="stable")
+    starts = np.searchsorted(inverse.ravel()[order], np.arange(len(unique) + 1))
+    return {tuple(int(v) for v in key): _container(owners[order[starts[i]:starts[i + 1]]], size)
+            for i, key in enumerate(unique)}
@@ -0,0 +1,133 @@
+import json
+from typing import Any, Dict, List
+
+# Short keys used in compact responses
+KEY_ABBREVIATIONS = {
+    "patient_id": "id",
+    "date_of_birth": "dob",
+    "gender": "sex",
+    "medical_history": "history",
+    "condition": "cond",
+    "diagnosis_date": "dx",
+    "severity": "sev",
+    "provider": "prov",
+    "ordering_provider": "prov",
+    "test_name": "test",
+    "value": "val",
+    "reference_range": "ref",
+    "abnormal_flag": "flag",
+    "collection_date": "date",
+    "result_date": "res",
+    "status": "st",
+    "lab_results": "labs",
+    "recent_lab_results": "labs",
+    "active_conditions": "active",
+    "total_results": "total",
+    "total_conditions": "n_cond",
+    "total_found": "found",
+}
+
+# Free text that the model rarely needs; the full format still returns it
+OMITTED_FIELDS = {"notes"}
+
+
+def _key(name: str) -> str:
+    return KEY_ABBREVIATIONS.get(name, name)
+
+
+def compact(value: Any) -> Any:
+    """Compact encoding of a tool response.
+
+    Lists of records become {"cols": [...], "rows": [[...]]} tables. Columns
+    holding one value in every row move to "same", empty columns and result
+    dates equal to the collection date are dropped, and keys are abbreviated.
+    """
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        return _table(value)
+    if isinstance(value, dict):
+        return {
+            _key(key): compact(item)
+            for key, item in value.items()
+            if key not in OMITTED_FIELDS and item not in ("", None)
+        }
+    return value
+
+
+def _table(records: List[Dict]) -> Dict:
+    fields = [field for field in dict.fromkeys(key for record in records for key in record)
+              if field not in OMITTED_FIELDS]
+    columns = {field: [record.get(field) for record in records] for field in fields}
+    if "result_date" in columns and columns["result_date"] == columns.get("collection_date"):
+        del columns["result_date"]
+
+    same = {}
+    for field in list(columns):
+        values = columns[field]
+        if all(value in ("", None) for value in values):
+            del columns[field]
+        elif len(records) > 1 and all(value == values[0] for value in values):
+            same[_key(field)] = compact(values[0])
+            del columns[field]
+
+    table = {
+        "cols": [_key(field) for field in columns],
+        "rows": [[compact(value) for value in row] for row in zip(*columns.values())],
+    }
+    if same:
+        table["same"] = same
+    return table
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def approx_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def measure_savings(full_text: str, compact_text: str) -> Dict:
+    """Byte and approximate token savings of a compact response over its full form."""
+    full_bytes = len(full_text.encode("utf-8"))
+    compact_bytes = len(compact_text.encode("utf-8"))
+    return {
+        "full_bytes": full_bytes,
+        "compact_bytes": compact_bytes,
+        "saved_pct": round(100 * (1 - compact_bytes / full_bytes), 1) if full_bytes else 0.0,
+        "approx_tokens_saved": approx_tokens(full_text) - approx_tokens(compact_text),
+    }
+
+
+if __name__ == "__main__":
+    # Report savings for every data tool against the configured patient data
+    import asyncio
+
+    import pydantic_core
+    from mcp.types import CallToolResult
+
+    import mcpserver
+
+    mcpserver.init_data()
+    patient_ids = list(mcpserver.store.patient_ids())[:mcpserver.MAX_BULK_PATIENTS]
+    calls = {
+        "get_patient_info": {"patient_id": patient_ids[0]},
+        "get_patient_history": {"patient_id": patient_ids[0]},
+        "get_lab_results": {"patient_id": patient_ids[0], "days_back": 3650},
+        "get_patient_summary": {"patient_id": patient_ids[0], "include_labs_days": 3650},
+        "search_patients": {"query": mcpserver.store.get_patient(patient_ids[0])["name"].split()[0]},
+        "get_patients_bulk": {"patient_ids": patient_ids},
+        "get_lab_results_bulk": {"patient_ids": patient_ids, "days_back": 3650},
+        "screen_population_risk": {"patient_ids": patient_ids, "include_labs_days": 3650},
+    }
+    print(f"{'tool':<24}{'full B':>10}{'compact B':>11}{'saved':>8}{'~tokens saved':>15}")
+    for tool, arguments in calls.items():
+        full = asyncio.run(getattr(mcpserver, tool)(**arguments, format="full"))
+        compact_result = asyncio.run(getattr(mcpserver, tool)(**arguments, format="compact"))
+        # Coalesced tools return the text FastMCP sends; others a dict it sends as indented JSON
+        if isinstance(full, CallToolResult):
+            full_text = full.content[0].text
+        else:
+            full_text = pydantic_core.to_json(full, indent=2).decode()
+        savings = measure_savings(full_text, compact_result.content[0].text)
+        print(f"{tool:<24}{savings['full_bytes']:>10}{savings['compact_bytes']:>11}"
+              f"{savings['saved_pct']:>7}%{savings['approx_tokens_saved']:>15}")
@@ -0,0 +1,184 @@
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+from strands.agent.conversation_manager import ConversationManager
+from strands.types.exceptions import ContextWindowOverflowException
+
+# Rough size of a token in characters of serialized message JSON
+CHARS_PER_TOKEN = 4
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+ELIDED_PREFIX = "[Earlier "
+# Oldest summary lines are dropped beyond this, so the summary itself stays bounded
+MAX_SUMMARY_LINES = 20
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    return sum(len(json.dumps(message, default=str)) for message in messages) // CHARS_PER_TOKEN
+
+
+def _text_of(message: Dict) -> str:
+    return " ".join(block["text"] for block in message.get("content", []) if "text" in block).strip()
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def extractive_summary(turns: List[List[Dict]]) -> str:
+    """Summarize turns without a model call: each question, the tools used and the start of the answer."""
+    lines = [SUMMARY_PREFIX]
+    for turn in turns:
+        question = _text_of(turn[0])
+        if question.startswith(SUMMARY_PREFIX):
+            # Fold in the summary produced by an earlier pass as-is
+            lines.extend(question[len(SUMMARY_PREFIX):].strip().splitlines())
+            continue
+        tools = [
+            f"{block['toolUse']['name']}({json.dumps(block['toolUse'].get('input', {}), default=str)})"
+            for message in turn for block in message.get("content", []) if "toolUse" in block
+        ]
+        answer = _text_of(turn[-1]) if turn[-1]["role"] == "assistant" else ""
+        line = f"- Clinician asked: {_clip(question, 200)}"
+        if tools:
+            line += f" | tools: {', '.join(dict.fromkeys(tools))}"
+        if answer:
+            line += f" | answer began: {_clip(answer, 300)}"
+        lines.append(line)
+    return "\n".join([lines[0]] + lines[1:][-MAX_SUMMARY_LINES:])
+
+
+class TokenBudgetConversationManager(ConversationManager):
+    """Keeps the prompt resent on every turn within a token budget.
+
+    After each turn, while the history is over budget it is shrunk step by
+    step: tool results outside the most recent turns are replaced by short
+    references; failing that, older turns are folded into one summary, made
+    from their original content, and tool results of recent turns other than
+    the last one are elided; then recent turns but the last are folded into
+    the summary too; and finally the newest tool results are truncated.
+    toolUse/toolResult pairs are never split.
+    """
+
+    def __init__(self, token_budget: int = 8000, keep_recent_turns: int = 3,
+                 summarizer: Optional[Callable[[List[List[Dict]]], str]] = None):
+        super().__init__()
+        self.token_budget = token_budget
+        self.keep_recent_turns = max(keep_recent_turns, 1)
+        self.summarizer = summarizer or extractive_summary
+
+    def apply_management(self, agent: Any, **kwargs: Any) -> None:
+        self._shrink(agent.messages, self.keep_recent_turns)
+
+    def reduce_context(self, agent: Any, e: Optional[Exception] = None, **kwargs: Any) -> None:
+        before = estimate_tokens(agent.messages)
+        self._shrink(agent.messages, 1, force=True)
+        if e is not None and estimate_tokens(agent.messages) >= before:
+            raise ContextWindowOverflowException("Unable to reduce the conversation any further") from e
+
+    def get_state(self) -> Dict[str, Any]:
+        state = super().get_state()
+        state.update(token_budget=self.token_budget, keep_recent_turns=self.keep_recent_turns)
+        return state
+
+    # ---------- Shrinking ----------
+
+    def _shrink(self, messages: List[Dict], keep_turns: int, force: bool = False):
+        if not force and estimate_tokens(messages) <= self.token_budget:
+            return
+        turns = self._split_turns(messages)
+        old, recent = turns[:-keep_turns], turns[-keep_turns:]
+
+        # Elision works on copies, so a summary is always made from the original tool results
+        elided_old = [self._elided(turn) for turn in old]
+        if self._fits(elided_old, recent) and not force:
+            self._replace(messages, elided_old + recent)
+            return
+
+        summarized = self._summarized(old)
+        if not self._fits(summarized, recent):
+            recent = [self._elided(turn) for turn in recent[:-1]] + recent[-1:]
+        if not self._fits(summarized, recent) and len(recent) > 1:
+            # Still over budget: only the last turn stays verbatim
+            old, recent = old + recent[:-1], recent[-1:]
+            summarized = self._summarized(old)
+        if not self._fits(summarized, recent):
+            recent = recent[:-1] + [self._truncated(recent[-1], summarized + recent[:-1])]
+
+        if summarized is not old:
+            self.removed_message_count += sum(
+                len(turn) for turn in old if not _text_of(turn[0]).startswith(SUMMARY_PREFIX)
+            )
+        self._replace(messages, summarized + recent)
+
+    def _summarized(self, old: List[List[Dict]]) -> List[List[Dict]]:
+        """One summary turn standing in for ``old``, which is returned as-is when it is already just that."""
+        if not old or (len(old) == 1 and _text_of(old[0][0]).startswith(SUMMARY_PREFIX)):
+            return old
+        summary = {"role": "user", "content": [{"text": self.summarizer(old)}]}
+        # The assistant reply keeps roles alternating
+        return [[summary, {"role": "assistant", "content": [{"text": "Noted."}]}]]
+
+    def _fits(self, old: List[List[Dict]], recent: List[List[Dict]]) -> bool:
+        return estimate_tokens([m for turn in old + recent for m in turn]) <= self.token_budget
+
+    def _truncated(self, turn: List[Dict], before: List[List[Dict]]) -> List[Dict]:
+        """``turn`` with its newest tool results cut down until the whole history fits the budget."""
+        turn = [{**message, "content": list(message.get("content", []))} for message in turn]
+        for message in reversed(turn):
+            for i in reversed(range(len(message["content"]))):
+                excess = estimate_tokens([m for t in before + [turn] for m in t]) - self.token_budget
+                if excess <= 0:
+                    return turn
+                result = message["content"][i].get("toolResult")
+                if result is None:
+                    continue
+                text = json.dumps(result.get("content", []), default=str)
+                keep = max(len(text) - excess * CHARS_PER_TOKEN - 200, 200)
+                if keep >= len(text):
+                    continue
+                message["content"][i] = {"toolResult": {**result, "content": [{
+                    "text": f"{text[:keep]} [truncated, {len(text) - keep} more bytes removed to save context]"
+                }]}}
+        return turn
+
+    @staticmethod
+    def _replace(messages: List[Dict], turns: List[List[Dict]]):
+        messages[:] = [message for turn in turns for message in turn]
+
+    @staticmethod
+    def _split_turns(messages: List[Dict]) -> List[List[Dict]]:
+        """Group messages into turns, each starting at a user message that is not a tool result."""
+        turns: List[List[Dict]] = []
+        for message in messages:
+            starts_turn = message["role"] == "user" and not any(
+                "toolResult" in block for block in message.get("content", [])
+            )
+            if starts_turn or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    @staticmethod
+    def _elided(turn: List[Dict]) -> List[Dict]:
+        """A copy of ``turn`` with its tool results replaced by short references."""
+        calls = {
+            block["toolUse"]["toolUseId"]: block["toolUse"]
+            for message in turn for block in message.get("content", []) if "toolUse" in block
+        }
+        elided = []
+        for message in turn:
+            content = []
+            for block in message.get("content", []):
+                result = block.get("toolResult")
+                if result is not None and not _text_of(result).startswith(ELIDED_PREFIX):
+                    call = calls.get(result["toolUseId"], {})
+                    size = len(json.dumps(result.get("content", []), default=str))
+                    arguments = json.dumps(call.get("input", {}), default=str)
+                    block = {"toolResult": {**result, "content": [{
+                        "text": f"{ELIDED_PREFIX}{call.get('name', 'tool')}({arguments}) result, {size} bytes, "
+                                "removed to save context. Call the tool again if you need it.]"
+                    }]}}
+                content.append(block)
+            elided.append({**message, "content": content})
+        return elided
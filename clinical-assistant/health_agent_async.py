@@ -1,12 +1,22 @@
 import logging
 import asyncio
 import os
+import queue
+import re
+import threading
+import time
+import weakref
 from strands import Agent
+from strands.hooks import AfterInvocationEvent, BeforeInvocationEvent, HookProvider
 from strands.models.openai import OpenAIModel
-from strands.tools.mcp import MCPClient
-from mcp.client.streamable_http import streamablehttp_client
+from strands.tools.executors import ConcurrentToolExecutor, SequentialToolExecutor
 import mlflow
 
+import trace_export
+from conversation import TokenBudgetConversationManager
+from mcp_pool import MCPConnectionPool, PrefetchedResults
+from response_cache import DataVersionClient, ResponseCache, last_turn, prompt_patient_ids
+
 # Load environment variables from .env file
 #load_dotenv()
 
@@ -18,20 +28,35 @@ logging.basicConfig(
 )
 
 
+_tracing_configured = False
+_tracing_enabled = None
+_tracing_lock = threading.Lock()
+
+
 def setup_mlflow_tracing():
-    """Configure MLflow tracing"""
-    mlflow_tracking_uri = os.environ.get("MLFLOW_TRACKING_URI", "http://mlflow:80")
+    """Configure MLflow tracing once per process"""
+    global _tracing_configured, _tracing_enabled
+    with _tracing_lock:
+        if _tracing_configured:
+            return _tracing_enabled
+        _tracing_configured = True
+        if os.environ.get("MLFLOW_TRACING", "1") == "0":
+            return _tracing_enabled
 
-    try:
-        mlflow.set_tracking_uri(mlflow_tracking_uri)
-        mlflow.set_experiment("clinical-assistant")
-        mlflow.strands.autolog()
-        print("✅ MLflow tracing enabled successfully!")
-        return True
-    except Exception as e:
-        print(f"⚠️  Failed to setup MLflow tracing: {e}")
-        print("   Continuing without tracing...")
-        return None
+        mlflow_tracking_uri = os.environ.get("MLFLOW_TRACKING_URI", "http://mlflow:80")
+
+        try:
+            # Traces are exported from a background queue so a slow tracking server never stalls a turn
+            trace_export.install(mlflow_tracking_uri)
+            mlflow.set_tracking_uri(mlflow_tracking_uri)
+            mlflow.set_experiment("clinical-assistant")
+            mlflow.strands.autolog()
+            print("✅ MLflow tracing enabled successfully!")
+            _tracing_enabled = True
+        except Exception as e:
+            print(f"⚠️  Failed to setup MLflow tracing: {e}")
+            print("   Continuing without tracing...")
+        return _tracing_enabled
 
 openai_model = OpenAIModel(
     client_args={
@@ -43,26 +68,98 @@ openai_model = OpenAIModel(
     params={"temperature": 0.3, "max_tokens": 2048}
 )
 
+_mcp_pool = None
+_mcp_pool_lock = threading.Lock()
+
+
+def get_mcp_pool():
+    """Get or create the process-wide pool of MCP healthcare server sessions."""
+    global _mcp_pool
+    with _mcp_pool_lock:
+        if _mcp_pool is None:
+            _mcp_pool = MCPConnectionPool(
+                os.environ.get("MCP_HOST", "http://healthcare-mcp-server:8000/mcp"),
+                size=int(os.environ.get("MCP_POOL_SIZE", "4")),
+                keepalive_seconds=float(os.environ.get("MCP_KEEPALIVE_SECONDS", "30")),
+            )
+    return _mcp_pool
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Get or create the process-wide response cache, or None when RESPONSE_CACHE_SIZE is 0."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None and int(os.environ.get("RESPONSE_CACHE_SIZE", "512")) > 0:
+            _response_cache = ResponseCache(
+                DataVersionClient(os.environ.get("MCP_HOST", "http://healthcare-mcp-server:8000/mcp")),
+                maxsize=int(os.environ.get("RESPONSE_CACHE_SIZE", "512")),
+                ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "600")),
+                # e.g. sentence-transformers/all-MiniLM-L6-v2 to also match reworded questions
+                embedding_model=os.environ.get("RESPONSE_CACHE_EMBEDDING_MODEL") or None,
+                similarity_threshold=float(os.environ.get("RESPONSE_CACHE_SIMILARITY", "0.92")),
+            )
+    return _response_cache
+
+
+# Tool calls made for each patient named in a question, started before the model asks for them
+PREFETCH_TOOLS = ("get_patient_info", "get_patient_history", "get_lab_results")
+PREFETCH_MAX_PATIENTS = int(os.environ.get("PREFETCH_MAX_PATIENTS", "5"))
+
+
+class PatientPrefetchHook(HookProvider):
+    """Starts fetching the patient bundle for patient IDs in the question while the model is still thinking."""
+
+    def __init__(self, prefetched: PrefetchedResults):
+        self.prefetched = prefetched
+
+    def register_hooks(self, registry, **kwargs):
+        registry.add_callback(BeforeInvocationEvent, self.start)
+        registry.add_callback(AfterInvocationEvent, self.finish)
+
+    def start(self, event: BeforeInvocationEvent):
+        question = " ".join(
+            block["text"] for message in event.messages or [] if message["role"] == "user"
+            for block in message.get("content", []) if "text" in block
+        )
+        patient_ids = prompt_patient_ids(question)[:PREFETCH_MAX_PATIENTS]
+        self.prefetched.start((tool, {"patient_id": pid}) for pid in patient_ids for tool in PREFETCH_TOOLS)
+
+    def finish(self, event: AfterInvocationEvent):
+        # Prefetches the model did not use are dropped, never served in a later turn
+        self.prefetched.clear()
+
+
 def create_health_agent():
     """Create the health agent with MCP healthcare data server connection and MLflow tracing"""
     
-    mcp_host = os.environ.get("MCP_HOST", "http://healthcare-mcp-server:8000/mcp")
-    
     # Setup MLflow tracing
     setup_mlflow_tracing()
     
-    # Connect to the MCP healthcare server using streamable HTTP client
-    mcp_client = MCPClient(lambda: streamablehttp_client(mcp_host))
+    # Tool definitions are fetched once per process; each tool call borrows a pooled MCP session,
+    # so independent calls the model makes together run concurrently on separate sessions
+    pool = get_mcp_pool()
+    mcp_client = pool.acquire()
+    prefetched = PrefetchedResults(pool)
+    tools = pool.pooled_tools(mcp_client.client, prefetched)
+    parallel_tools = os.environ.get("AGENT_PARALLEL_TOOLS", "1") == "1"
+    prefetch = os.environ.get("AGENT_PREFETCH", "1") == "1"
     
-    # Get tools from the MCP server
-    with mcp_client:
-        tools = mcp_client.list_tools_sync()
-        
-        # Create the health agent with MCP tools
-        health_agent = Agent(
-            model=openai_model,
-            tools=tools,
-            system_prompt="""You are a Clinical Decision Support AI Assistant with access to patient data through an MCP healthcare data server. You help healthcare professionals with diagnostic reasoning and clinical decision-making.
+    # Create the health agent with MCP tools
+    health_agent = Agent(
+        model=openai_model,
+        tools=tools,
+        tool_executor=ConcurrentToolExecutor() if parallel_tools else SequentialToolExecutor(),
+        hooks=[PatientPrefetchHook(prefetched)] if prefetch else None,
+        # Bound the history resent to the model on every turn
+        conversation_manager=TokenBudgetConversationManager(
+            token_budget=int(os.environ.get("CONVERSATION_TOKEN_BUDGET", "8000")),
+            keep_recent_turns=int(os.environ.get("CONVERSATION_RECENT_TURNS", "3")),
+        ),
+        system_prompt="""You are a Clinical Decision Support AI Assistant with access to patient data through an MCP healthcare data server. You help healthcare professionals with diagnostic reasoning and clinical decision-making.
 
 Your role is to:
 - Provide evidence-based clinical insights and differential diagnoses
@@ -76,8 +173,21 @@ Available Healthcare Data Tools (via MCP server at http://localhost:8000):
 - get_patient_info: Retrieve patient demographics (use patient IDs: PAT001, PAT002, PAT003)
 - get_patient_history: Get complete medical history including conditions and diagnoses
 - get_lab_results: Retrieve lab results within specified timeframes
-- search_patients: Find patients by name or ID
+- search_patients: Find patients by name, ID or condition (e.g. "diabetes")
 - get_patient_summary: Get comprehensive patient overview with risk assessment
+- get_patients_bulk: Demographics and medical history for many patients in one call
+- get_lab_results_bulk: Lab results for many patients in one call
+- screen_population_risk: Risk factor counts and at-risk patients across a group or the whole population
+- get_lab_trends: Per-test slope, rolling mean, out-of-range counts and flag changes for a patient or a cohort
+- query_cohort: Count and list patients matching condition and lab criteria (e.g. active diabetics with HbA1c above 7 in the last 90 days)
+
+For questions about several patients or a cohort, use the bulk tools with all patient IDs in a single call instead of calling the per-patient tools once per patient.
+
+Request independent tool calls together in one response (e.g. get_patient_info, get_patient_history and get_lab_results for a patient); they run in parallel.
+
+Every tool accepts format="compact", which returns the same data in fewer tokens: lists of records become tables with "cols" and "rows", values shared by every row are listed once under "same", keys are abbreviated (e.g. "id" for patient_id, "dob" for date_of_birth, "labs" for lab results, "ref" for reference range) and free-text notes are omitted. Use it for large or multi-patient requests, and the default format when you need the notes.
+
+Long lab histories come in pages. When get_lab_results returns a next_cursor (or get_patient_summary a labs_next_cursor), call get_lab_results with cursor set to it for the next page. Fetch further pages only when the question needs them.
 
 Important Guidelines:
 - Always emphasize that your recommendations are for clinical decision support only
@@ -98,52 +208,115 @@ You should provide structured, clear responses that include:
 7. Red flags or urgent concerns to monitor
 
 Remember: You are a support tool for healthcare professionals, not a replacement for clinical judgment. Use the MCP healthcare data server tools to access patient information when needed."""
-        )
-        
-        return health_agent, mcp_client
+    )
+    # Unpin the session when the agent is garbage collected, unless the caller releases it first
+    weakref.finalize(health_agent, mcp_client.release)
+    
+    return health_agent, mcp_client
 
 
 # Cache agent and mcp_client at module level
-_health_agent = None
-_mcp_client = None
+def warm_up():
+    """Set up the resources every session shares: tracing, the MCP session pool, tool definitions
+    and the response cache.
+
+    After this, create_health_agent() only builds a new Agent holding conversation state.
+    """
+    setup_mlflow_tracing()
+    pool = get_mcp_pool()
+    pool.tool_specs()
+    get_response_cache()
+    return pool
+
 
+# Streamed tokens are pushed to the UI at most this often, or after this many tokens
+STREAM_FLUSH_SECONDS = float(os.environ.get("STREAM_FLUSH_MS", "50")) / 1000
+STREAM_FLUSH_TOKENS = int(os.environ.get("STREAM_FLUSH_TOKENS", "64"))
 
-def get_health_agent():
-    """Get or create the health agent singleton."""
-    global _health_agent, _mcp_client
-    if _health_agent is None:
-        _health_agent, _mcp_client = create_health_agent()
-    return _health_agent, _mcp_client
+_agent_loop = None
+_agent_loop_lock = threading.Lock()
+_STREAM_END = object()
+
+
+def get_agent_loop():
+    """Get or create the process-wide event loop that every agent turn runs on."""
+    global _agent_loop
+    with _agent_loop_lock:
+        if _agent_loop is None:
+            _agent_loop = asyncio.new_event_loop()
+            threading.Thread(target=_agent_loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return _agent_loop
 
 
 def run_health_agent(question, st, health_agent, mcp_client):
     message_placeholder = st.empty()
     full_response = ""
+    chunks = queue.Queue()
+    failed = threading.Event()
 
-    async def process_streaming_response():
-        nonlocal full_response
+    cache = get_response_cache()
+    model_id = health_agent.model.get_config()["model_id"]
+    cacheable = cache is not None and cache.cacheable(question, health_agent.messages)
 
+    async def process_streaming_response():
         try:
-            # Keep the MCP client connection alive during the session
-            with mcp_client:
-                try:
-                    # Stream the response
-                    agent_stream = health_agent.stream_async(question)
-                    async for event in agent_stream:
-                        if "data" in event:
-                            full_response += event["data"]
-                            message_placeholder.markdown(full_response)
-                except Exception as e:
-                    print(f"Error processing request: {e}")
+            # Stream the response
+            agent_stream = health_agent.stream_async(question)
+            async for event in agent_stream:
+                if "data" in event:
+                    chunks.put(event["data"])
         except Exception as e:
+            failed.set()
             print(f"Error processing request: {e}")
-            message_placeholder.markdown(
-                "Sorry, an error occurred while generating the response."
-            )
-            print(f"Error processing request: {e}")
+        finally:
+            chunks.put(_STREAM_END)
 
-    asyncio.run(process_streaming_response())
+    try:
+        cached = cache.lookup(model_id, question) if cacheable else None
+        if cached is not None:
+            print("⚡ Serving response from cache")
+            # Replay the cached answer through the same rendering path as a live stream
+            for chunk in re.findall(r"\s*\S+", cached):
+                chunks.put(chunk)
+            chunks.put(_STREAM_END)
+            health_agent.messages.extend([
+                {"role": "user", "content": [{"text": question}]},
+                {"role": "assistant", "content": [{"text": cached}]},
+            ])
+            health_agent.conversation_manager.apply_management(health_agent)
+        else:
+            before = cache.snapshot() if cacheable else None
+            # Tool calls borrow pooled MCP sessions as they run
+            asyncio.run_coroutine_threadsafe(process_streaming_response(), get_agent_loop())
 
-    return full_response
+        # Re-render in batches: every token would redraw the whole, growing answer
+        pending = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                chunk = chunks.get(timeout=STREAM_FLUSH_SECONDS)
+            except queue.Empty:
+                chunk = None
+            if chunk is _STREAM_END:
+                break
+            if chunk:
+                pending.append(chunk)
+            if pending and (len(pending) >= STREAM_FLUSH_TOKENS
+                            or time.monotonic() - last_flush >= STREAM_FLUSH_SECONDS):
+                full_response += "".join(pending)
+                pending.clear()
+                message_placeholder.markdown(full_response)
+                last_flush = time.monotonic()
+
+        full_response += "".join(pending)
+        message_placeholder.markdown(full_response)
 
+        if cacheable and cached is None and full_response and not failed.is_set():
+            cache.store(model_id, question, full_response, last_turn(health_agent.messages), before)
+    except Exception as e:
+        print(f"Error processing request: {e}")
+        message_placeholder.markdown(
+            "Sorry, an error occurred while generating the response."
+        )
 
+    return full_response
@@ -0,0 +1,371 @@
+import math
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from patient_store import day_ordinal
+
+# Abnormal flags as small integer codes; anything other than blank/N, H or L counts as "A"
+FLAG_NAMES = ("N", "H", "L", "A")
+_FLAG_CODES = {"": 0, "N": 0, "H": 1, "L": 2}
+
+_RANGE_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[-–]\s*(-?\d+(?:\.\d+)?)")
+_BOUND_RE = re.compile(r"^\s*(<=|>=|≤|≥|<|>)\s*(-?\d+(?:\.\d+)?)")
+_NUMBER_RE = re.compile(r"^\s*(?:<=|>=|≤|≥|<|>)?\s*(-?\d+(?:\.\d+)?)")
+
+DAYS_PER_YEAR = 365.25
+
+
+def parse_reference_range(text: str) -> Tuple[float, float]:
+    """(low, high) of a free-text range: "70-100", "<5.7" (no lower bound), ">40" (no upper bound).
+
+    Missing bounds are -inf/inf; unparseable ranges are (nan, nan), which no value falls outside of.
+    """
+    text = text or ""
+    match = _RANGE_RE.match(text)
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    match = _BOUND_RE.match(text)
+    if match:
+        bound = float(match.group(2))
+        return (-math.inf, bound) if match.group(1) in ("<", "<=", "≤") else (bound, math.inf)
+    return math.nan, math.nan
+
+
+def parse_value(text: str) -> float:
+    """Numeric lab value; censored values such as "<0.1" read as the bound, text results as nan."""
+    match = _NUMBER_RE.match(text or "")
+    return float(match.group(1)) if match else math.nan
+
+
+def flag_code(flag: str) -> int:
+    """Index of an abnormal flag in FLAG_NAMES."""
+    return _FLAG_CODES.get(flag, 3)
+
+
+def _encode(values: Iterable[str], table: Dict[str, int], count: int) -> np.ndarray:
+    """Integer codes of strings, adding unseen strings to ``table``."""
+    return np.fromiter((table.setdefault(value, len(table)) for value in values), dtype=np.int32, count=count)
+
+
+class _Rows:
+    """Parallel columns of lab rows: day ordinal, numeric value, range/unit codes and flag code."""
+
+    __slots__ = ("day", "value", "range", "unit", "flag", "patient")
+
+    def __init__(self, day, value, range_, unit, flag, patient):
+        self.day, self.value, self.range, self.unit, self.flag, self.patient = day, value, range_, unit, flag, patient
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    def take(self, index) -> "_Rows":
+        return _Rows(self.day[index], self.value[index], self.range[index], self.unit[index],
+                     self.flag[index], self.patient[index])
+
+    @staticmethod
+    def concat(parts: List["_Rows"]) -> "_Rows":
+        return _Rows(*(np.concatenate([getattr(part, name) for part in parts]) for name in _Rows.__slots__))
+
+
+class LabTrendIndex:
+    """Numeric lab results grouped by (test, patient), for vectorized trend statistics.
+
+    Values and reference ranges are parsed once at build time. Rows are sorted
+    by test, then patient, then collection day into flat NumPy columns, so one
+    patient's series for a test is a contiguous slice (an array view) and every
+    patient's series for a test is one contiguous block. Patients whose labs
+    change later are re-parsed into per-patient overrides that replace their
+    rows in the flat columns.
+    """
+
+    def __init__(self):
+        self._tests: Dict[str, int] = {}
+        self._ranges: Dict[str, int] = {}
+        self._units: Dict[str, int] = {}
+        self._patients: Dict[str, int] = {}
+        self._rows = _Rows(*(np.empty(0, dtype) for dtype in (np.int32, np.float64, np.int32, np.int32,
+                                                               np.int8, np.int32)))
+        # Rows of test t are [_test_bounds[t], _test_bounds[t + 1]), sorted by patient then day
+        self._test_bounds = np.zeros(1, dtype=np.int64)
+        self._overrides: Dict[int, Dict[int, _Rows]] = {}
+        self._range_bounds = np.empty((0, 2))
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store) -> "LabTrendIndex":
+        index = cls()
+        columns, offsets, days = store.lab_columns(("test_name", "value", "reference_range", "unit", "abnormal_flag"))
+        for patient_id in store.patient_ids():
+            index._patients[patient_id] = len(index._patients)
+        count = len(days)
+        tests = _encode((columns["test_name"][i] for i in range(count)), index._tests, count)
+        rows = _Rows(
+            np.array(days, dtype=np.int32),
+            index._parse_values((columns["value"][i] for i in range(count)), count),
+            _encode((columns["reference_range"][i] for i in range(count)), index._ranges, count),
+            _encode((columns["unit"][i] for i in range(count)), index._units, count),
+            np.fromiter((flag_code(columns["abnormal_flag"][i]) for i in range(count)),
+                        dtype=np.int8, count=count),
+            np.repeat(np.arange(len(index._patients), dtype=np.int32), np.diff(np.asarray(offsets, dtype=np.int64))),
+        )
+        # Store rows are already grouped by patient and sorted by day, so a stable sort on test suffices
+        order = np.argsort(tests, kind="stable")
+        index._rows = rows.take(order)
+        index._test_bounds = np.searchsorted(tests[order], np.arange(len(index._tests) + 1)).astype(np.int64)
+        index._refresh_names()
+        return index
+
+    @staticmethod
+    def _parse_values(values: Iterable[str], count: int) -> np.ndarray:
+        parsed: Dict[str, float] = {}
+        return np.fromiter(
+            (parsed[v] if v in parsed else parsed.setdefault(v, parse_value(v)) for v in values),
+            dtype=np.float64, count=count,
+        )
+
+    def _refresh_names(self):
+        self._range_bounds = np.array([parse_reference_range(text) for text in self._ranges], dtype=np.float64
+                                      ).reshape(-1, 2)
+        self._range_names = list(self._ranges)
+        self._unit_names = list(self._units)
+        self._test_names = list(self._tests)
+
+    def refresh_patient(self, patient_id: str, labs: Sequence[Dict]):
+        """Replace a patient's rows with ``labs`` (all of them, oldest first)."""
+        with self._write_lock:
+            row = self._patients.setdefault(patient_id, len(self._patients))
+            count = len(labs)
+            tests = _encode((lab.get("test_name", "") for lab in labs), self._tests, count)
+            rows = _Rows(
+                np.fromiter((day_ordinal(str(lab.get("collection_date") or "")) for lab in labs),
+                            dtype=np.int32, count=count),
+                self._parse_values((lab.get("value", "") for lab in labs), count),
+                _encode((lab.get("reference_range", "") for lab in labs), self._ranges, count),
+                _encode((lab.get("unit", "") for lab in labs), self._units, count),
+                np.fromiter((flag_code(lab.get("abnormal_flag", "")) for lab in labs),
+                            dtype=np.int8, count=count),
+                np.full(count, row, dtype=np.int32),
+            )
+            self._refresh_names()
+            by_test = {int(test): rows.take(np.flatnonzero(tests == test)) for test in np.unique(tests)}
+            # One assignment, so concurrent readers see either the old or the new series
+            self._overrides = {**self._overrides, row: by_test}
+
+    # ---------- Lookup ----------
+
+    def tests_matching(self, names: Optional[Iterable[str]]) -> List[int]:
+        """Test codes whose name contains any of ``names`` (case-insensitive); every test when None."""
+        if names is None:
+            return list(range(len(self._test_names)))
+        needles = [name.lower() for name in names]
+        return [code for code, test in enumerate(self._test_names) if any(n in test.lower() for n in needles)]
+
+    def patient_rows(self, patient_id: str, test: int, since_day: int) -> Optional[_Rows]:
+        row = self._patients.get(patient_id)
+        if row is None:
+            return None
+        overrides = self._overrides.get(row)
+        if overrides is not None:
+            rows = overrides.get(test)
+        else:
+            start, end = self._test_block(test)
+            patients = self._rows.patient[start:end]
+            first = start + np.searchsorted(patients, row, "left")
+            last = start + np.searchsorted(patients, row, "right")
+            rows = self._rows.take(slice(first, last)) if last > first else None
+        if rows is None:
+            return None
+        return rows.take(slice(np.searchsorted(rows.day, since_day), None))
+
+    def cohort_rows(self, patient_ids: Optional[List[str]], test: int, since_day: int) -> _Rows:
+        """Rows of ``test`` since ``since_day`` for the given patients (everyone when None), grouped by patient."""
+        start, end = self._test_block(test)
+        block = self._rows.take(slice(start, end))
+        keep = block.day >= since_day
+        overrides = self._overrides
+        overridden = np.fromiter(overrides, dtype=np.int32, count=len(overrides))
+        if len(overridden):
+            keep &= ~np.isin(block.patient, overridden)
+        if patient_ids is not None:
+            cohort = np.fromiter((self._patients[pid] for pid in patient_ids if pid in self._patients),
+                                 dtype=np.int32)
+            keep &= np.isin(block.patient, cohort)
+            overridden = overridden[np.isin(overridden, cohort)]
+        parts = [block.take(keep)]
+        for row in overridden:
+            rows = overrides[int(row)].get(test)
+            if rows is not None:
+                parts.append(rows.take(rows.day >= since_day))
+        return _Rows.concat(parts) if len(parts) > 1 else parts[0]
+
+    def _test_block(self, test: int) -> Tuple[int, int]:
+        if test + 1 >= len(self._test_bounds):
+            # Test first seen in an update: no rows in the flat columns
+            return 0, 0
+        return int(self._test_bounds[test]), int(self._test_bounds[test + 1])
+
+    def test_name(self, test: int) -> str:
+        return self._test_names[test]
+
+    def unit_name(self, unit: int) -> str:
+        return self._unit_names[unit]
+
+    def range_name(self, range_code: int) -> str:
+        return self._range_names[range_code]
+
+    def range_bounds(self, range_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        bounds = self._range_bounds[range_codes]
+        return bounds[:, 0], bounds[:, 1]
+
+
+def segment_stats(index: LabTrendIndex, rows: _Rows, window: int) -> Dict[str, np.ndarray]:
+    """Trend statistics of every patient's series in ``rows`` (grouped by patient, oldest first), vectorized.
+
+    Returns per-series arrays: patient, results, slope_per_year, rolling_mean (of the last ``window``
+    numeric results), mean, min, max, latest value/day/flag/row, out_of_range and flag transition
+    counts (a series x 16 matrix indexed by from_flag * 4 + to_flag).
+    """
+    n_rows = len(rows)
+    if n_rows == 0:
+        return {"series": 0}
+    starts = np.concatenate(([0], np.flatnonzero(rows.patient[1:] != rows.patient[:-1]) + 1))
+    n_series = len(starts)
+    lengths = np.diff(np.append(starts, n_rows))
+    series = np.repeat(np.arange(n_series), lengths)
+    ends = starts + lengths - 1
+
+    # Flag transitions between consecutive results of the same series
+    same = series[1:] == series[:-1]
+    changed = same & (rows.flag[1:] != rows.flag[:-1])
+    kinds = rows.flag[:-1][changed].astype(np.int64) * 4 + rows.flag[1:][changed]
+    transitions = np.bincount(series[1:][changed] * 16 + kinds, minlength=n_series * 16).reshape(n_series, 16)
+
+    # Numeric statistics skip results without a numeric value
+    numeric = ~np.isnan(rows.value)
+    s = series[numeric]
+    y = rows.value[numeric]
+    low, high = index.range_bounds(rows.range[numeric])
+    counts = np.bincount(s, minlength=n_series)
+    # Years since each series' first result, keeping the sums small
+    first_day = rows.day[starts].astype(np.float64)
+    x = (rows.day[numeric] - first_day[s]) / DAYS_PER_YEAR
+    sx = np.bincount(s, x, n_series)
+    sy = np.bincount(s, y, n_series)
+    sxx = np.bincount(s, x * x, n_series)
+    sxy = np.bincount(s, x * y, n_series)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        denominator = counts * sxx - sx * sx
+        slope = np.where(denominator > 1e-12, (counts * sxy - sx * sy) / denominator, np.nan)
+        mean = sy / counts
+
+    has_values = counts > 0
+    numeric_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    minimum = np.full(n_series, np.nan)
+    maximum = np.full(n_series, np.nan)
+    latest = np.full(n_series, np.nan)
+    rolling = np.full(n_series, np.nan)
+    if has_values.any():
+        minimum[has_values] = np.minimum.reduceat(y, numeric_starts[has_values])
+        maximum[has_values] = np.maximum.reduceat(y, numeric_starts[has_values])
+        numeric_ends = numeric_starts + counts
+        latest[has_values] = y[numeric_ends[has_values] - 1]
+        cumulative = np.concatenate(([0.0], np.cumsum(y)))
+        window_start = np.maximum(numeric_ends - max(window, 1), numeric_starts)
+        rolling[has_values] = ((cumulative[numeric_ends] - cumulative[window_start])
+                               / (numeric_ends - window_start))[has_values]
+    out_of_range = np.bincount(s, ((y < low) | (y > high)).astype(np.float64), n_series).astype(np.int64)
+
+    return {
+        "series": n_series,
+        "patient": rows.patient[starts],
+        "results": lengths,
+        "numeric_results": counts,
+        "slope_per_year": slope,
+        "rolling_mean": rolling,
+        "mean": mean,
+        "min": minimum,
+        "max": maximum,
+        "latest_value": latest,
+        "first_day": rows.day[starts],
+        "latest_day": rows.day[ends],
+        "latest_flag": rows.flag[ends],
+        "latest_row": ends,
+        "out_of_range": out_of_range,
+        "transitions": transitions,
+    }
+
+
+def _number(value, digits: int = 3):
+    value = float(value)
+    return None if math.isnan(value) else round(value, digits)
+
+
+def transition_counts(row: np.ndarray) -> Dict[str, int]:
+    """{"N->H": 2, ...} from one row of a transition matrix."""
+    return {f"{FLAG_NAMES[kind // 4]}->{FLAG_NAMES[kind % 4]}": int(row[kind]) for kind in np.flatnonzero(row)}
+
+
+def patient_trends(index: LabTrendIndex, patient_id: str, tests: List[int], since_day: int, window: int,
+                   iso_date: Callable[[int], str]) -> List[Dict]:
+    """One entry per test the patient has results for in the window."""
+    trends = []
+    for test in tests:
+        rows = index.patient_rows(patient_id, test, since_day)
+        if rows is None or len(rows) == 0:
+            continue
+        stats = segment_stats(index, rows, window)
+        last = int(stats["latest_row"][0])
+        trends.append({
+            "test_name": index.test_name(test),
+            "unit": index.unit_name(int(rows.unit[last])),
+            "reference_range": index.range_name(int(rows.range[last])),
+            "results": int(stats["results"][0]),
+            "first_date": iso_date(int(stats["first_day"][0])),
+            "latest_date": iso_date(int(stats["latest_day"][0])),
+            "latest_value": _number(stats["latest_value"][0]),
+            "latest_flag": FLAG_NAMES[int(stats["latest_flag"][0])],
+            "slope_per_year": _number(stats["slope_per_year"][0]),
+            f"rolling_mean_last_{window}": _number(stats["rolling_mean"][0]),
+            "mean": _number(stats["mean"][0]),
+            "min": _number(stats["min"][0]),
+            "max": _number(stats["max"][0]),
+            "out_of_range": int(stats["out_of_range"][0]),
+            "flag_transitions": transition_counts(stats["transitions"][0]),
+        })
+    return trends
+
+
+def cohort_trends(index: LabTrendIndex, patient_ids: Optional[List[str]], tests: List[int], since_day: int,
+                  window: int) -> List[Dict]:
+    """Aggregates over every patient's series, one entry per test with results in the window."""
+    trends = []
+    for test in tests:
+        rows = index.cohort_rows(patient_ids, test, since_day)
+        if len(rows) == 0:
+            continue
+        stats = segment_stats(index, rows, window)
+        slopes = stats["slope_per_year"]
+        latest = stats["latest_value"]
+        with np.errstate(invalid="ignore"):
+            trends.append({
+                "test_name": index.test_name(test),
+                "patients": int(stats["series"]),
+                "results": int(stats["results"].sum()),
+                "mean_slope_per_year": _number(np.nanmean(slopes)) if np.isfinite(slopes).any() else None,
+                "median_slope_per_year": _number(np.nanmedian(slopes)) if np.isfinite(slopes).any() else None,
+                "patients_rising": int((slopes > 0).sum()),
+                "patients_falling": int((slopes < 0).sum()),
+                "latest_value": {
+                    "mean": _number(np.nanmean(latest)) if np.isfinite(latest).any() else None,
+                    "min": _number(np.nanmin(latest)) if np.isfinite(latest).any() else None,
+                    "max": _number(np.nanmax(latest)) if np.isfinite(latest).any() else None,
+                },
+                "patients_latest_abnormal": int((stats["latest_flag"] != 0).sum()),
+                "patients_out_of_range": int((stats["out_of_range"] > 0).sum()),
+                "out_of_range_results": int(stats["out_of_range"].sum()),
+                "flag_transitions": transition_counts(stats["transitions"].sum(axis=0)),
+            })
+    return trends
@@ -0,0 +1,286 @@
+"""Load tests for the clinical assistant stack.
+
+    python loadtest.py mcp --url http://localhost:8000/mcp --users 32 --duration 60
+    python loadtest.py agent --url http://localhost:8000/mcp --users 8 --token-latency-ms 20
+    python loadtest.py compare graviton.json x86.json
+
+"mcp" calls the MCP server's tools directly over streamable HTTP. "agent" runs
+full agent turns against a stub OpenAI-compatible model (started in-process
+unless --llm-url is given), so the numbers reflect the agent and MCP tiers
+rather than the model. Each run prints p50/p95/p99 latency, throughput and
+error rate per operation, and --output saves the report as JSON for comparing
+runs on different node pools.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+DEFAULT_PATIENT_IDS = "PAT001,PAT002,PAT003"
+DEFAULT_TOOL_MIX = "get_patient_summary=4,get_lab_results=3,get_patient_info=2,get_patient_history=2,search_patients=1"
+QUESTIONS = (
+    "Get patient summary for {pid}",
+    "What are the recent lab results for {pid}?",
+    "Summarize the medical history of {pid}",
+)
+SEARCH_TERMS = ("diabetes", "hypertension", "john", "smith", "asthma")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class LatencyRecorder:
+    """Latencies and errors per operation name."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = Counter()
+        self.error_messages: Dict[str, int] = Counter()
+
+    def record(self, name: str, seconds: float, error: Optional[str] = None):
+        self.samples[name].append(seconds)
+        if error:
+            self.errors[name] += 1
+            self.error_messages[f"{name}: {error[:120]}"] += 1
+
+    def report(self, elapsed: float) -> Dict:
+        operations = {}
+        for name, samples in sorted(self.samples.items()):
+            values = sorted(samples)
+            operations[name] = {
+                "count": len(values),
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(values), 4),
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(1000 * sum(values) / len(values), 2),
+                "p50_ms": round(1000 * percentile(values, 50), 2),
+                "p95_ms": round(1000 * percentile(values, 95), 2),
+                "p99_ms": round(1000 * percentile(values, 99), 2),
+                "max_ms": round(1000 * values[-1], 2),
+            }
+        return {"operations": operations, "top_errors": dict(self.error_messages.most_common(10))}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def tool_arguments(tool: str, patient_ids: List[str], rng: random.Random) -> Dict:
+    if tool == "search_patients":
+        return {"query": rng.choice(SEARCH_TERMS)}
+    if tool in ("get_patients_bulk", "get_lab_results_bulk", "screen_population_risk"):
+        return {"patient_ids": rng.sample(patient_ids, min(len(patient_ids), 10))}
+    return {"patient_id": rng.choice(patient_ids)}
+
+
+async def run_users(users: int, duration: float, ramp: float,
+                    user: Callable[[int, random.Random, float], Awaitable[None]]) -> float:
+    """Run ``users`` closed-loop virtual users, started evenly over ``ramp`` seconds, until ``duration`` is up."""
+    start = time.monotonic()
+    deadline = start + duration
+
+    async def virtual_user(index: int):
+        await asyncio.sleep(ramp * index / max(users, 1))
+        await user(index, random.Random(index), deadline)
+
+    await asyncio.gather(*(virtual_user(i) for i in range(users)))
+    return time.monotonic() - start
+
+
+# ---------- MCP tools ----------
+
+async def mcp_load(args, recorder: LatencyRecorder) -> float:
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    weights = parse_mix(args.mix)
+    tools, tool_weights = list(weights), list(weights.values())
+    patient_ids = args.patient_ids.split(",")
+
+    async def user(index: int, rng: random.Random, deadline: float):
+        # Each virtual user holds its own session, as separate agent processes would
+        async with streamablehttp_client(args.url) as (read_stream, write_stream, _):
+            async with ClientSession(read_stream, write_stream) as session:
+                await session.initialize()
+                while time.monotonic() < deadline:
+                    tool = rng.choices(tools, tool_weights)[0]
+                    started = time.perf_counter()
+                    error = None
+                    try:
+                        result = await session.call_tool(tool, tool_arguments(tool, patient_ids, rng))
+                        structured = (result.structuredContent or {}).get("result", {})
+                        if result.isError:
+                            error = result.content[0].text if result.content else "tool error"
+                        elif isinstance(structured, dict) and "error" in structured:
+                            error = structured["error"]
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    recorder.record(tool, time.perf_counter() - started, error)
+                    await asyncio.sleep(args.think_ms / 1000)
+
+    return await run_users(args.users, args.duration, args.ramp, user)
+
+
+# ---------- Agent end to end ----------
+
+def _start_stub_llm(args) -> str:
+    import uvicorn
+
+    from stub_llm import StubModelSettings, create_app
+
+    settings = StubModelSettings(args.first_token_ms / 1000, args.token_latency_ms / 1000, args.output_tokens)
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), host="127.0.0.1", port=args.stub_port,
+                                           log_level="warning"))
+    threading.Thread(target=server.run, name="stub-llm", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    print(f"🤖 Stub model on port {args.stub_port} ({args.first_token_ms:g} ms to first token, "
+          f"{args.token_latency_ms:g} ms/token, {args.output_tokens} tokens)")
+    return f"http://127.0.0.1:{args.stub_port}/v1"
+
+
+async def agent_load(args, recorder: LatencyRecorder) -> float:
+    os.environ["LITELLM_HOST"] = args.llm_url or _start_stub_llm(args)
+    os.environ["MCP_HOST"] = args.url
+    if not args.tracing:
+        os.environ["MLFLOW_TRACING"] = "0"
+
+    from strands.handlers.callback_handler import null_callback_handler
+
+    import health_agent_async
+
+    await asyncio.to_thread(health_agent_async.warm_up)
+    agents = []
+    for _ in range(args.users):
+        agent, _ = await asyncio.to_thread(health_agent_async.create_health_agent)
+        agent.callback_handler = null_callback_handler
+        agents.append(agent)
+    patient_ids = args.patient_ids.split(",")
+
+    async def user(index: int, rng: random.Random, deadline: float):
+        agent = agents[index]
+        while time.monotonic() < deadline:
+            # A fresh conversation per turn keeps every turn the same size
+            agent.messages.clear()
+            question = rng.choice(QUESTIONS).format(pid=rng.choice(patient_ids))
+            started = time.perf_counter()
+            first_token = None
+            error = None
+            try:
+                async for event in agent.stream_async(question):
+                    if "data" in event and first_token is None:
+                        first_token = time.perf_counter() - started
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            recorder.record("agent_turn", time.perf_counter() - started, error)
+            if first_token is not None:
+                recorder.record("agent_first_token", first_token)
+            await asyncio.sleep(args.think_ms / 1000)
+
+    return await run_users(args.users, args.duration, args.ramp, user)
+
+
+# ---------- Reports ----------
+
+def print_report(report: Dict):
+    print(f"\n{report['label']} ({report['mode']}, {report['machine']}, {report['cpu_count']} CPUs, "
+          f"{report['config']['users']} users, {report['elapsed_s']} s)")
+    print(f"{'operation':<22}{'count':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for name, stats in report["operations"].items():
+        print(f"{name:<22}{stats['count']:>8}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{100 * stats['error_rate']:>8.2f}%")
+    for message, count in report["top_errors"].items():
+        print(f"  ⚠️  {count} x {message}")
+    if report.get("trace_export"):
+        print(f"🧵 Trace export: {json.dumps(report['trace_export'])}")
+
+
+def compare_reports(paths: List[str]):
+    """Print the same operation from several saved reports side by side."""
+    reports = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            reports.append(json.load(f))
+    operations = dict.fromkeys(name for report in reports for name in report["operations"])
+    for name in operations:
+        print(f"\n{name}")
+        print(f"  {'run':<28}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+        for report in reports:
+            stats = report["operations"].get(name)
+            if stats is None:
+                continue
+            label = f"{report['label']} ({report['machine']})"
+            print(f"  {label:<28}{stats['throughput_rps']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                  f"{stats['p99_ms']:>10}{100 * stats['error_rate']:>8.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests for the clinical assistant stack")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    for mode in ("mcp", "agent"):
+        sub = modes.add_parser(mode)
+        sub.add_argument("--url", default=os.environ.get("MCP_HOST", "http://localhost:8000/mcp"))
+        sub.add_argument("--users", type=int, default=16 if mode == "mcp" else 4)
+        sub.add_argument("--duration", type=float, default=30, help="seconds")
+        sub.add_argument("--ramp", type=float, default=5, help="seconds over which users start")
+        sub.add_argument("--think-ms", type=float, default=0)
+        sub.add_argument("--patient-ids", default=DEFAULT_PATIENT_IDS)
+        sub.add_argument("--label", default=platform.node())
+        sub.add_argument("--output", help="write the report as JSON")
+    modes.choices["mcp"].add_argument("--mix", default=DEFAULT_TOOL_MIX, help="tool=weight,...")
+    agent = modes.choices["agent"]
+    agent.add_argument("--llm-url", help="OpenAI-compatible endpoint; a stub model is started when omitted")
+    agent.add_argument("--stub-port", type=int, default=4100)
+    agent.add_argument("--first-token-ms", type=float, default=200)
+    agent.add_argument("--token-latency-ms", type=float, default=20)
+    agent.add_argument("--output-tokens", type=int, default=200)
+    agent.add_argument("--tracing", action="store_true", help="keep MLflow tracing on")
+    compare = modes.add_parser("compare")
+    compare.add_argument("reports", nargs="+")
+    args = parser.parse_args()
+
+    if args.mode == "compare":
+        compare_reports(args.reports)
+        return
+
+    recorder = LatencyRecorder()
+    elapsed = asyncio.run((mcp_load if args.mode == "mcp" else agent_load)(args, recorder))
+    report = {
+        "label": args.label,
+        "mode": args.mode,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("mode", "output")},
+        "elapsed_s": round(elapsed, 2),
+        **recorder.report(elapsed),
+    }
+    if args.mode == "agent" and args.tracing:
+        import trace_export
+
+        report["trace_export"] = trace_export.export_stats()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
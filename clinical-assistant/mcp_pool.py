@@ -0,0 +1,341 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from mcp.client.streamable_http import streamablehttp_client
+from strands.tools.mcp import MCPAgentTool, MCPClient
+# Not public API: MCPAgentTool.stream yields the same event, pinned in requirements.txt to tested versions
+from strands.types._events import ToolResultEvent
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledSession:
+    def __init__(self, url: str):
+        self.client = MCPClient(lambda: streamablehttp_client(url))
+        self.lock = threading.Lock()
+        self.started = False
+        self.borrowers = 0
+        self.pinned = 0
+        self.last_healthy = 0.0
+        # Set once a failed health check takes the session out of the pool
+        self.retired = False
+        self.replacement: Optional["_PooledSession"] = None
+
+
+class PinnedClient:
+    """A pooled client pinned to one agent; ``release`` unpins it once the agent is done with it."""
+
+    def __init__(self, pool: "MCPConnectionPool", session: _PooledSession):
+        self._pool = pool
+        self._session = session
+        self._released = False
+
+    def _current(self) -> _PooledSession:
+        # A retired session hands its pins to the session that replaced it
+        session = self._session
+        while session.replacement is not None:
+            session = session.replacement
+        return session
+
+    @property
+    def client(self) -> MCPClient:
+        with self._pool._lock:
+            return self._current().client
+
+    def release(self):
+        """Unpin the session; later calls do nothing."""
+        with self._pool._lock:
+            if not self._released:
+                self._released = True
+                self._current().pinned -= 1
+
+    def __enter__(self) -> MCPClient:
+        return self.client
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MCPConnectionPool:
+    """Long-lived MCP client sessions shared by every agent in the process.
+
+    Sessions are opened once and kept warm by a keep-alive thread, so a chat
+    turn no longer pays for the HTTP handshake and MCP initialize. A session
+    that fails its health check (checked again when it was in use as an error
+    escaped) is retired: new borrowers get a fresh session in its place, and it
+    is closed once the calls still running on it have returned. Tools from
+    ``pooled_tools`` borrow a session per call, so they survive the swap.
+    """
+
+    def __init__(self, url: str, size: int = 4, keepalive_seconds: float = 30.0):
+        self.url = url
+        self.keepalive_seconds = keepalive_seconds
+        self._sessions = [_PooledSession(url) for _ in range(max(size, 1))]
+        # Retired sessions waiting for their borrowers to return
+        self._retired: List[_PooledSession] = []
+        self._lock = threading.Lock()
+        self._tool_specs = None
+        self._closed = threading.Event()
+        self._keepalive = threading.Thread(target=self._keepalive_loop, name="mcp-pool-keepalive", daemon=True)
+        self._keepalive.start()
+
+    # ---------- Borrowing ----------
+
+    def acquire(self) -> PinnedClient:
+        """Pin a client to a new agent's tools, spreading agents across the pool; release it with the agent."""
+        with self._lock:
+            session = min(self._sessions, key=lambda s: (s.pinned, s.borrowers))
+            session.pinned += 1
+        pinned = PinnedClient(self, session)
+        try:
+            with self.borrow(session.client):
+                pass
+        except Exception:
+            pinned.release()
+            raise
+        return pinned
+
+    @contextmanager
+    def borrow(self, client: Optional[MCPClient] = None) -> Iterator[MCPClient]:
+        """Use a healthy pooled client, ``client`` while it is in the pool or else the least-borrowed one."""
+        session = self._checkout_healthy(client)
+        try:
+            yield session.client
+        except Exception:
+            # Re-check this session before it is handed out again
+            session.last_healthy = 0.0
+            raise
+        finally:
+            self._checkin(session)
+
+    @asynccontextmanager
+    async def borrow_async(self) -> AsyncIterator[MCPClient]:
+        """``borrow`` for coroutines: the least-borrowed session, health-checked off the event loop."""
+        session = self._checkout(None)
+        if not session.started or time.monotonic() - session.last_healthy >= self.keepalive_seconds:
+            self._checkin(session)
+            session = await asyncio.to_thread(self._checkout_healthy, None)
+        try:
+            yield session.client
+        except Exception:
+            session.last_healthy = 0.0
+            raise
+        finally:
+            self._checkin(session)
+
+    def _checkout(self, client: Optional[MCPClient]) -> _PooledSession:
+        with self._lock:
+            session = next((s for s in self._sessions if s.client is client), None) if client is not None else None
+            if session is None:
+                session = min(self._sessions, key=lambda s: s.borrowers)
+            session.borrowers += 1
+        return session
+
+    def _checkout_healthy(self, client: Optional[MCPClient]) -> _PooledSession:
+        """Check out a session that is connected, in place of any that fail their health check."""
+        for _ in range(len(self._sessions) + 1):
+            session = self._checkout(client)
+            try:
+                healthy = self._ensure_healthy(session)
+            except BaseException:
+                self._checkin(session)
+                raise
+            if healthy:
+                return session
+            self._checkin(session)
+        raise RuntimeError(f"No healthy MCP session to {self.url}")
+
+    def _checkin(self, session: _PooledSession):
+        with self._lock:
+            session.borrowers -= 1
+            last_borrower = session.retired and session.borrowers == 0 and session in self._retired
+            if last_borrower:
+                self._retired.remove(session)
+        if last_borrower:
+            self._close_retired(session)
+
+    def tool_specs(self) -> list:
+        """MCP tool definitions, fetched from the server once per process."""
+        if self._tool_specs is None:
+            with self.borrow() as client:
+                self._tool_specs = [tool.mcp_tool for tool in client.list_tools_sync()]
+        return self._tool_specs
+
+    def tools_for(self, client: MCPClient) -> List[MCPAgentTool]:
+        """Agent tools that invoke the cached tool definitions through ``client``."""
+        return [MCPAgentTool(spec, client) for spec in self.tool_specs()]
+
+    def pooled_tools(self, client: MCPClient, prefetched: Optional["PrefetchedResults"] = None) -> List[MCPAgentTool]:
+        """Agent tools whose calls each borrow a session, so concurrent calls run on separate sessions."""
+        return [PooledMCPTool(spec, client, self, prefetched) for spec in self.tool_specs()]
+
+    async def iter_pages(self, name: str, arguments: Dict, items: str,
+                         cursor_field: str = "next_cursor") -> AsyncIterator[List[Dict]]:
+        """Call a paged tool and yield each page's ``items`` list, following its cursor until the last page.
+
+        Only one page is held at a time, so a caller can stop early or fold a long history as it arrives.
+        """
+        arguments = dict(arguments)
+        while True:
+            async with self.borrow_async() as client:
+                result = await client.call_tool_async(tool_use_id=f"page-{name}", name=name, arguments=arguments)
+            if result["status"] != "success":
+                raise RuntimeError(f"{name} failed: {result['content']}")
+            page = (result.get("structuredContent") or {}).get("result", {})
+            if "error" in page:
+                raise RuntimeError(f"{name} failed: {page['error']}")
+            yield page.get(items, [])
+            if not page.get(cursor_field):
+                return
+            arguments["cursor"] = page[cursor_field]
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            sessions = self._sessions + self._retired
+        for session in sessions:
+            with session.lock:
+                if session.started:
+                    self._stop(session)
+
+    # ---------- Health ----------
+
+    def _ensure_healthy(self, session: _PooledSession, force: bool = False) -> bool:
+        """Start the session or probe it when due; False when it failed and was retired."""
+        with session.lock:
+            if session.retired:
+                return False
+            if not session.started:
+                self._start(session)
+                return True
+            if not force and time.monotonic() - session.last_healthy < self.keepalive_seconds:
+                return True
+            try:
+                session.client.list_tools_sync()
+                session.last_healthy = time.monotonic()
+                return True
+            except Exception as e:
+                logger.warning(f"MCP session health check failed, replacing it: {e}")
+                self._retire(session)
+                return False
+
+    def _retire(self, session: _PooledSession):
+        """Swap a fresh session into the pool in place of ``session``, closing it once nobody borrows it."""
+        with self._lock:
+            fresh = _PooledSession(self.url)
+            fresh.pinned, session.pinned = session.pinned, 0
+            session.retired = True
+            session.replacement = fresh
+            self._sessions[self._sessions.index(session)] = fresh
+            idle = session.borrowers == 0
+            if not idle:
+                self._retired.append(session)
+        if idle:
+            self._close_retired(session)
+
+    def _close_retired(self, session: _PooledSession):
+        # Closing joins the client's background thread; never make the caller, maybe an event loop, wait for it
+        threading.Thread(target=self._stop_started, args=(session,), name="mcp-pool-close", daemon=True).start()
+
+    def _stop_started(self, session: _PooledSession):
+        with session.lock:
+            if session.started:
+                self._stop(session)
+
+    def _start(self, session: _PooledSession):
+        session.client.start()
+        session.started = True
+        session.last_healthy = time.monotonic()
+
+    def _stop(self, session: _PooledSession):
+        try:
+            session.client.stop(None, None, None)
+        except Exception as e:
+            logger.warning(f"Error closing MCP session: {e}")
+        session.started = False
+
+    def _keepalive_loop(self):
+        while not self._closed.wait(self.keepalive_seconds):
+            with self._lock:
+                sessions = list(self._sessions)
+            for session in sessions:
+                if session.started and session.borrowers == 0:
+                    try:
+                        # A session failing here is retired; calls that borrowed it meanwhile still finish on it
+                        self._ensure_healthy(session, force=True)
+                    except Exception as e:
+                        logger.warning(f"MCP keep-alive failed: {e}")
+
+
+def _call_key(spec, arguments: Dict) -> Tuple[str, str]:
+    """Identify a call by tool name and arguments, with omitted arguments at their defaults."""
+    properties = (spec.inputSchema or {}).get("properties", {})
+    defaults = {name: schema["default"] for name, schema in properties.items() if "default" in schema}
+    return spec.name, json.dumps({**defaults, **(arguments or {})}, sort_keys=True, default=str)
+
+
+class PrefetchedResults:
+    """Tool calls started ahead of the model asking for them, handed over on the first matching call.
+
+    Prefetches live for one agent turn: ``clear`` cancels and drops whatever
+    the model did not ask for, so results are never older than the turn.
+    """
+
+    def __init__(self, pool: MCPConnectionPool):
+        self._pool = pool
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def start(self, calls: Iterable[Tuple[str, Dict]]):
+        """Start (tool name, arguments) calls concurrently; must run on the agent's event loop."""
+        specs = {spec.name: spec for spec in self._pool.tool_specs()}
+        for name, arguments in calls:
+            key = _call_key(specs[name], arguments)
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.ensure_future(self._call(name, arguments))
+
+    def take(self, spec, arguments: Dict) -> Optional[asyncio.Task]:
+        return self._tasks.pop(_call_key(spec, arguments), None)
+
+    def clear(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _call(self, name: str, arguments: Dict) -> Dict[str, Any]:
+        async with self._pool.borrow_async() as client:
+            return await client.call_tool_async(tool_use_id=f"prefetch-{name}", name=name, arguments=arguments)
+
+
+class PooledMCPTool(MCPAgentTool):
+    """MCP tool that borrows a pooled session per call and serves matching prefetched results."""
+
+    def __init__(self, spec, client: MCPClient, pool: MCPConnectionPool,
+                 prefetched: Optional[PrefetchedResults] = None):
+        super().__init__(spec, client)
+        self._pool = pool
+        self._prefetched = prefetched
+
+    async def stream(self, tool_use, invocation_state, **kwargs):
+        task = self._prefetched.take(self.mcp_tool, tool_use["input"]) if self._prefetched else None
+        if task is not None:
+            try:
+                result = await task
+                if result["status"] == "success":
+                    yield ToolResultEvent({**result, "toolUseId": tool_use["toolUseId"]})
+                    return
+            except Exception as e:
+                logger.warning(f"Prefetched {self.tool_name} call failed, calling again: {e}")
+
+        async with self._pool.borrow_async() as client:
+            result = await client.call_tool_async(
+                tool_use_id=tool_use["toolUseId"],
+                name=self.mcp_tool.name,
+                arguments=tool_use["input"],
+                read_timeout_seconds=self.timeout,
+            )
+        yield ToolResultEvent(result)
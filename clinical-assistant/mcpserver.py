@@ -1,10 +1,72 @@
 from mcp.server import FastMCP
+import base64
+import functools
+import hashlib
+import hmac
+import itertools
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from typing import Iterable, List, Dict, Optional, Tuple
 
-# Initialize MCP server for healthcare data
-mcp = FastMCP("Healthcare Data Server", host="0.0.0.0")
+import anyio
+from mcp.types import CallToolResult, TextContent
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+
+from cache import TTLCache
+from coalesce import SingleFlight
+from cohort_index import CohortIndex
+from compact import compact, dumps
+from lab_trends import FLAG_NAMES, LabTrendIndex, cohort_trends, patient_trends
+from metrics import CallProfiler, ToolMetrics
+from patient_store import PatientStore, write_snapshot
+from risk_rules import RiskRuleEngine, load_rules
+from search_index import PatientSearchIndex
+from versioned_store import ListenerError, VersionedStore
+
+# Serving configuration
+MCP_HOST = os.environ.get("MCP_SERVER_HOST", "0.0.0.0")
+MCP_PORT = int(os.environ.get("MCP_SERVER_PORT", "8000"))
+MCP_WORKERS = int(os.environ.get("MCP_WORKERS", "1"))
+MCP_THREAD_POOL_SIZE = int(os.environ.get("MCP_THREAD_POOL_SIZE", "8"))
+# Default encoding of tool results; a tool call's format argument overrides it
+MCP_RESPONSE_FORMAT = os.environ.get("MCP_RESPONSE_FORMAT", "full")
+RESPONSE_FORMATS = ("full", "compact")
+
+# Initialize MCP server for healthcare data. With several worker processes a client's
+# requests can land on any of them, so sessions must not hold per-process state.
+mcp = FastMCP("Healthcare Data Server", host=MCP_HOST, port=MCP_PORT, stateless_http=MCP_WORKERS > 1)
+
+# Bounds concurrent blocking lookups so a burst of tool calls cannot exhaust the worker threads
+_tool_limiter = anyio.CapacityLimiter(MCP_THREAD_POOL_SIZE)
+
+# Every tool call is measured; MCP_PROFILE ("cprofile", "py-spy" or both, comma separated)
+# additionally enables the profiling routes; cprofile profiles one call at a time, py-spy samples them all
+tool_metrics = ToolMetrics()
+MCP_PROFILE = {mode.strip() for mode in os.environ.get("MCP_PROFILE", "").split(",") if mode.strip()}
+profiler = CallProfiler() if "cprofile" in MCP_PROFILE else None
+
+# Concurrent calls of a tool with identical arguments share one computation and one rendered
+# result; MCP_COALESCE=0 turns this off
+MCP_COALESCE = os.environ.get("MCP_COALESCE", "1") != "0"
+single_flight = SingleFlight()
+
+def coalesced(func):
+    return single_flight.coalesced(func) if MCP_COALESCE else func
+
+def offloaded(func):
+    """Turn a blocking tool body into an async tool that runs on the bounded thread pool."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        call = functools.partial(profiler.call, func) if profiler else func
+        return await anyio.to_thread.run_sync(functools.partial(call, *args, **kwargs), limiter=_tool_limiter)
+    return wrapper
 
 # Sample healthcare data (in production, this would connect to a real database/API)
 SAMPLE_PATIENTS = {
@@ -141,95 +203,537 @@ SAMPLE_LAB_RESULTS = {
     ]
 }
 
+def _load_store() -> PatientStore:
+    """Open PATIENT_SNAPSHOT or load bulk patient data from PATIENT_DATA_DIR, falling back to the sample data."""
+    snapshot = os.environ.get("PATIENT_SNAPSHOT")
+    if snapshot and os.path.exists(snapshot):
+        print(f"📂 Mapping patient data snapshot {snapshot}")
+        return PatientStore.open_snapshot(snapshot)
+    data_dir = os.environ.get("PATIENT_DATA_DIR")
+    if data_dir:
+        print(f"📂 Loading patient data from {data_dir}")
+        store = PatientStore.from_directory(data_dir)
+        print(f"✅ Loaded {len(store)} patients")
+        return store
+    return PatientStore.from_sample(SAMPLE_PATIENTS, SAMPLE_MEDICAL_HISTORY, SAMPLE_LAB_RESULTS)
+
+# Populated by init_data(); loading is deferred so worker processes only load data once
+store: Optional[VersionedStore] = None
+search_index: Optional[PatientSearchIndex] = None
+lab_trend_index: Optional[LabTrendIndex] = None
+cohort_index: Optional[CohortIndex] = None
+
+# Incremental ingestion: batches POSTed to /ingest are appended to PATIENT_CHANGE_LOG, which every
+# worker follows, and folded into a new base snapshot every PATIENT_COMPACT_SECONDS or as soon as
+# PATIENT_COMPACT_ROWS rows are waiting
+PATIENT_CHANGE_LOG = os.environ.get("PATIENT_CHANGE_LOG")
+CHANGE_LOG_POLL_SECONDS = float(os.environ.get("CHANGE_LOG_POLL_SECONDS", "1"))
+PATIENT_COMPACT_SECONDS = float(os.environ.get("PATIENT_COMPACT_SECONDS", "300"))
+PATIENT_COMPACT_ROWS = int(os.environ.get("PATIENT_COMPACT_ROWS", "10000"))
+MAX_INGEST_ROWS = int(os.environ.get("MAX_INGEST_ROWS", "10000"))
+# Bearer token /ingest requires; without one ingestion is disabled
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+# Data versions let clients tell whether results they derived from patient data are still current.
+# The epoch identifies the base data set and change log; store.version counts batches ingested on top of it.
+data_epoch = ""
+
+def _data_epoch(store: PatientStore) -> str:
+    """Same in every worker serving the same base data and change log, new whenever versions could restart."""
+    snapshot = os.environ.get("PATIENT_SNAPSHOT")
+    data_dir = os.environ.get("PATIENT_DATA_DIR")
+    if store.read_only and snapshot:
+        stat = os.stat(snapshot)
+        source = f"snapshot:{stat.st_mtime_ns}:{stat.st_size}"
+    elif data_dir:
+        source = "dir:" + ",".join(f"{entry.name}:{entry.stat().st_mtime_ns}:{entry.stat().st_size}"
+                                   for entry in sorted(os.scandir(data_dir), key=lambda e: e.name)
+                                   if entry.is_file())
+    else:
+        source = "sample"
+    if PATIENT_CHANGE_LOG:
+        # Versions are numbered by the log, so they only restart with a new log file
+        open(PATIENT_CHANGE_LOG, "ab").close()
+        stat = os.stat(PATIENT_CHANGE_LOG)
+        changes = f"log:{stat.st_dev}:{stat.st_ino}"
+    elif MCP_WORKERS == 1:
+        # Ingested batches live only in this process, so its versions start over after a restart
+        changes = uuid.uuid4().hex
+    else:
+        # Several workers without a change log refuse ingestion, so the data never changes
+        changes = "static"
+    return hashlib.sha256(f"{source}|{changes}".encode()).hexdigest()[:16]
+
+def _index_store_change(kind: str, patient_id: str):
+    """Keep the search index in step with patients and conditions added to the store."""
+    if kind == "patient":
+        search_index.add_patient(patient_id, store.get_patient(patient_id)["name"])
+    elif kind == "conditions":
+        for condition in store.get_conditions(patient_id):
+            search_index.add_condition(patient_id, condition["condition"])
+
+def _refresh_lab_trends(kind: str, patient_id: str, index: Optional[LabTrendIndex] = None):
+    if kind == "labs":
+        (index or lab_trend_index).refresh_patient(patient_id, store.get_labs(patient_id))
+
+def _refresh_cohort_index(kind: str, patient_id: str, index: Optional[CohortIndex] = None):
+    index = index or cohort_index
+    if kind == "patient":
+        index.add_patient(patient_id)
+    elif kind == "conditions":
+        index.refresh_conditions(patient_id, store.get_conditions(patient_id))
+    elif kind == "labs":
+        index.refresh_labs(patient_id, store.delta_labs(patient_id))
+
+def _build_column_indexes():
+    """Index the base columns and whatever is still in the delta, then publish both indexes together."""
+    global lab_trend_index, cohort_index
+    trends = LabTrendIndex.from_store(store.base)
+    cohort = CohortIndex.from_store(store.base)
+    replayed = store.version
+    for kind, patient_id in store.delta_changes():
+        _refresh_lab_trends(kind, patient_id, trends)
+        _refresh_cohort_index(kind, patient_id, cohort)
+    lab_trend_index, cohort_index = trends, cohort
+    # Batches since the replay may have notified the old indexes; refreshing a patient again changes nothing
+    for patient_id in store.changed_since(replayed):
+        for kind in ("patient", "conditions", "labs"):
+            _refresh_lab_trends(kind, patient_id, trends)
+            _refresh_cohort_index(kind, patient_id, cohort)
+
+# Risk rules come from RISK_RULES_PATH when set, otherwise the built-in table
+_risk_rules_path = os.environ.get("RISK_RULES_PATH")
+risk_engine = RiskRuleEngine(load_rules(_risk_rules_path) if _risk_rules_path else None)
+
+# Summaries keyed on (patient_id, include_labs_days, lab page size), dropped when that patient's data changes
+summary_cache = TTLCache(
+    maxsize=int(os.environ.get("SUMMARY_CACHE_SIZE", "4096")),
+    ttl=float(os.environ.get("SUMMARY_CACHE_TTL", "300")),
+)
+
+def init_data():
+    """Load patient data and build the derived indexes; later calls are no-ops."""
+    global store, search_index, data_epoch
+    if store is not None:
+        return
+    base = _load_store()
+    data_epoch = _data_epoch(base)
+    # Snapshot-backed workers following a change log share one compacted snapshot file rather than private copies
+    store = VersionedStore(base, change_log=PATIENT_CHANGE_LOG,
+                           snapshot_path=os.environ.get("PATIENT_SNAPSHOT") if base.read_only else None)
+    replayed = store.sync()
+    if replayed:
+        print(f"📥 Applied {replayed} batches from change log {PATIENT_CHANGE_LOG}")
+    search_index = PatientSearchIndex.from_store(store)
+    _build_column_indexes()
+    store.subscribe(_index_store_change)
+    store.subscribe(_refresh_lab_trends)
+    store.subscribe(_refresh_cohort_index)
+    store.subscribe(lambda kind, patient_id: summary_cache.invalidate_group(patient_id))
+
+def _maintain_store():
+    """Follow the change log and compact the delta; runs on a daemon thread in every serving process."""
+    last_compaction = time.monotonic()
+    while True:
+        time.sleep(CHANGE_LOG_POLL_SECONDS)
+        try:
+            store.sync()
+            due = time.monotonic() - last_compaction >= PATIENT_COMPACT_SECONDS
+            if store.delta_rows >= PATIENT_COMPACT_ROWS or (due and store.delta_rows):
+                if store.compact():
+                    _build_column_indexes()
+                    print(f"🗜️  Compacted patient data at version {store.version}")
+                last_compaction = time.monotonic()
+        except Exception as e:
+            print(f"⚠️  Patient data maintenance failed: {e}")
+
+def start_store_maintenance():
+    threading.Thread(target=_maintain_store, name="store-maintenance", daemon=True).start()
+
+@mcp.custom_route("/stats", methods=["GET"])
+async def server_stats(request: Request) -> JSONResponse:
+    """Cache counters for operators; not exposed to the agent as a tool."""
+    return JSONResponse({
+        "summary_cache": summary_cache.stats(),
+        "patient_data": store.stats(),
+        "coalescing": {"tools": single_flight.tool_totals(), "hot_keys": single_flight.hot_keys()},
+    })
+
+@mcp.custom_route("/data_versions", methods=["GET"])
+async def data_versions(request: Request) -> JSONResponse:
+    """Current data version, and per-patient versions for ?patient_ids=PAT001,PAT002; used by client-side caches."""
+    patient_ids = [pid for pid in request.query_params.get("patient_ids", "").split(",") if pid]
+    return JSONResponse({
+        "data_epoch": data_epoch,
+        "data_version": store.version,
+        "patients": {pid: store.patient_version(pid) for pid in patient_ids if pid in store},
+    })
+
+@mcp.custom_route("/ingest", methods=["POST"])
+async def ingest(request: Request) -> JSONResponse:
+    """Append new patients, conditions and labs: {"patients": [...], "conditions": [...], "labs": [...]},
+    condition and lab rows carrying a patient_id. Operators and data pipelines only (Authorization: Bearer
+    INGEST_TOKEN), not an agent tool."""
+    if not INGEST_TOKEN:
+        return JSONResponse({"error": "Ingestion is disabled, set INGEST_TOKEN to enable it"}, status_code=403)
+    supplied = request.headers.get("authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {INGEST_TOKEN}".encode()):
+        return JSONResponse({"error": "Missing or wrong ingest token"}, status_code=401)
+    if MCP_WORKERS > 1 and not PATIENT_CHANGE_LOG:
+        return JSONResponse({"error": "Set PATIENT_CHANGE_LOG to ingest with several workers"}, status_code=409)
+    try:
+        batch = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Body must be a JSON object"}, status_code=400)
+    if not isinstance(batch, dict):
+        return JSONResponse({"error": "Body must be a JSON object"}, status_code=400)
+    rows = {kind: batch.get(kind) or [] for kind in ("patients", "conditions", "labs")}
+    if sum(map(len, rows.values())) > MAX_INGEST_ROWS:
+        return JSONResponse({"error": f"Too many rows, maximum is {MAX_INGEST_ROWS} per batch"}, status_code=413)
+    counts = {kind: len(r) for kind, r in rows.items()}
+    try:
+        version = await anyio.to_thread.run_sync(
+            functools.partial(store.ingest, rows["patients"], rows["conditions"], rows["labs"]))
+    except ListenerError as e:
+        # The batch is committed, so retrying it would only be rejected as duplicates
+        print(f"⚠️  Ingested data version {e.version}, but updating derived indexes failed: {e}")
+        return JSONResponse({"data_version": e.version, **counts,
+                             "warning": f"Batch stored, but updating search and cohort indexes failed: {e}"})
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        message = e.args[0] if isinstance(e, KeyError) and e.args else str(e)
+        return JSONResponse({"error": message}, status_code=400)
+    return JSONResponse({"data_version": version, **counts})
+
+@mcp.custom_route("/changes", methods=["GET"])
+async def changes(request: Request) -> JSONResponse:
+    """Patients changed after ?since=<data_version>, with the version of their last change."""
+    try:
+        since = int(request.query_params.get("since", "0"))
+    except ValueError:
+        return JSONResponse({"error": "since must be a data version"}, status_code=400)
+    return JSONResponse({
+        "data_epoch": data_epoch,
+        "data_version": store.version,
+        "patients": store.changed_since(since),
+    })
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> PlainTextResponse:
+    """Prometheus metrics of this process: per-tool latency, response size, errors and in-flight calls."""
+    cache = summary_cache.stats()
+    coalescing = single_flight.tool_totals()
+    body = tool_metrics.render(
+        extra={
+            "tool_executions_in_flight": {f'tool="{tool}"': counts.get("executions_in_flight", 0)
+                                          for tool, counts in coalescing.items()},
+            "summary_cache_entries": {"": cache["size"]},
+            "data_version": {"": store.version},
+            "patient_delta_rows": {"": store.delta_rows},
+        },
+        counters={
+            **{f"tool_{counter}": {f'tool="{tool}"': counts.get(counter, 0) for tool, counts in coalescing.items()}
+               for counter in ("executions", "coalesced")},
+            "summary_cache_hits": {"": cache["hits"]},
+            "summary_cache_misses": {"": cache["misses"]},
+            "summary_cache_evictions": {"": cache["evictions"]},
+        },
+    )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@mcp.custom_route("/profile", methods=["GET"])
+async def profile(request: Request) -> PlainTextResponse:
+    """cProfile statistics accumulated over tool calls (MCP_PROFILE=cprofile); ?reset=1 starts over."""
+    if profiler is None:
+        return PlainTextResponse("Profiling is off, set MCP_PROFILE=cprofile\n", status_code=404)
+    try:
+        limit = int(request.query_params.get("limit", "40"))
+    except ValueError:
+        return PlainTextResponse("limit must be a whole number\n", status_code=400)
+    if limit <= 0:
+        return PlainTextResponse("limit must be positive\n", status_code=400)
+    sort = request.query_params.get("sort", "cumulative")
+    try:
+        report = profiler.report(sort=sort, limit=limit)
+    except KeyError:
+        return PlainTextResponse(f"Unknown sort key {sort!r}\n", status_code=400)
+    if request.query_params.get("reset") == "1":
+        profiler.reset()
+    return PlainTextResponse(report)
+
+@mcp.custom_route("/profile/py-spy", methods=["GET"])
+async def profile_py_spy(request: Request) -> Response:
+    """Sample this process with py-spy for ?seconds=N (MCP_PROFILE=py-spy) and return a speedscope profile."""
+    py_spy = shutil.which("py-spy")
+    if "py-spy" not in MCP_PROFILE or py_spy is None:
+        return PlainTextResponse("py-spy profiling is off, set MCP_PROFILE=py-spy and install py-spy\n",
+                                 status_code=404)
+    try:
+        seconds = int(request.query_params.get("seconds", "10"))
+    except ValueError:
+        return PlainTextResponse("seconds must be a whole number\n", status_code=400)
+    if not 1 <= seconds <= 120:
+        return PlainTextResponse("seconds must be between 1 and 120\n", status_code=400)
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "profile.json")
+        # py-spy attaches to this process from outside, so the event loop keeps serving meanwhile
+        completed = await anyio.run_process(
+            [py_spy, "record", "--pid", str(os.getpid()), "--duration", str(seconds),
+             "--format", "speedscope", "--output", output, "--nonblocking"],
+            check=False,
+        )
+        if completed.returncode != 0:
+            return PlainTextResponse(completed.stderr.decode(errors="replace"), status_code=500)
+        with open(output, "rb") as f:
+            return Response(f.read(), media_type="application/json")
+
+# Upper bound on patients per bulk tool call, keeping one response a reasonable size
+MAX_BULK_PATIENTS = int(os.environ.get("MAX_BULK_PATIENTS", "100"))
+
+# Labs per page of a paged patient summary; 0 returns every lab in the window
+SUMMARY_LAB_PAGE_SIZE = int(os.environ.get("SUMMARY_LAB_PAGE_SIZE", "0"))
+
+def _cutoff_day(days_back: int) -> int:
+    """Day ordinal of the oldest collection date inside a days_back window."""
+    return date.today().toordinal() - days_back
+
+def _patient_version(patient_id: str) -> str:
+    return f"{data_epoch}:{store.patient_version(patient_id)}"
+
+def _lab_cursor(patient_id: str, since_day: int, offset: int) -> str:
+    """Opaque continuation token for the lab page starting at ``offset`` of a window."""
+    state = [patient_id, since_day, offset, _patient_version(patient_id)]
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+def _read_lab_cursor(cursor: str, patient_id: str) -> Tuple[int, int]:
+    """(since_day, offset) of a cursor issued for patient_id; ValueError if it is invalid or stale."""
+    try:
+        cursor_patient, since_day, offset, version = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_patient != patient_id:
+        raise ValueError(f"Cursor was issued for {cursor_patient}, not {patient_id}")
+    # Added labs shift positions in the window, so a cursor is only valid for the data it was issued on
+    if version != _patient_version(patient_id):
+        raise ValueError(f"Lab results for {patient_id} changed since the cursor was issued; "
+                         "start again without a cursor")
+    return since_day, offset
+
+def _respond(result: Dict, format: Optional[str]):
+    """Encode a tool result in the requested format (the server default when None)."""
+    format = format or MCP_RESPONSE_FORMAT
+    if format not in RESPONSE_FORMATS:
+        return {"error": f"Invalid format '{format}', expected 'full' or 'compact'"}
+    if format == "full" or "error" in result:
+        return result
+    encoded = compact(result)
+    # Minified JSON text instead of the indented text FastMCP renders for plain dicts;
+    # structured content keeps FastMCP's {"result": ...} wrapping of Dict outputs
+    return CallToolResult(content=[TextContent(type="text", text=dumps(encoded))],
+                          structuredContent={"result": encoded})
+
 @mcp.tool(description="Get patient demographic information by patient ID")
-def get_patient_info(patient_id: str) -> Dict:
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_patient_info(patient_id: str, format: Optional[str] = None) -> Dict:
     """Retrieve patient demographic information."""
-    if patient_id not in SAMPLE_PATIENTS:
+    patient = store.get_patient(patient_id)
+    if patient is None:
         return {"error": f"Patient {patient_id} not found"}
     
-    return SAMPLE_PATIENTS[patient_id]
+    return _respond(patient, format)
 
 @mcp.tool(description="Get complete medical history for a patient")
-def get_patient_history(patient_id: str) -> Dict:
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_patient_history(patient_id: str, format: Optional[str] = None) -> Dict:
     """Retrieve complete medical history for a patient."""
-    if patient_id not in SAMPLE_PATIENTS:
+    if patient_id not in store:
         return {"error": f"Patient {patient_id} not found"}
     
-    history = SAMPLE_MEDICAL_HISTORY.get(patient_id, [])
-    return {
+    history = store.get_conditions(patient_id)
+    return _respond({
         "patient_id": patient_id,
         "medical_history": history,
         "total_conditions": len(history)
-    }
+    }, format)
 
-@mcp.tool(description="Get lab results for a patient within specified timeframe")
-def get_lab_results(patient_id: str, days_back: int = 365) -> Dict:
+@mcp.tool(description="Get lab results for a patient within specified timeframe, oldest first, one page "
+                      "of up to limit results. Pass the returned next_cursor as cursor to get the next page; "
+                      "next_cursor is null on the last page.")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_lab_results(patient_id: str, days_back: int = 365, limit: int = 100, offset: int = 0,
+                    cursor: Optional[str] = None, format: Optional[str] = None) -> Dict:
     """Retrieve lab results for a patient within specified timeframe."""
-    if patient_id not in SAMPLE_PATIENTS:
+    if patient_id not in store:
         return {"error": f"Patient {patient_id} not found"}
     
-    lab_results = SAMPLE_LAB_RESULTS.get(patient_id, [])
+    since_day = _cutoff_day(days_back)
+    if cursor:
+        # The cursor pins the window, so "today" moving on between pages does not shift it
+        try:
+            since_day, offset = _read_lab_cursor(cursor, patient_id)
+        except ValueError as e:
+            return {"error": str(e)}
+    lab_results, total = store.labs_since(patient_id, since_day, offset, limit)
+    next_offset = offset + len(lab_results)
+    more = next_offset < total
     
-    # Filter by date range (simplified for sample data)
-    cutoff_date = datetime.now() - timedelta(days=days_back)
-    filtered_results = []
+    return _respond({
+        "patient_id": patient_id,
+        "lab_results": lab_results,
+        "total_results": total,
+        "returned": len(lab_results),
+        "next_offset": next_offset if more else None,
+        "next_cursor": _lab_cursor(patient_id, since_day, next_offset) if more else None,
+        "date_range": f"Last {days_back} days"
+    }, format)
+
+@mcp.tool(description="Get demographics and medical history for many patients in one call. "
+                      f"Prefer this over repeated get_patient_info/get_patient_history calls (max {MAX_BULK_PATIENTS} IDs).")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_patients_bulk(patient_ids: List[str], include_history: bool = True, format: Optional[str] = None) -> Dict:
+    """Retrieve demographics, and optionally medical history, for a list of patients."""
+    if len(patient_ids) > MAX_BULK_PATIENTS:
+        return {"error": f"Too many patient IDs ({len(patient_ids)}), maximum is {MAX_BULK_PATIENTS}"}
     
-    for result in lab_results:
-        result_date = datetime.strptime(result["collection_date"], "%Y-%m-%d")
-        if result_date >= cutoff_date:
-            filtered_results.append(result)
+    patients = []
+    not_found = []
+    for patient_id in dict.fromkeys(patient_ids):
+        patient = store.get_patient(patient_id)
+        if patient is None:
+            not_found.append(patient_id)
+            continue
+        if include_history:
+            patient["medical_history"] = store.get_conditions(patient_id)
+        patients.append(patient)
     
-    return {
-        "patient_id": patient_id,
-        "lab_results": filtered_results,
-        "total_results": len(filtered_results),
+    return _respond({
+        "patients": patients,
+        "not_found": not_found,
+        "total_found": len(patients)
+    }, format)
+
+@mcp.tool(description="Get lab results for many patients within specified timeframe in one call. "
+                      f"Prefer this over repeated get_lab_results calls (max {MAX_BULK_PATIENTS} IDs).")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_lab_results_bulk(patient_ids: List[str], days_back: int = 365, limit_per_patient: int = 100,
+                         format: Optional[str] = None) -> Dict:
+    """Retrieve lab results for a list of patients within specified timeframe."""
+    if len(patient_ids) > MAX_BULK_PATIENTS:
+        return {"error": f"Too many patient IDs ({len(patient_ids)}), maximum is {MAX_BULK_PATIENTS}"}
+    
+    since_day = _cutoff_day(days_back)
+    results = {}
+    not_found = []
+    for patient_id in dict.fromkeys(patient_ids):
+        if patient_id not in store:
+            not_found.append(patient_id)
+            continue
+        lab_results, total = store.labs_since(patient_id, since_day, limit=limit_per_patient)
+        results[patient_id] = {
+            "lab_results": lab_results,
+            "total_results": total,
+            "returned": len(lab_results)
+        }
+    
+    return _respond({
+        "results": results,
+        "not_found": not_found,
         "date_range": f"Last {days_back} days"
-    }
+    }, format)
 
-@mcp.tool(description="Search for patients by name or ID")
-def search_patients(query: str) -> Dict:
-    """Search for patients by name or patient ID."""
-    results = []
-    query_lower = query.lower()
+@mcp.tool(description="Search for patients by name, ID or medical condition (e.g. 'diabetes'). "
+                      "search_by is one of 'all', 'name' (name or ID) or 'condition'. "
+                      "Name matches are ranked and tolerate typos.")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def search_patients(query: str, limit: int = 20, search_by: str = "all", format: Optional[str] = None) -> Dict:
+    """Search for patients by name, patient ID or condition."""
+    if search_by not in ("all", "name", "condition"):
+        return {"error": f"Invalid search_by '{search_by}', expected 'all', 'name' or 'condition'"}
     
-    for patient_id, patient_data in SAMPLE_PATIENTS.items():
-        if (query_lower in patient_id.lower() or 
-            query_lower in patient_data["name"].lower()):
-            results.append({
-                "patient_id": patient_id,
-                "name": patient_data["name"],
-                "date_of_birth": patient_data["date_of_birth"],
-                "gender": patient_data["gender"]
-            })
+    matches = []
+    if search_by in ("all", "name"):
+        # Exact patient IDs skip the index entirely
+        if query.strip().upper() in store:
+            matches.append((query.strip().upper(), {"match": "id", "score": 2.0}))
+        else:
+            matches += [(pid, {"match": "name", "score": score})
+                        for pid, score in search_index.search(query, limit)]
+    if search_by in ("all", "condition"):
+        matches += [(pid, {"match": "condition", "condition": condition})
+                    for pid, condition in search_index.search_conditions(query, limit)]
     
-    return {
+    results = []
+    seen = set()
+    for patient_id, match in matches:
+        if patient_id in seen or len(results) >= limit:
+            continue
+        seen.add(patient_id)
+        patient_data = store.get_patient(patient_id)
+        results.append({
+            "patient_id": patient_id,
+            "name": patient_data["name"],
+            "date_of_birth": patient_data["date_of_birth"],
+            "gender": patient_data["gender"],
+            **match
+        })
+    
+    return _respond({
         "query": query,
         "results": results,
         "total_found": len(results)
-    }
+    }, format)
 
-@mcp.tool(description="Get comprehensive patient summary including demographics, history, and recent labs")
-def get_patient_summary(patient_id: str, include_labs_days: int = 365) -> Dict:
+@mcp.tool(description="Get comprehensive patient summary including demographics, history, and recent labs. "
+                      "With labs_page_size set, only the first page of recent labs is included and "
+                      "labs_next_cursor continues through get_lab_results.")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_patient_summary(patient_id: str, include_labs_days: int = 365, labs_page_size: Optional[int] = None,
+                        format: Optional[str] = None) -> Dict:
     """Get comprehensive patient summary."""
-    if patient_id not in SAMPLE_PATIENTS:
+    page_size = SUMMARY_LAB_PAGE_SIZE if labs_page_size is None else labs_page_size
+    cache_key = (patient_id, include_labs_days, page_size)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        summary, age = cached
+        return _respond({**summary, "cache_age": round(age, 3)}, format)
+    
+    cache_version = summary_cache.group_version(patient_id)
+    patient_info = store.get_patient(patient_id)
+    if patient_info is None:
         return {"error": f"Patient {patient_id} not found"}
     
     # Get all patient data
-    patient_info = SAMPLE_PATIENTS[patient_id]
-    medical_history = SAMPLE_MEDICAL_HISTORY.get(patient_id, [])
-    lab_results = SAMPLE_LAB_RESULTS.get(patient_id, [])
-    
-    # Filter recent lab results
-    cutoff_date = datetime.now() - timedelta(days=include_labs_days)
-    recent_labs = []
-    for result in lab_results:
-        result_date = datetime.strptime(result["collection_date"], "%Y-%m-%d")
-        if result_date >= cutoff_date:
-            recent_labs.append(result)
+    medical_history = store.get_conditions(patient_id)
     
     # Get active conditions
     active_conditions = [h for h in medical_history if h["status"].lower() == "active"]
     
+    # Filter recent lab results
+    since_day = _cutoff_day(include_labs_days)
+    if page_size > 0:
+        # Paged: risk rules read the window a page at a time and only the first page is kept
+        recent_lab_count = store.lab_count_since(patient_id, since_day)
+        pages = store.iter_lab_pages(patient_id, since_day, page_size=page_size)
+        recent_labs = next(pages, [])
+        risk_factors = _generate_risk_factors(active_conditions,
+                                              itertools.chain(recent_labs, itertools.chain.from_iterable(pages)))
+    else:
+        recent_labs, recent_lab_count = store.labs_since(patient_id, since_day)
+        risk_factors = _generate_risk_factors(active_conditions, recent_labs)
+    
     # Generate summary
     summary = {
         "patient_info": patient_info,
@@ -238,37 +742,156 @@ def get_patient_summary(patient_id: str, include_labs_days: int = 365) -> Dict:
         "summary_stats": {
             "total_conditions": len(medical_history),
             "active_conditions": len(active_conditions),
-            "recent_lab_count": len(recent_labs)
+            "recent_lab_count": recent_lab_count
         },
-        "risk_factors": _generate_risk_factors(active_conditions, recent_labs),
+        "risk_factors": risk_factors,
         "summary_generated": datetime.now().isoformat()
     }
+    if page_size > 0:
+        more = len(recent_labs) < recent_lab_count
+        summary["labs_next_cursor"] = _lab_cursor(patient_id, since_day, len(recent_labs)) if more else None
+    summary_cache.set(cache_key, summary, group=patient_id, version=cache_version)
     
-    return summary
+    return _respond({**summary, "cache_age": 0.0}, format)
 
-def _generate_risk_factors(conditions: List[Dict], lab_results: List[Dict]) -> List[str]:
+def _generate_risk_factors(conditions: List[Dict], lab_results: Iterable[Dict]) -> List[str]:
     """Generate risk factors based on conditions and lab results."""
-    risk_factors = []
+    return risk_engine.evaluate(conditions, lab_results)
+
+@mcp.tool(description="Screen many patients for risk factors in one call. Omit patient_ids to screen "
+                      "every patient. Returns counts per risk factor and patients with at least one risk factor.")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def screen_population_risk(patient_ids: Optional[List[str]] = None, include_labs_days: int = 365,
+                           limit: int = 100, format: Optional[str] = None) -> Dict:
+    """Population-level risk screening over active conditions and recent labs."""
+    since_day = _cutoff_day(include_labs_days)
+    ids = [pid for pid in (patient_ids if patient_ids is not None else store.patient_ids()) if pid in store]
+    
+    risk_by_patient = risk_engine.evaluate_batch(
+        (pid,
+         [c for c in store.get_conditions(pid) if c["status"].lower() == "active"],
+         itertools.chain.from_iterable(store.iter_lab_pages(pid, since_day)))
+        for pid in ids
+    )
+    
+    factor_counts = {}
+    at_risk = []
+    for pid, risk_factors in risk_by_patient.items():
+        for factor in risk_factors:
+            factor_counts[factor] = factor_counts.get(factor, 0) + 1
+        if risk_factors and len(at_risk) < limit:
+            at_risk.append({"patient_id": pid, "risk_factors": risk_factors})
+    
+    return _respond({
+        "patients_screened": len(risk_by_patient),
+        "patients_not_found": [pid for pid in patient_ids or [] if pid not in store],
+        "risk_factor_counts": factor_counts,
+        "patients_at_risk": at_risk,
+        "date_range": f"Last {include_labs_days} days"
+    }, format)
+
+@mcp.tool(description="Lab value trends over time. Per test: slope (change per year), rolling mean of the last "
+                      "window results, min/max, results outside the reference range and abnormal-flag transitions "
+                      "(e.g. N->H). Give patient_id for one patient's trends, or patient_ids (omit both for every "
+                      "patient) for cohort aggregates per test. test_names filters tests by name, e.g. ['glucose'].")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def get_lab_trends(patient_id: Optional[str] = None, patient_ids: Optional[List[str]] = None,
+                   test_names: Optional[List[str]] = None, days_back: int = 730, window: int = 3,
+                   format: Optional[str] = None) -> Dict:
+    """Vectorized lab trend statistics for one patient or a cohort."""
+    # One index generation for the whole call, even if compaction publishes a new one meanwhile
+    index = lab_trend_index
+    since_day = _cutoff_day(days_back)
+    tests = index.tests_matching(test_names)
+    if patient_id is not None:
+        if patient_id not in store:
+            return {"error": f"Patient {patient_id} not found"}
+        trends = patient_trends(index, patient_id, tests, since_day, window,
+                                lambda day: date.fromordinal(day).isoformat() if day > 0 else "")
+        return _respond({
+            "patient_id": patient_id,
+            "trends": trends,
+            "tests_found": len(trends),
+            "date_range": f"Last {days_back} days"
+        }, format)
     
-    # Check conditions
-    condition_names = [c["condition"].lower() for c in conditions]
-    if any("diabetes" in name for name in condition_names):
-        risk_factors.append("Diabetes - requires ongoing monitoring")
-    if any("hypertension" in name for name in condition_names):
-        risk_factors.append("Hypertension - cardiovascular risk factor")
-    if any("coronary" in name or "heart" in name for name in condition_names):
-        risk_factors.append("Cardiovascular disease - high risk")
+    not_found = [pid for pid in patient_ids or [] if pid not in store]
+    trends = cohort_trends(index, patient_ids, tests, since_day, window)
+    return _respond({
+        "patients_requested": len(patient_ids) if patient_ids is not None else len(store),
+        "patients_not_found": not_found,
+        "trends": trends,
+        "tests_found": len(trends),
+        "date_range": f"Last {days_back} days"
+    }, format)
+
+@mcp.tool(description="Find patients matching condition and lab criteria across the whole population, e.g. "
+                      "active diabetics with HbA1c above 7 in the last 90 days: conditions=['diabetes'], "
+                      "condition_status='active', lab_tests=['a1c'], lab_value_min=7, days_back=90. "
+                      "Names match by substring, case-insensitive. Condition criteria must hold for one condition "
+                      "and lab criteria for one lab result; abnormal_flags are among N, H, L, A. Returns the number "
+                      "of matching patients and one page of their IDs; pass next_offset as offset for the next page.")
+@tool_metrics.instrumented
+@coalesced
+@offloaded
+def query_cohort(conditions: Optional[List[str]] = None, condition_status: Optional[str] = None,
+                 condition_severity: Optional[str] = None, lab_tests: Optional[List[str]] = None,
+                 abnormal_flags: Optional[List[str]] = None, lab_value_min: Optional[float] = None,
+                 lab_value_max: Optional[float] = None, days_back: Optional[int] = None,
+                 limit: int = 100, offset: int = 0, format: Optional[str] = None) -> Dict:
+    """Count and list the patients matching every given criterion, from precomputed patient bitmaps."""
+    # One index generation for the whole call, even if compaction publishes a new one meanwhile
+    index = cohort_index
+    flags = [flag.upper() for flag in abnormal_flags] if abnormal_flags is not None else None
+    invalid = [flag for flag in flags or [] if flag not in FLAG_NAMES]
+    if invalid:
+        return {"error": f"Invalid abnormal_flags {invalid}, expected N, H, L or A"}
+    if limit <= 0:
+        # An empty page would hand a pager the same offset back forever
+        return {"error": f"Invalid limit {limit}, expected a positive number"}
     
-    # Check lab results
-    for lab in lab_results:
-        if lab["abnormal_flag"] == "H":
-            if "glucose" in lab["test_name"].lower():
-                risk_factors.append("Elevated glucose levels")
-            elif "cholesterol" in lab["test_name"].lower():
-                risk_factors.append("High cholesterol levels")
-            elif "hba1c" in lab["test_name"].lower():
-                risk_factors.append("Poor diabetes control")
+    mask = index.query(
+        conditions=conditions, status=condition_status, severity=condition_severity,
+        lab_tests=lab_tests, flags=flags, since_day=_cutoff_day(days_back) if days_back is not None else None,
+        value_min=lab_value_min, value_max=lab_value_max,
+    )
+    total = int(mask.sum())
+    offset = max(offset, 0)
+    patient_ids = index.patient_ids(mask, offset, limit)
+    next_offset = offset + len(patient_ids)
     
-    return list(set(risk_factors))  # Remove duplicates
+    return _respond({
+        "patient_count": total,
+        "patients_searched": len(mask),
+        "patient_ids": patient_ids,
+        "returned": len(patient_ids),
+        "next_offset": next_offset if next_offset < total else None,
+        "data_version": store.version,
+        "date_range": f"Last {days_back} days" if days_back is not None else "All time"
+    }, format)
+
+def create_app():
+    """ASGI app factory used by uvicorn for each worker process."""
+    init_data()
+    start_store_maintenance()
+    return mcp.streamable_http_app()
 
-mcp.run(transport="streamable-http")
\ No newline at end of file
+if __name__ == "__main__":
+    init_data()
+    if MCP_WORKERS > 1:
+        import uvicorn
+        
+        # Workers re-import this module; have them map one shared snapshot rather than each parse the data
+        snapshot = os.environ.get("PATIENT_SNAPSHOT")
+        if snapshot and not store.base.read_only:
+            print(f"💾 Writing patient data snapshot {snapshot}")
+            write_snapshot(store.base, snapshot)
+        print(f"🚀 Starting {MCP_WORKERS} MCP workers on {MCP_HOST}:{MCP_PORT}")
+        uvicorn.run("mcpserver:create_app", factory=True, host=MCP_HOST, port=MCP_PORT, workers=MCP_WORKERS)
+    else:
+        start_store_maintenance()
+        mcp.run(transport="streamable-http")
\ No newline at end of file
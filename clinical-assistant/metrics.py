@@ -0,0 +1,219 @@
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pydantic_core
+from mcp.types import CallToolResult
+
+# Upper bounds of the latency (seconds) and response size (bytes) histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; not thread-safe on its own."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        out = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            out.append(("+Inf" if bound == float("inf") else f"{bound:g}", total))
+        return out
+
+
+class _ToolStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.errors: Dict[str, int] = {}
+        self.in_flight = 0
+
+
+def response_size(result) -> int:
+    """Bytes of the text content a tool result is sent as."""
+    if isinstance(result, CallToolResult):
+        return sum(len(block.text.encode("utf-8")) for block in result.content if hasattr(block, "text"))
+    # The same serialization FastMCP applies to plain results
+    return len(pydantic_core.to_json(result, fallback=str, indent=2))
+
+
+class ToolMetrics:
+    """Per-tool call latency, response size, error and in-flight counts, rendered for Prometheus."""
+
+    def __init__(self, namespace: str = "mcp"):
+        self.namespace = namespace
+        self._tools: Dict[str, _ToolStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, tool: str) -> _ToolStats:
+        stats = self._tools.get(tool)
+        if stats is None:
+            stats = self._tools.setdefault(tool, _ToolStats())
+        return stats
+
+    def instrumented(self, func):
+        """Record every call of an async tool function under the function's name."""
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with self._lock:
+                self._stats(name).in_flight += 1
+            started = time.perf_counter()
+            error = None
+            size = None
+            try:
+                result = await func(*args, **kwargs)
+                if isinstance(result, dict) and "error" in result:
+                    error = "result"
+                elif isinstance(result, CallToolResult) and result.isError:
+                    error = "result"
+                size = response_size(result)
+                return result
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    stats = self._stats(name)
+                    stats.in_flight -= 1
+                    stats.latency.observe(elapsed)
+                    if size is not None:
+                        stats.response_bytes.observe(size)
+                    if error:
+                        stats.errors[error] = stats.errors.get(error, 0) + 1
+        return wrapper
+
+    def render(self, extra: Optional[Dict[str, Dict[str, float]]] = None,
+               counters: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+        """Prometheus text exposition of all tool metrics, plus ``extra`` gauges and ``counters``.
+
+        Both are {metric: {label value: number}}; ``extra`` holds current values
+        such as sizes, ``counters`` totals that only grow, exposed as <metric>_total.
+        """
+        ns = self.namespace
+        lines = [
+            f"# HELP {ns}_tool_duration_seconds Tool call latency, including time queued for a worker thread.",
+            f"# TYPE {ns}_tool_duration_seconds histogram",
+        ]
+        with self._lock:
+            tools = {name: stats for name, stats in sorted(self._tools.items())}
+            for name, stats in tools.items():
+                lines += _histogram_lines(f"{ns}_tool_duration_seconds", name, stats.latency)
+            lines += [f"# HELP {ns}_tool_response_bytes Size of tool results as sent to the client.",
+                      f"# TYPE {ns}_tool_response_bytes histogram"]
+            for name, stats in tools.items():
+                lines += _histogram_lines(f"{ns}_tool_response_bytes", name, stats.response_bytes)
+            lines += [f"# HELP {ns}_tool_errors_total Tool calls that raised or returned an error, by kind.",
+                      f"# TYPE {ns}_tool_errors_total counter"]
+            for name, stats in tools.items():
+                for kind, count in sorted(stats.errors.items()):
+                    lines.append(f'{ns}_tool_errors_total{{tool="{name}",kind="{kind}"}} {count}')
+            lines += [f"# HELP {ns}_tool_in_flight Tool calls currently running.",
+                      f"# TYPE {ns}_tool_in_flight gauge"]
+            for name, stats in tools.items():
+                lines.append(f'{ns}_tool_in_flight{{tool="{name}"}} {stats.in_flight}')
+        for metric, values in (extra or {}).items():
+            lines += _sample_lines(f"{ns}_{metric}", "gauge", values)
+        for metric, values in (counters or {}).items():
+            lines += _sample_lines(f"{ns}_{metric}_total", "counter", values)
+        return "\n".join(lines) + "\n"
+
+
+def _sample_lines(metric: str, kind: str, values: Dict[str, float]) -> List[str]:
+    lines = [f"# TYPE {metric} {kind}"]
+    for label, value in values.items():
+        lines.append(f"{metric}{{{label}}} {value}" if label else f"{metric} {value}")
+    return lines
+
+
+def _histogram_lines(metric: str, tool: str, histogram: Histogram) -> List[str]:
+    lines = [f'{metric}_bucket{{tool="{tool}",le="{bound}"}} {count}' for bound, count in histogram.cumulative()]
+    lines.append(f'{metric}_sum{{tool="{tool}"}} {histogram.sum:.6f}')
+    lines.append(f'{metric}_count{{tool="{tool}"}} {histogram.count}')
+    return lines
+
+
+class CallProfiler:
+    """Accumulates cProfile statistics of the calls it runs, across threads.
+
+    Python allows one active profiler per process (3.12+ rejects a second
+    one), so one call is profiled at a time; calls overlapping it run
+    unprofiled and are only counted. For a view of every concurrent call,
+    sample the process with py-spy instead.
+    """
+
+    def __init__(self):
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self.calls = 0
+        self.skipped = 0
+
+    def call(self, func, *args, **kwargs):
+        if not self._active.acquire(blocking=False):
+            self._skip()
+            return func(*args, **kwargs)
+        try:
+            # cProfile only sees the thread it is enabled on, so each call gets its own profile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool (a debugger, coverage) holds the hook; never fail the call over it
+                self._skip()
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.calls += 1
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+        finally:
+            self._active.release()
+
+    def _skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> str:
+        with self._lock:
+            if self._stats is None:
+                return "No profiled calls yet\n"
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return (f"{self.calls} profiled calls ({self.skipped} overlapping calls ran unprofiled)\n"
+                + out.getvalue())
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self.calls = 0
+            self.skipped = 0
@@ -0,0 +1,452 @@
+import bisect
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Column layout of the three patient tables
+PATIENT_FIELDS = ("patient_id", "name", "date_of_birth", "gender", "age")
+CONDITION_FIELDS = ("condition", "diagnosis_date", "status", "severity", "notes", "provider")
+LAB_FIELDS = (
+    "test_name", "value", "unit", "reference_range", "status", "abnormal_flag",
+    "collection_date", "result_date", "ordering_provider", "notes",
+)
+
+DATA_FILE_EXTENSIONS = (".parquet", ".jsonl", ".ndjson", ".csv")
+
+# Snapshot file: magic, 8-byte aligned sections, JSON section table, trailer (table offset, length)
+SNAPSHOT_MAGIC = b"PSNAP001"
+_SNAPSHOT_TRAILER = struct.Struct("<QQ")
+_NULL_INT = -(2 ** 63)
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Stream row dicts from a CSV, JSONL or Parquet file."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif extension in (".jsonl", ".ndjson"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif extension == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("pyarrow is required to load Parquet files") from e
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Unsupported data file format: {path}")
+
+
+def _find_data_file(data_dir: str, name: str) -> Optional[str]:
+    for extension in DATA_FILE_EXTENSIONS:
+        path = os.path.join(data_dir, name + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def day_ordinal(value: str) -> int:
+    """Convert a YYYY-MM-DD date to its proleptic Gregorian day number (0 if unparseable)."""
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+def _normalize(field: str, value):
+    if field == "age":
+        return int(value) if value not in (None, "") else None
+    if value is None:
+        return ""
+    # Interning collapses repeated codes (status, units, providers) to one object
+    return sys.intern(str(value))
+
+
+def normalize_record(fields: tuple, record: Dict) -> Dict:
+    """A row dict holding exactly ``fields``, with values as the store keeps them."""
+    return {field: _normalize(field, record.get(field)) for field in fields}
+
+
+class _Table:
+    """Column-oriented storage for rows sharing one schema."""
+
+    def __init__(self, fields: tuple):
+        self.fields = fields
+        self.columns: Dict[str, list] = {field: [] for field in fields}
+
+    def __len__(self) -> int:
+        return len(self.columns[self.fields[0]])
+
+    def append(self, record: Dict):
+        for field in self.fields:
+            self.columns[field].append(_normalize(field, record.get(field)))
+
+    def insert(self, index: int, record: Dict):
+        for field in self.fields:
+            self.columns[field].insert(index, _normalize(field, record.get(field)))
+
+    def reorder(self, order: List[int]):
+        for field in self.fields:
+            column = self.columns[field]
+            self.columns[field] = [column[i] for i in order]
+
+    def row(self, index: int) -> Dict:
+        return {field: self.columns[field][index] for field in self.fields}
+
+    def rows(self, start: int, end: int) -> List[Dict]:
+        return [self.row(i) for i in range(start, end)]
+
+
+class _MappedStrColumn:
+    """Read-only string column decoded on access from a memory-mapped snapshot."""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
+
+
+class _MappedIntColumn:
+    """Read-only integer column from a memory-mapped snapshot; missing values read as None."""
+
+    def __init__(self, values: memoryview):
+        self._values = values
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, index: int) -> Optional[int]:
+        value = self._values[index]
+        return None if value == _NULL_INT else value
+
+
+class PatientStore:
+    """Patients, conditions and lab results held in columnar tables.
+
+    Condition and lab rows are grouped by patient, so each patient's rows are a
+    contiguous slice located through per-patient offsets. Lab rows are kept
+    sorted by collection date within each slice, with the dates also held as
+    integer day ordinals so time windows are found by binary search. Patient
+    lookup is a single dict probe, so read cost is independent of the number
+    of patients.
+    """
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._patients = _Table(PATIENT_FIELDS)
+        self._conditions = _Table(CONDITION_FIELDS)
+        self._labs = _Table(LAB_FIELDS)
+        # Rows of patient i live in [offsets[i], offsets[i + 1])
+        self._condition_offsets = array("q", [0])
+        self._lab_offsets = array("q", [0])
+        # Collection date of every lab row as a day ordinal, parallel to _labs
+        self._lab_days = array("i")
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._write_lock = threading.Lock()
+        # Set for stores opened from a snapshot; keeps the mapping alive
+        self._mmap: Optional[mmap.mmap] = None
+
+    # ---------- Loading ----------
+
+    @classmethod
+    def from_records(cls, patients: Iterable[Dict], conditions: Iterable[Dict],
+                     labs: Iterable[Dict]) -> "PatientStore":
+        """Build a store from flat row iterables; child rows carry a patient_id column."""
+        store = cls()
+        for patient in patients:
+            store._append_patient(patient)
+        store._condition_offsets = store._load_grouped(store._conditions, conditions)
+        store._lab_offsets = store._load_grouped(store._labs, labs, sort_field="collection_date")
+        store._lab_days = array("i", map(day_ordinal, store._labs.columns["collection_date"]))
+        return store
+
+    @classmethod
+    def from_directory(cls, data_dir: str) -> "PatientStore":
+        """Load patients, conditions and labs files (CSV/JSONL/Parquet) from a directory."""
+        tables = {}
+        for name in ("patients", "conditions", "labs"):
+            path = _find_data_file(data_dir, name)
+            if path is None and name == "patients":
+                raise FileNotFoundError(f"No patients data file found in {data_dir}")
+            tables[name] = read_records(path) if path else iter(())
+        return cls.from_records(tables["patients"], tables["conditions"], tables["labs"])
+
+    @classmethod
+    def from_sample(cls, patients: Dict[str, Dict], history: Dict[str, List[Dict]],
+                    labs: Dict[str, List[Dict]]) -> "PatientStore":
+        """Build a store from the nested per-patient dicts used for sample data."""
+        return cls.from_records(
+            patients.values(),
+            ({"patient_id": pid, **row} for pid, rows in history.items() for row in rows),
+            ({"patient_id": pid, **row} for pid, rows in labs.items() for row in rows),
+        )
+
+    @classmethod
+    def open_snapshot(cls, path: str) -> "PatientStore":
+        """Open a snapshot written by ``write_snapshot`` as a read-only, memory-mapped store.
+
+        Column data stays in the OS page cache, so every process that opens the
+        same snapshot shares one copy of it; only the patient ID index is built
+        in process memory.
+        """
+        store = cls()
+        with open(path, "rb") as f:
+            store._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(store._mmap)
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a patient data snapshot")
+        table_offset, table_length = _SNAPSHOT_TRAILER.unpack(view[-_SNAPSHOT_TRAILER.size:])
+        sections = json.loads(bytes(view[table_offset:table_offset + table_length]))
+
+        def section(name: str) -> memoryview:
+            offset, length, typecode = sections[name]
+            data = view[offset:offset + length]
+            return data if typecode == "B" else data.cast(typecode)
+
+        for table in (store._patients, store._conditions, store._labs):
+            for field in table.fields:
+                key = f"{_table_name(table)}.{field}"
+                if key + ".data" in sections:
+                    table.columns[field] = _MappedStrColumn(section(key + ".offsets"), section(key + ".data"))
+                else:
+                    table.columns[field] = _MappedIntColumn(section(key))
+        store._condition_offsets = section("condition_offsets")
+        store._lab_offsets = section("lab_offsets")
+        store._lab_days = section("lab_days")
+        patient_ids = store._patients.columns["patient_id"]
+        store._index = {sys.intern(patient_ids[i]): i for i in range(len(patient_ids))}
+        return store
+
+    @property
+    def read_only(self) -> bool:
+        return self._mmap is not None
+
+    def _append_patient(self, patient: Dict) -> int:
+        patient_id = str(patient["patient_id"])
+        if patient_id in self._index:
+            raise ValueError(f"Duplicate patient {patient_id}")
+        self._index[sys.intern(patient_id)] = len(self._patients)
+        self._patients.append(patient)
+        return self._index[patient_id]
+
+    def _load_grouped(self, table: _Table, records: Iterable[Dict],
+                      sort_field: Optional[str] = None) -> array:
+        """Append rows in arrival order, then regroup them by patient and return offsets."""
+        owners = []
+        for record in records:
+            row = self._index.get(str(record.get("patient_id")))
+            if row is None:
+                continue
+            owners.append(row)
+            table.append(record)
+
+        if sort_field:
+            keys = table.columns[sort_field]
+            order = sorted(range(len(owners)), key=lambda i: (owners[i], keys[i]))
+        else:
+            order = sorted(range(len(owners)), key=owners.__getitem__)
+        table.reorder(order)
+
+        offsets = array("q", [0]) * (len(self._patients) + 1)
+        for owner in owners:
+            offsets[owner + 1] += 1
+        for i in range(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+        return offsets
+
+    # ---------- Reads ----------
+
+    def __len__(self) -> int:
+        return len(self._patients)
+
+    def __contains__(self, patient_id: str) -> bool:
+        return patient_id in self._index
+
+    def patient_ids(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def get_patient(self, patient_id: str) -> Optional[Dict]:
+        row = self._index.get(patient_id)
+        return None if row is None else self._patients.row(row)
+
+    def get_conditions(self, patient_id: str) -> List[Dict]:
+        row = self._index.get(patient_id)
+        if row is None:
+            return []
+        return self._conditions.rows(self._condition_offsets[row], self._condition_offsets[row + 1])
+
+    def get_labs(self, patient_id: str) -> List[Dict]:
+        """Lab results for a patient, oldest collection date first."""
+        row = self._index.get(patient_id)
+        if row is None:
+            return []
+        return self._labs.rows(self._lab_offsets[row], self._lab_offsets[row + 1])
+
+    def labs_since(self, patient_id: str, since_day: int, offset: int = 0,
+                   limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Labs collected on or after day ordinal ``since_day``, oldest first.
+
+        Returns the requested page of rows and the total number of rows in the window.
+        """
+        row = self._index.get(patient_id)
+        if row is None:
+            return [], 0
+        end = self._lab_offsets[row + 1]
+        start = bisect.bisect_left(self._lab_days, since_day, self._lab_offsets[row], end)
+        page_start = min(start + max(offset, 0), end)
+        page_end = end if limit is None else min(page_start + max(limit, 0), end)
+        return self._labs.rows(page_start, page_end), end - start
+
+    def iter_lab_pages(self, patient_id: str, since_day: int, offset: int = 0,
+                       page_size: int = 100) -> Iterator[List[Dict]]:
+        """Pages of ``labs_since`` rows, oldest first, each built only when the caller asks for it."""
+        row = self._index.get(patient_id)
+        if row is None:
+            return
+        end = self._lab_offsets[row + 1]
+        start = bisect.bisect_left(self._lab_days, since_day, self._lab_offsets[row], end)
+        for page_start in range(min(start + max(offset, 0), end), end, max(page_size, 1)):
+            yield self._labs.rows(page_start, min(page_start + page_size, end))
+
+    def lab_columns(self, fields: Iterable[str]) -> Tuple[Dict[str, Sequence], Sequence[int], Sequence[int]]:
+        """Whole lab columns, per-patient row offsets (in ``patient_ids`` order) and collection day
+        ordinals, for building derived indexes without materializing row dicts. Read-only."""
+        return {field: self._labs.columns[field] for field in fields}, self._lab_offsets, self._lab_days
+
+    def condition_columns(self, fields: Iterable[str]) -> Tuple[Dict[str, Sequence], Sequence[int]]:
+        """Whole condition columns and per-patient row offsets (in ``patient_ids`` order). Read-only."""
+        return {field: self._conditions.columns[field] for field in fields}, self._condition_offsets
+
+    def lab_count_since(self, patient_id: str, since_day: int) -> int:
+        row = self._index.get(patient_id)
+        if row is None:
+            return 0
+        end = self._lab_offsets[row + 1]
+        return end - bisect.bisect_left(self._lab_days, since_day, self._lab_offsets[row], end)
+
+    # ---------- Updates ----------
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """Register callback(kind, patient_id), called after every update."""
+        self._listeners.append(callback)
+
+    def _notify(self, kind: str, patient_id: str):
+        for callback in self._listeners:
+            callback(kind, patient_id)
+
+    def add_patient(self, patient: Dict):
+        self._check_writable()
+        with self._write_lock:
+            self._append_patient(patient)
+            self._condition_offsets.append(self._condition_offsets[-1])
+            self._lab_offsets.append(self._lab_offsets[-1])
+        self._notify("patient", str(patient["patient_id"]))
+
+    def add_conditions(self, patient_id: str, conditions: List[Dict]):
+        self._check_writable()
+        with self._write_lock:
+            row = self._require(patient_id)
+            for condition in conditions:
+                self._insert(self._conditions, self._condition_offsets, row,
+                             self._condition_offsets[row + 1], condition)
+        self._notify("conditions", patient_id)
+
+    def add_labs(self, patient_id: str, labs: List[Dict]):
+        self._check_writable()
+        with self._write_lock:
+            row = self._require(patient_id)
+            dates = self._labs.columns["collection_date"]
+            for lab in labs:
+                position = bisect.bisect_right(
+                    dates, str(lab.get("collection_date", "")),
+                    self._lab_offsets[row], self._lab_offsets[row + 1],
+                )
+                self._insert(self._labs, self._lab_offsets, row, position, lab)
+                self._lab_days.insert(position, day_ordinal(dates[position]))
+        self._notify("labs", patient_id)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("Snapshot-backed patient stores are read-only")
+
+    def _require(self, patient_id: str) -> int:
+        row = self._index.get(patient_id)
+        if row is None:
+            raise KeyError(f"Patient {patient_id} not found")
+        return row
+
+    @staticmethod
+    def _insert(table: _Table, offsets: array, row: int, position: int, record: Dict):
+        # Shifts every later row; fine for occasional edits, bulk data goes through from_records
+        table.insert(position, record)
+        for i in range(row + 1, len(offsets)):
+            offsets[i] += 1
+
+
+def _table_name(table: _Table) -> str:
+    return {PATIENT_FIELDS: "patients", CONDITION_FIELDS: "conditions", LAB_FIELDS: "labs"}[table.fields]
+
+
+def write_snapshot(store: PatientStore, path: str):
+    """Write ``store`` to an immutable snapshot file for ``PatientStore.open_snapshot``.
+
+    The file is written next to ``path`` and renamed into place, so readers
+    never see a partial snapshot.
+    """
+    sections = {}
+
+    def write_section(f, name: str, payload: bytes, typecode: str = "B"):
+        f.write(b"\0" * (-f.tell() % 8))
+        sections[name] = [f.tell(), len(payload), typecode]
+        f.write(payload)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        for table in (store._patients, store._conditions, store._labs):
+            for field in table.fields:
+                key = f"{_table_name(table)}.{field}"
+                column = table.columns[field]
+                if field == "age":
+                    values = array("q", (_NULL_INT if v is None else v for v in column))
+                    write_section(f, key, values.tobytes(), "q")
+                    continue
+                encoded = [column[i].encode("utf-8") for i in range(len(column))]
+                offsets = array("q", [0]) * (len(encoded) + 1)
+                for i, value in enumerate(encoded):
+                    offsets[i + 1] = offsets[i] + len(value)
+                write_section(f, key + ".offsets", offsets.tobytes(), "q")
+                write_section(f, key + ".data", b"".join(encoded))
+        write_section(f, "condition_offsets", array("q", store._condition_offsets).tobytes(), "q")
+        write_section(f, "lab_offsets", array("q", store._lab_offsets).tobytes(), "q")
+        write_section(f, "lab_days", array("i", store._lab_days).tobytes(), "i")
+
+        table = json.dumps(sections).encode("utf-8")
+        table_offset = f.tell()
+        f.write(table)
+        f.write(_SNAPSHOT_TRAILER.pack(table_offset, len(table)))
+    os.replace(temp_path, path)
+
+
+if __name__ == "__main__":
+    # Build a snapshot offline: python patient_store.py <data_dir> <snapshot_path>
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python patient_store.py <data_dir> <snapshot_path>")
+    write_snapshot(PatientStore.from_directory(sys.argv[1]), sys.argv[2])
+    print(f"✅ Wrote snapshot {sys.argv[2]}")
@@ -0,0 +1,200 @@
+import json
+import logging
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+PATIENT_ID_PATTERN = re.compile(r"\bPAT\d+\b", re.IGNORECASE)
+# Tool arguments that name the patients a result was built from
+PATIENT_ARGUMENTS = ("patient_id", "patient_ids")
+# An unreachable server or an unexpected /data_versions body; either way the cache is bypassed
+VERSION_ERRORS = (httpx.HTTPError, ValueError, KeyError, TypeError)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case, whitespace and trailing punctuation do not change what is being asked."""
+    return " ".join(prompt.lower().split()).rstrip(" ?.!")
+
+
+def prompt_patient_ids(prompt: str) -> Tuple[str, ...]:
+    return tuple(sorted({pid.upper() for pid in PATIENT_ID_PATTERN.findall(prompt)}))
+
+
+def last_turn(messages: List[Dict]) -> List[Dict]:
+    """Messages of the latest turn, from its user question to the final answer."""
+    for i in range(len(messages) - 1, -1, -1):
+        message = messages[i]
+        if message["role"] == "user" and not any("toolResult" in block for block in message.get("content", [])):
+            return messages[i:]
+    return []
+
+
+def turn_dependencies(turn: List[Dict]) -> Tuple[List[str], bool]:
+    """Patients whose data the turn's tool calls read, and whether any call read data beyond them."""
+    patients = set()
+    population = False
+    for message in turn:
+        for block in message.get("content", []):
+            tool_use = block.get("toolUse")
+            if tool_use is None:
+                continue
+            arguments = tool_use.get("input") or {}
+            if isinstance(arguments, str):
+                arguments = json.loads(arguments or "{}")
+            named = [arguments.get(name) for name in PATIENT_ARGUMENTS if arguments.get(name)]
+            if not named:
+                # e.g. search_patients or screening the whole population
+                population = True
+            for value in named:
+                patients.update([value] if isinstance(value, str) else value)
+    return sorted(pid.upper() for pid in patients), population
+
+
+class DataVersionClient:
+    """Reads data versions from the MCP server's /data_versions route."""
+
+    def __init__(self, mcp_url: str, timeout: float = 2.0):
+        base_url = mcp_url.rstrip("/")
+        if base_url.endswith("/mcp"):
+            base_url = base_url[:-len("/mcp")]
+        self._client = httpx.Client(base_url=base_url, timeout=timeout)
+
+    def __call__(self, patient_ids: Iterable[str]) -> Dict:
+        response = self._client.get("/data_versions", params={"patient_ids": ",".join(patient_ids)})
+        response.raise_for_status()
+        return response.json()
+
+
+def _load_embedder(model_name: str):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("⚠️  sentence-transformers is not installed, response cache uses exact matches only")
+        return None
+    model = SentenceTransformer(model_name, device="cpu")
+    return lambda text: model.encode(text, normalize_embeddings=True)
+
+
+class ResponseCache:
+    """Answers to opening questions of a conversation, reused while the data behind them is unchanged.
+
+    Entries are keyed on model ID and normalized prompt and remember the data
+    versions of every patient the answer's tool calls read (or the global data
+    version when a call was not limited to named patients). A hit whose
+    versions no longer match the server's is dropped. With an embedding model
+    configured, a miss falls back to the most similar cached prompt that names
+    the same patients.
+    """
+
+    def __init__(self, versions: Callable[[Iterable[str]], Dict], maxsize: int = 512, ttl: float = 600.0,
+                 embedding_model: Optional[str] = None, similarity_threshold: float = 0.92):
+        self._versions = versions
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._embed = _load_embedder(embedding_model) if embedding_model else None
+        self._embeddings: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.stale = 0
+
+    @staticmethod
+    def cacheable(prompt: str, history: List[Dict]) -> bool:
+        """Only opening questions; a follow-up can depend on earlier turns even when it names a patient."""
+        return not history
+
+    def snapshot(self) -> Optional[Dict]:
+        """Data versions to compare against after a turn, taken before it runs."""
+        try:
+            versions = self._versions(())
+            return {"data_epoch": versions["data_epoch"], "data_version": versions["data_version"]}
+        except VERSION_ERRORS as e:
+            logger.warning(f"Could not read data versions, not caching this turn: {e}")
+            return None
+
+    def lookup(self, model_id: str, prompt: str) -> Optional[str]:
+        key = (model_id, normalize_prompt(prompt))
+        cached = self._entries.get(key)
+        similar = False
+        if cached is None and self._embed is not None:
+            key = self._most_similar(model_id, key[1], prompt_patient_ids(prompt))
+            cached = self._entries.get(key) if key else None
+            similar = True
+        if cached is None:
+            return None
+
+        entry, _ = cached
+        try:
+            current = self._dependency_versions(self._versions(entry["patients"]), entry["population"])
+        except VERSION_ERRORS as e:
+            logger.warning(f"Could not check data versions, bypassing the response cache: {e}")
+            return None
+        if current != entry["versions"]:
+            # The data this answer was built from has changed since
+            self._entries.discard(key)
+            self.stale += 1
+            return None
+        if similar:
+            self.similar_hits += 1
+        else:
+            self.exact_hits += 1
+        return entry["response"]
+
+    def store(self, model_id: str, prompt: str, response: str, turn: List[Dict], before: Optional[Dict]):
+        if before is None:
+            return
+        patients, population = turn_dependencies(turn)
+        patients = sorted(set(patients) | set(prompt_patient_ids(prompt)))
+        try:
+            after = self._versions(patients)
+            if (after["data_epoch"], after["data_version"]) != (before["data_epoch"], before["data_version"]):
+                # Data changed while the answer was being generated
+                return
+            versions = self._dependency_versions(after, population)
+        except VERSION_ERRORS as e:
+            logger.warning(f"Could not read data versions, not caching the response: {e}")
+            return
+        key = (model_id, normalize_prompt(prompt))
+        self._entries.set(key, {
+            "response": response,
+            "patients": patients,
+            "population": population,
+            "versions": versions,
+        })
+        if self._embed is not None:
+            embedding = self._embed(key[1])
+            with self._lock:
+                self._embeddings[key] = (embedding, prompt_patient_ids(prompt))
+                if len(self._embeddings) > 2 * self._entries.maxsize:
+                    self._embeddings = {k: v for k, v in self._embeddings.items() if k in self._entries}
+
+    def stats(self) -> Dict:
+        return {**self._entries.stats(), "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits, "stale": self.stale}
+
+    @staticmethod
+    def _dependency_versions(versions: Dict, population: bool) -> Dict:
+        # Unless the answer read beyond its named patients, updates to other patients do not matter
+        return {
+            "data_epoch": versions["data_epoch"],
+            "data_version": versions["data_version"] if population else None,
+            "patients": versions["patients"],
+        }
+
+    def _most_similar(self, model_id: str, normalized: str, patient_ids: Tuple[str, ...]):
+        import numpy as np
+
+        with self._lock:
+            candidates = [(key, embedding) for key, (embedding, ids) in self._embeddings.items()
+                          if key[0] == model_id and ids == patient_ids]
+        if not candidates:
+            return None
+        similarities = np.stack([embedding for _, embedding in candidates]) @ self._embed(normalized)
+        best = int(np.argmax(similarities))
+        return candidates[best][0] if similarities[best] >= self.similarity_threshold else None
@@ -0,0 +1,140 @@
+import json
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# Default rule table. Rules are reported in table order; "source" selects whether
+# keywords are matched against condition names or (abnormal) lab test names.
+DEFAULT_RISK_RULES = [
+    {"id": "diabetes", "source": "condition", "keywords": ["diabetes"],
+     "risk_factor": "Diabetes - requires ongoing monitoring"},
+    {"id": "hypertension", "source": "condition", "keywords": ["hypertension"],
+     "risk_factor": "Hypertension - cardiovascular risk factor"},
+    {"id": "cardiovascular", "source": "condition", "keywords": ["coronary", "heart"],
+     "risk_factor": "Cardiovascular disease - high risk"},
+    {"id": "elevated_glucose", "source": "lab", "keywords": ["glucose"], "abnormal_flags": ["H"],
+     "risk_factor": "Elevated glucose levels"},
+    {"id": "high_cholesterol", "source": "lab", "keywords": ["cholesterol"], "abnormal_flags": ["H"],
+     "risk_factor": "High cholesterol levels"},
+    {"id": "diabetes_control", "source": "lab", "keywords": ["hba1c", "hemoglobin a1c"],
+     "abnormal_flags": ["H"], "risk_factor": "Poor diabetes control"},
+]
+
+RULE_SOURCES = ("condition", "lab")
+
+# Distinct condition/test names are few, so per-name matches are memoized up to this many
+MAX_MEMOIZED_NAMES = 65536
+
+
+def load_rules(path: str) -> List[Dict]:
+    """Read a rule table from a JSON file holding a list of rules (or {"rules": [...]})."""
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    if isinstance(rules, dict):
+        rules = rules.get("rules", [])
+    return rules
+
+
+class _KeywordAutomaton:
+    """Aho-Corasick automaton that reports every keyword found in a text in one pass."""
+
+    def __init__(self, keywords: Dict[str, Set[int]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[FrozenSet[int]] = [frozenset()]
+
+        for keyword, rule_indices in keywords.items():
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(frozenset())
+                state = next_state
+            self._out[state] = self._out[state] | rule_indices
+
+        # Breadth-first so every failure target is complete before it is inherited
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] | self._out[self._fail[next_state]]
+                queue.append(next_state)
+
+    def match(self, text: str) -> FrozenSet[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return frozenset(found)
+
+
+class RiskRuleEngine:
+    """Risk-factor rules compiled into one keyword automaton per rule source.
+
+    Each condition or lab test name is scanned once regardless of how many
+    rules there are, and results for repeated names are memoized. Output
+    follows rule-table order, so it is deterministic.
+    """
+
+    def __init__(self, rules: Optional[List[Dict]] = None):
+        self.rules = [self._validate(rule) for rule in (rules or DEFAULT_RISK_RULES)]
+        self._automata = {}
+        for source in RULE_SOURCES:
+            keywords: Dict[str, Set[int]] = {}
+            for i, rule in enumerate(self.rules):
+                if rule["source"] == source:
+                    for keyword in rule["keywords"]:
+                        keywords.setdefault(keyword.lower(), set()).add(i)
+            self._automata[source] = _KeywordAutomaton(keywords)
+        self._lab_flags = [
+            frozenset(rule.get("abnormal_flags", ["H"])) if rule["source"] == "lab" else frozenset()
+            for rule in self.rules
+        ]
+        self._memo: Dict[Tuple[str, str], FrozenSet[int]] = {}
+
+    @staticmethod
+    def _validate(rule: Dict) -> Dict:
+        missing = [key for key in ("id", "source", "keywords", "risk_factor") if key not in rule]
+        if missing:
+            raise ValueError(f"Risk rule {rule.get('id', rule)} is missing {', '.join(missing)}")
+        if rule["source"] not in RULE_SOURCES:
+            raise ValueError(f"Risk rule {rule['id']} has unknown source '{rule['source']}'")
+        return rule
+
+    def _match(self, source: str, name: str) -> FrozenSet[int]:
+        key = (source, name)
+        matched = self._memo.get(key)
+        if matched is None:
+            matched = self._automata[source].match(name.lower())
+            if len(self._memo) < MAX_MEMOIZED_NAMES:
+                self._memo[key] = matched
+        return matched
+
+    def evaluate(self, conditions: List[Dict], lab_results: Iterable[Dict]) -> List[str]:
+        """Risk factors for one patient's conditions and lab results, in rule order; labs are read once."""
+        matched: Set[int] = set()
+        for condition in conditions:
+            matched |= self._match("condition", condition["condition"])
+        for lab in lab_results:
+            flag = lab["abnormal_flag"]
+            if flag:
+                matched.update(i for i in self._match("lab", lab["test_name"]) if flag in self._lab_flags[i])
+
+        # dict.fromkeys drops repeated messages while keeping rule order
+        return list(dict.fromkeys(self.rules[i]["risk_factor"] for i in sorted(matched)))
+
+    def evaluate_batch(self, patients: Iterable[Tuple[str, List[Dict], Iterable[Dict]]]) -> Dict[str, List[str]]:
+        """Risk factors for many (patient_id, conditions, lab_results) tuples."""
+        return {patient_id: self.evaluate(conditions, labs) for patient_id, conditions, labs in patients}
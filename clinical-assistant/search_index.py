@@ -0,0 +1,249 @@
+import bisect
+import heapq
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Posting entries are keys ordered by text length, then doc: (length << _DOC_BITS) | doc
+_DOC_BITS = 25
+_DOC_MASK = (1 << _DOC_BITS) - 1
+_MAX_KEY_LENGTH = 127
+
+# Fuzzy mode counts at most this many entries of a gram's posting list, evenly spaced
+FUZZY_POSTING_SAMPLE = 5000
+# Patients sharing the most grams with the query, per result, that fuzzy mode scores exactly
+FUZZY_SHORTLIST = 20
+MIN_FUZZY_SIMILARITY = 0.3
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _padded_grams(token: str) -> List[str]:
+    """Trigrams of a word padded so that prefixes of one or two letters have grams too."""
+    padded = "  " + token + " "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def _query_grams(token: str) -> List[str]:
+    """Grams that any word containing ``token`` is guaranteed to have."""
+    if len(token) < 3:
+        # Too short for an inner trigram: match it as a word prefix
+        return [("  " + token)[-3:]]
+    return [token[i:i + 3] for i in range(len(token) - 2)]
+
+
+def _start_gram(token: str) -> str:
+    """The gram every word starting with ``token`` has."""
+    return ("  " + token)[:3] if len(token) < 2 else " " + token[:2]
+
+
+def _contains(postings: array, key: int) -> bool:
+    i = bisect.bisect_left(postings, key)
+    return i < len(postings) and postings[i] == key
+
+
+class PatientSearchIndex:
+    """Trigram index over patient names and IDs, plus an index of condition names.
+
+    Every patient is a document numbered in insertion order. Trigram posting
+    lists hold sorted keys that order documents by the length of their text,
+    so a query walks its candidates shortest text first and stops as soon as
+    no remaining candidate can beat the results it already has. Patients and
+    conditions can be added one at a time as the underlying store grows.
+    """
+
+    def __init__(self):
+        self._patient_ids: List[str] = []
+        self._texts: List[str] = []
+        self._docs: Dict[str, int] = {}
+        self._grams: Dict[str, array] = {}
+        # Lower-cased condition name -> sorted docs of patients with that condition
+        self._conditions: Dict[str, array] = {}
+        self._condition_names: Dict[str, str] = {}
+
+    @classmethod
+    def from_store(cls, store) -> "PatientSearchIndex":
+        index = cls()
+        for patient_id in store.patient_ids():
+            index._add_patient(patient_id, store.get_patient(patient_id)["name"], ordered=False)
+            for condition in store.get_conditions(patient_id):
+                index.add_condition(patient_id, condition["condition"])
+        # Sorting each list once is far cheaper than keeping it sorted through a bulk load
+        for gram, postings in index._grams.items():
+            index._grams[gram] = array("I", sorted(postings))
+        return index
+
+    def __len__(self) -> int:
+        return len(self._patient_ids)
+
+    # ---------- Updates ----------
+
+    def add_patient(self, patient_id: str, name: str):
+        self._add_patient(patient_id, name, ordered=True)
+
+    def _add_patient(self, patient_id: str, name: str, ordered: bool):
+        if patient_id in self._docs:
+            return
+        doc = len(self._patient_ids)
+        if doc > _DOC_MASK:
+            raise ValueError(f"Search index is limited to {_DOC_MASK + 1} patients")
+        text = f"{name} {patient_id}".lower()
+        key = min(len(text), _MAX_KEY_LENGTH) << _DOC_BITS | doc
+        # Everything a reader looks up by doc exists before any posting list can lead it there
+        self._texts.append(text)
+        self._patient_ids.append(patient_id)
+        self._docs[patient_id] = doc
+        for gram in {gram for token in _tokens(text) for gram in _padded_grams(token)}:
+            postings = self._grams.get(gram)
+            if postings is None:
+                postings = self._grams[gram] = array("I")
+            if ordered:
+                bisect.insort(postings, key)
+            else:
+                postings.append(key)
+
+    def add_condition(self, patient_id: str, condition: str):
+        doc = self._docs.get(patient_id)
+        if doc is None:
+            return
+        key = condition.lower()
+        postings = self._conditions.get(key)
+        if postings is None:
+            # Name first: a reader that finds the condition can always display it
+            self._condition_names[key] = condition
+            postings = self._conditions[key] = array("i")
+        if not _contains(postings, doc):
+            bisect.insort(postings, doc)
+
+    # ---------- Queries ----------
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Rank patients whose name or ID matches ``query``, best match first.
+
+        Patients containing every query word rank first, those where the words
+        are word prefixes highest. Only when nothing contains the query, e.g. a misspelled
+        name, are patients ranked by trigram similarity of their name instead.
+        """
+        tokens = _tokens(query)
+        if not tokens or limit <= 0:
+            return []
+
+        ranked = self._substring_matches(tokens, limit) or self._fuzzy_matches(tokens, limit)
+        return [(self._patient_ids[doc], round(score, 3)) for doc, score in ranked]
+
+    def search_conditions(self, query: str, limit: int = 20) -> List[Tuple[str, str]]:
+        """Patients with a condition whose name contains every query word."""
+        tokens = _tokens(query)
+        if not tokens or limit <= 0:
+            return []
+
+        results = []
+        seen = set()
+        # A snapshot, since ingestion can add conditions while we iterate
+        for condition, postings in list(self._conditions.items()):
+            if not all(token in condition for token in tokens):
+                continue
+            for doc in postings:
+                if doc not in seen:
+                    seen.add(doc)
+                    results.append((self._patient_ids[doc], self._condition_names[condition]))
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def _postings(self, grams: Set[str]) -> Optional[List[array]]:
+        postings = [self._grams.get(gram) for gram in grams]
+        return None if any(p is None for p in postings) else postings
+
+    def _substring_matches(self, tokens: List[str], limit: int) -> List[Tuple[int, float]]:
+        """The ``limit`` best patients containing every token, scored and ordered like ``search``.
+
+        Patients with a word starting with every token are ranked first, since
+        they hold the top scores; the rest are only walked when those do not
+        fill the results.
+        """
+        postings = self._postings({gram for token in tokens for gram in _query_grams(token)})
+        if postings is None:
+            return []
+
+        # Min-heap of (score, -key, doc), so ties keep the shorter text, then the earlier patient
+        top: List[Tuple[float, int, int]] = []
+        seen: Set[int] = set()
+        # Best possible score, at length zero, of a patient missing a prefix match for some token
+        best_partial = 1.0 + (len(tokens) - 1) / len(tokens)
+        complete = True
+        start_postings = self._postings({_start_gram(token) for token in tokens})
+        if start_postings is not None:
+            complete = self._rank(postings + start_postings, tokens, limit, top, seen, 2.0)
+            if len(top) >= limit and top[0][0] >= best_partial:
+                return self._ordered(top)
+        # Patients the first pass stopped short of may still hold prefix matches
+        self._rank(postings, tokens, limit, top, seen, best_partial if complete else 2.0)
+        return self._ordered(top)
+
+    def _rank(self, postings: List[array], tokens: List[str], limit: int,
+              top: List[Tuple[float, int, int]], seen: Set[int], best: float) -> bool:
+        """Score the matches among the shortest posting list into ``top``; False if it stopped early.
+
+        Checking a candidate's text is cheaper than probing the other lists.
+        ``best`` bounds the score of any patient left, less its text length, so
+        the walk ends once the results can no longer improve.
+        """
+        for key in min(postings, key=len):
+            if len(top) >= limit and top[0][0] >= best - (key >> _DOC_BITS) / 1000:
+                return False
+            doc = key & _DOC_MASK
+            if doc in seen:
+                continue
+            seen.add(doc)
+            text = self._texts[doc]
+            if not all(token in text for token in tokens):
+                continue
+            words = text.split()
+            prefix_hits = sum(any(word.startswith(token) for word in words) for token in tokens)
+            entry = (1.0 + prefix_hits / len(tokens) - len(text) / 1000, -key, doc)
+            if len(top) < limit:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+        return True
+
+    @staticmethod
+    def _ordered(top: List[Tuple[float, int, int]]) -> List[Tuple[int, float]]:
+        return [(doc, score) for score, _, doc in sorted(top, reverse=True)]
+
+    def _name_words(self, doc: int) -> List[str]:
+        text = self._texts[doc]
+        return _tokens(text[:len(text) - len(self._patient_ids[doc]) - 1])
+
+    def _fuzzy_matches(self, tokens: List[str], limit: int) -> List[Tuple[int, float]]:
+        """Patients whose name is most similar to the query, by the Dice coefficient of trigrams.
+
+        Patients are shortlisted by how many query grams they share, counting a
+        sample of the longest posting lists. The shortlist is scored exactly:
+        each query word against its most similar word of the name, averaged.
+        """
+        token_grams = [set(_padded_grams(token)) for token in tokens]
+        shared = Counter()
+        for gram in set().union(*token_grams):
+            postings = self._grams.get(gram)
+            if postings is not None:
+                step = -(-len(postings) // FUZZY_POSTING_SAMPLE)
+                shared.update(postings[::step] if step > 1 else postings)
+
+        matches = []
+        for key, _ in shared.most_common(limit * FUZZY_SHORTLIST):
+            doc = key & _DOC_MASK
+            word_grams = [set(_padded_grams(word)) for word in self._name_words(doc)]
+            similarity = sum(
+                max((2 * len(grams & word) / (len(grams) + len(word)) for word in word_grams), default=0.0)
+                for grams in token_grams
+            ) / len(token_grams)
+            if similarity >= MIN_FUZZY_SIMILARITY:
+                matches.append((doc, similarity))
+        return heapq.nlargest(limit, matches, key=lambda match: match[1])
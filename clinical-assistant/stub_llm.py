@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+PATIENT_ID_PATTERN = re.compile(r"\bPAT\d+\b", re.IGNORECASE)
+FILLER_WORDS = ("patient", "labs", "stable", "monitor", "glucose", "follow-up", "history", "risk")
+
+
+class StubModelSettings:
+    """Timing of the stub model: time to first token, then one token every token_latency seconds."""
+
+    def __init__(self, first_token_latency: float = 0.2, token_latency: float = 0.02, output_tokens: int = 200):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.output_tokens = output_tokens
+
+
+def _tool_call_for(messages: List[Dict], tools: List[Dict]) -> Optional[Dict]:
+    """Pick the tool a model would plausibly call for the latest question, once per question."""
+    if not tools or messages[-1]["role"] != "user":
+        return None
+    content = messages[-1]["content"]
+    question = content if isinstance(content, str) else " ".join(
+        part.get("text", "") for part in content if isinstance(part, dict)
+    )
+    names = {tool["function"]["name"] for tool in tools}
+    patient_ids = [pid.upper() for pid in PATIENT_ID_PATTERN.findall(question)]
+    if not patient_ids:
+        return {"name": "search_patients", "arguments": {"query": question[:40]}} if "search_patients" in names else None
+    if "lab" in question.lower() and "get_lab_results" in names:
+        return {"name": "get_lab_results", "arguments": {"patient_id": patient_ids[0]}}
+    if "history" in question.lower() and "get_patient_history" in names:
+        return {"name": "get_patient_history", "arguments": {"patient_id": patient_ids[0]}}
+    if "get_patient_summary" in names:
+        return {"name": "get_patient_summary", "arguments": {"patient_id": patient_ids[0]}}
+    return None
+
+
+def _chunk(completion_id: str, model: str, delta: Dict, finish_reason: Optional[str] = None) -> str:
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }) + "\n\n"
+
+
+def create_app(settings: StubModelSettings) -> Starlette:
+    """OpenAI-compatible chat completions endpoint that answers with canned text or one tool call."""
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        tool_call = _tool_call_for(body.get("messages", []), body.get("tools") or [])
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        output_tokens = 1 if tool_call else settings.output_tokens
+
+        async def events():
+            await asyncio.sleep(settings.first_token_latency)
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            if tool_call:
+                yield _chunk(completion_id, model, {"tool_calls": [{
+                    "index": 0,
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])},
+                }]})
+                yield _chunk(completion_id, model, {}, "tool_calls")
+            else:
+                for i in range(settings.output_tokens):
+                    if i:
+                        await asyncio.sleep(settings.token_latency)
+                    yield _chunk(completion_id, model, {"content": FILLER_WORDS[i % len(FILLER_WORDS)] + " "})
+                yield _chunk(completion_id, model, {}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": output_tokens,
+                              "total_tokens": prompt_tokens + output_tokens},
+                }) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        if body.get("stream"):
+            return StreamingResponse(events(), media_type="text/event-stream")
+        # Non-streaming callers get the same answer in one response
+        text = "".join(FILLER_WORDS[i % len(FILLER_WORDS)] + " " for i in range(output_tokens))
+        await asyncio.sleep(settings.first_token_latency + settings.token_latency * (output_tokens - 1))
+        message = {"role": "assistant", "content": None if tool_call else text}
+        if tool_call:
+            message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                                      "function": {"name": tool_call["name"],
+                                                   "arguments": json.dumps(tool_call["arguments"])}}]
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": prompt_tokens + output_tokens},
+        })
+
+    async def models(request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/models", models, methods=["GET"]),
+    ])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible model server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-latency-ms", type=float, default=20)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    settings = StubModelSettings(args.first_token_ms / 1000, args.token_latency_ms / 1000, args.output_tokens)
+    print(f"🤖 Stub model on http://{args.host}:{args.port}/v1 "
+          f"({args.first_token_ms:g} ms to first token, {args.token_latency_ms:g} ms/token)")
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,202 @@
+"""Synthetic patients, medical history and lab results at any scale.
+
+    python synthetic_data.py --patients 100000 --output-dir data/100k
+    PATIENT_DATA_DIR=data/100k python mcpserver.py
+
+Writes patients, conditions and labs files in the layout PATIENT_DATA_DIR
+expects (JSON lines by default, --format csv for CSV). Records are generated
+and written one patient at a time, so memory stays flat from 1K to 10M
+patients. The same --seed always produces the same data.
+
+Conditions follow rough population prevalences, and labs follow them: a
+diabetic gets more glucose and HbA1c results, with values that are often out
+of range. Lab counts per patient are Pareto-distributed: most patients have a
+handful of results and a few have hundreds. --lab-skew sets the Pareto shape,
+where lower values give a heavier tail.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from patient_store import CONDITION_FIELDS, LAB_FIELDS, PATIENT_FIELDS
+
+FIRST_NAMES = (
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Maria",
+    "Wei", "Mei", "Ahmed", "Fatima", "Raj", "Priya", "Kenji", "Yuki", "Olu", "Amara",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Chen", "Wang", "Kim", "Patel", "Singh", "Nguyen", "Okafor", "Tanaka", "Cohen",
+)
+PROVIDERS = ("Dr. Smith", "Dr. Jones", "Dr. Brown", "Dr. Patel", "Dr. Chen", "Dr. Garcia", "Dr. Okafor", "Dr. Kim")
+
+# (condition, prevalence, lab tests it makes more frequent and more often abnormal)
+CONDITIONS = (
+    ("Type 2 Diabetes Mellitus", 0.10, ("Glucose, Fasting", "Hemoglobin A1c")),
+    ("Hypertension", 0.25, ()),
+    ("Hyperlipidemia", 0.15, ("Total Cholesterol", "LDL Cholesterol")),
+    ("Hypothyroidism", 0.05, ("TSH",)),
+    ("Coronary Artery Disease", 0.06, ("Troponin I", "LDL Cholesterol")),
+    ("Chronic Kidney Disease", 0.04, ("Creatinine",)),
+    ("Asthma", 0.08, ()),
+    ("Chronic Obstructive Pulmonary Disease", 0.04, ()),
+    ("Major Depressive Disorder", 0.07, ()),
+    ("Osteoarthritis", 0.10, ()),
+)
+STATUSES = (("active", 0.75), ("resolved", 0.15), ("inactive", 0.10))
+SEVERITIES = (("mild", 0.5), ("moderate", 0.35), ("high", 0.15))
+
+# test -> (unit, reference range, low, high, (mean, sd), (mean, sd) for patients with a related condition)
+LAB_TESTS = {
+    "Glucose, Fasting": ("mg/dL", "70-100", 70, 100, (92, 12), (150, 35)),
+    "Hemoglobin A1c": ("%", "<5.7", None, 5.7, (5.3, 0.3), (7.4, 1.1)),
+    "Total Cholesterol": ("mg/dL", "<200", None, 200, (185, 30), (235, 35)),
+    "LDL Cholesterol": ("mg/dL", "<100", None, 100, (95, 25), (140, 30)),
+    "HDL Cholesterol": ("mg/dL", ">40", 40, None, (52, 12), (52, 12)),
+    "TSH": ("mIU/L", "0.4-4.0", 0.4, 4.0, (2.1, 0.9), (5.5, 2.0)),
+    "Creatinine": ("mg/dL", "0.6-1.3", 0.6, 1.3, (0.95, 0.18), (2.0, 0.6)),
+    "Troponin I": ("ng/mL", "<0.04", None, 0.04, (0.015, 0.008), (0.03, 0.03)),
+    "Hemoglobin": ("g/dL", "12.0-17.5", 12.0, 17.5, (14.2, 1.3), (14.2, 1.3)),
+}
+
+
+def _weighted(rng: random.Random, choices: Tuple[Tuple[str, float], ...]) -> str:
+    return rng.choices([name for name, _ in choices], weights=[weight for _, weight in choices])[0]
+
+
+def lab_count(rng: random.Random, mean_labs: float, lab_skew: float, max_labs: int) -> int:
+    """Pareto-distributed number of lab results averaging about ``mean_labs``."""
+    scale = mean_labs * (lab_skew - 1) / lab_skew if lab_skew > 1 else mean_labs
+    return min(int(scale * rng.paretovariate(lab_skew)), max_labs)
+
+
+def generate_patient(rng: random.Random, index: int, as_of: date, mean_labs: float = 8.0,
+                     lab_skew: float = 1.5, max_labs: int = 1000) -> Tuple[Dict, List[Dict], List[Dict]]:
+    """One patient with their conditions and labs; child rows carry the patient_id."""
+    patient_id = f"PAT{index + 1:07d}"
+    birth = as_of - timedelta(days=rng.randint(18 * 365, 95 * 365))
+    age = as_of.year - birth.year - ((as_of.month, as_of.day) < (birth.month, birth.day))
+    patient = {
+        "patient_id": patient_id,
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "date_of_birth": birth.isoformat(),
+        "gender": rng.choice(("Male", "Female")),
+        "age": age,
+    }
+
+    conditions = []
+    related_tests = set()
+    provider = rng.choice(PROVIDERS)
+    for name, prevalence, tests in CONDITIONS:
+        # Older patients carry more chronic conditions
+        if rng.random() < prevalence * (0.5 + age / 60):
+            status = _weighted(rng, STATUSES)
+            if status == "active":
+                related_tests.update(tests)
+            conditions.append({
+                "patient_id": patient_id,
+                "condition": name,
+                "diagnosis_date": (as_of - timedelta(days=rng.randint(30, 15 * 365))).isoformat(),
+                "status": status,
+                "severity": _weighted(rng, SEVERITIES),
+                "notes": "",
+                "provider": provider,
+            })
+
+    labs = []
+    test_names = list(LAB_TESTS)
+    # Related tests are ordered several times as often
+    weights = [5 if test in related_tests else 1 for test in test_names]
+    for _ in range(lab_count(rng, mean_labs, lab_skew, max_labs)):
+        test = rng.choices(test_names, weights=weights)[0]
+        unit, reference_range, low, high, normal, related = LAB_TESTS[test]
+        mean, sd = related if test in related_tests else normal
+        value = max(rng.gauss(mean, sd), 0.0)
+        flag = "H" if high is not None and value > high else "L" if low is not None and value < low else ""
+        collected = as_of - timedelta(days=rng.randint(0, 3 * 365))
+        labs.append({
+            "patient_id": patient_id,
+            "test_name": test,
+            "value": f"{value:.3g}" if value < 1 else f"{value:.1f}",
+            "unit": unit,
+            "reference_range": reference_range,
+            "status": "final",
+            "abnormal_flag": flag,
+            "collection_date": collected.isoformat(),
+            "result_date": (collected + timedelta(days=rng.randint(0, 2))).isoformat(),
+            "ordering_provider": provider,
+            "notes": "",
+        })
+    return patient, conditions, labs
+
+
+def generate(patients: int, seed: int = 0, as_of: Optional[date] = None,
+             **options) -> Iterator[Tuple[Dict, List[Dict], List[Dict]]]:
+    """(patient, conditions, labs) for ``patients`` patients; options as for ``generate_patient``."""
+    rng = random.Random(seed)
+    as_of = as_of or date.today()
+    for index in range(patients):
+        yield generate_patient(rng, index, as_of, **options)
+
+
+def write_dataset(output_dir: str, patients: int, seed: int = 0, file_format: str = "jsonl",
+                  as_of: Optional[date] = None, **options) -> Dict[str, int]:
+    """Write patients/conditions/labs files to ``output_dir`` and return the row counts."""
+    os.makedirs(output_dir, exist_ok=True)
+    fields = {
+        "patients": PATIENT_FIELDS,
+        "conditions": ("patient_id",) + CONDITION_FIELDS,
+        "labs": ("patient_id",) + LAB_FIELDS,
+    }
+    files = {name: open(os.path.join(output_dir, f"{name}.{file_format}"), "w", encoding="utf-8", newline="")
+             for name in fields}
+    counts = dict.fromkeys(fields, 0)
+    try:
+        if file_format == "csv":
+            writers = {name: csv.DictWriter(files[name], fieldnames=fields[name]) for name in fields}
+            for writer in writers.values():
+                writer.writeheader()
+            write = {name: writer.writerow for name, writer in writers.items()}
+        else:
+            write = {name: (lambda row, f=files[name]: f.write(json.dumps(row) + "\n")) for name in fields}
+        for patient, conditions, labs in generate(patients, seed, as_of, **options):
+            write["patients"](patient)
+            for row in conditions:
+                write["conditions"](row)
+            for row in labs:
+                write["labs"](row)
+            counts["patients"] += 1
+            counts["conditions"] += len(conditions)
+            counts["labs"] += len(labs)
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic patient data for PATIENT_DATA_DIR")
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mean-labs", type=float, default=8.0, help="average lab results per patient")
+    parser.add_argument("--lab-skew", type=float, default=1.5, help="Pareto shape of lab counts, lower is more skewed")
+    parser.add_argument("--max-labs", type=int, default=1000, help="lab results of the busiest patients")
+    parser.add_argument("--as-of", type=date.fromisoformat, help="date the data ends on, default today")
+    args = parser.parse_args()
+
+    counts = write_dataset(args.output_dir, args.patients, args.seed, args.format, args.as_of,
+                           mean_labs=args.mean_labs, lab_skew=args.lab_skew, max_labs=args.max_labs)
+    print(f"✅ Wrote {counts['patients']} patients, {counts['conditions']} conditions and "
+          f"{counts['labs']} lab results to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
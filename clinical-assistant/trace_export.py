@@ -0,0 +1,397 @@
+"""Background export of MLflow traces that never blocks an agent turn.
+
+MLflow's span exporter hands every finished trace (and incremental span
+batches) to an export queue as a task. ``install()`` swaps that queue for
+``TraceExportQueue``, which:
+
+- accepts tasks without blocking and drops them when the bounded queue is full
+- sends them from one background thread in batches, merging span batches of the
+  same experiment into one request
+- probes the tracking server's /health endpoint, and while it is unreachable
+  appends traces to a local JSON lines spool instead of waiting on timeouts; a
+  trace whose export fails while the server looked up is spooled too
+- replays the spool once the server is back
+
+The queue relies on internals of MLflow's span exporter, checked when this
+module is imported (requirements.txt pins the MLflow versions it was tested
+with). On an MLflow where any is missing, ``install()`` keeps MLflow's own
+async export queue and sizes it with the settings below instead.
+
+Settings (environment variables):
+    TRACE_SAMPLE_RATE          fraction of agent turns traced, default 1.0
+    TRACE_EXPORT_QUEUE_SIZE    pending export tasks before new ones are dropped, default 1000
+    TRACE_EXPORT_BATCH_SIZE    tasks sent per batch, default 50
+    TRACE_EXPORT_FLUSH_SECONDS longest a task waits for its batch to fill, default 2
+    TRACE_HEALTH_INTERVAL      seconds between tracking server health probes, default 15
+    TRACE_SPOOL_PATH           spool file, default /tmp/mlflow-trace-spool.jsonl
+    TRACE_SPOOL_MAX_MB         spool size after which traces are dropped, default 100
+
+    python trace_export.py replay   # send spooled traces to MLFLOW_TRACKING_URI now
+"""
+import inspect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+import httpx
+import mlflow
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("exported", "dropped", "spooled")
+
+
+def _missing_hooks() -> List[str]:
+    """The MLflow exporter internals TraceExportQueue uses that this MLflow version lacks."""
+    try:
+        from mlflow.tracing.export import mlflow_v3
+        from mlflow.tracing.export.async_export_queue import Task
+        from mlflow.utils.workspace_context import ServerWorkspaceContext  # noqa: F401
+    except ImportError as e:
+        return [str(e)]
+    missing = []
+    if not hasattr(mlflow_v3, "AsyncTraceExportQueue"):
+        missing.append("mlflow_v3.AsyncTraceExportQueue")
+    exporter = getattr(mlflow_v3, "MlflowV3SpanExporter", None)
+    for method in ("_log_trace", "_log_spans"):
+        if not callable(getattr(exporter, method, None)):
+            missing.append(f"MlflowV3SpanExporter.{method}")
+    if not {"handler", "args"} <= set(inspect.signature(Task).parameters):
+        missing.append("Task(handler, args)")
+    if not callable(getattr(mlflow.MlflowClient, "_log_trace", None)):
+        missing.append("MlflowClient._log_trace")
+    if exporter is not None:
+        source = inspect.getsource(exporter)
+        for used in ("self._client", "_store_supports_log_spans", "Failed to send trace"):
+            if used not in source:
+                missing.append(f"MlflowV3SpanExporter {used!r}")
+    return missing
+
+
+# Checked once, when the module is imported
+MISSING_HOOKS = _missing_hooks()
+
+
+def _task_kind(task) -> str:
+    return getattr(task.handler, "__name__", "")
+
+
+def _task_spans(task) -> int:
+    """Spans of the trace a task exports. Incremental span batches count as 0, their spans are in the trace too."""
+    if _task_kind(task) == "_log_trace" and task.args[0] is not None:
+        return len(task.args[0].data.spans)
+    return 0
+
+
+class _SendFailures(logging.Handler):
+    """Trace send failures MLflow's exporter logs on this thread instead of raising."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.thread = threading.get_ident()
+        self.messages: List[str] = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if record.thread == self.thread and message.startswith("Failed to send trace"):
+            self.messages.append(message)
+
+
+@contextmanager
+def _raising(task):
+    """Run a task's handler, raising when it fails, including failures the exporter only logs."""
+    failures = _SendFailures()
+    exporter_logger = logging.getLogger(task.handler.__module__)
+    exporter_logger.addHandler(failures)
+    try:
+        yield
+    finally:
+        exporter_logger.removeHandler(failures)
+    if failures.messages:
+        raise RuntimeError(failures.messages[0])
+
+
+class TraceExportQueue:
+    """Drop-in replacement for MLflow's AsyncTraceExportQueue: bounded, batched, spooling when the server is down."""
+
+    def __init__(self, tracking_uri: Optional[str] = None):
+        self.tracking_uri = tracking_uri or mlflow.get_tracking_uri()
+        self.batch_size = int(os.environ.get("TRACE_EXPORT_BATCH_SIZE", "50"))
+        self.flush_seconds = float(os.environ.get("TRACE_EXPORT_FLUSH_SECONDS", "2"))
+        self.health_interval = float(os.environ.get("TRACE_HEALTH_INTERVAL", "15"))
+        self.spool_path = os.environ.get("TRACE_SPOOL_PATH", "/tmp/mlflow-trace-spool.jsonl")
+        self.spool_max_bytes = int(float(os.environ.get("TRACE_SPOOL_MAX_MB", "100")) * 1024 * 1024)
+        self._queue: queue.Queue = queue.Queue(maxsize=int(os.environ.get("TRACE_EXPORT_QUEUE_SIZE", "1000")))
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._spans: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._traces: Dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self._span_batches: Dict[str, int] = {"exported": 0, "failed": 0}
+        self._server_up: Optional[bool] = None
+        self._last_probe = 0.0
+        self._last_drop_warning = 0.0
+        self._worker: Optional[threading.Thread] = None
+
+    # ---------- Interface MLflow's exporter calls ----------
+
+    def put(self, task):
+        """Queue a task without ever blocking the caller; a full queue drops it."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(task)
+        except queue.Full:
+            self._count(task, "dropped")
+            now = time.monotonic()
+            if now - self._last_drop_warning > 30:
+                self._last_drop_warning = now
+                logger.warning("Trace export queue is full, dropping traces (TRACE_EXPORT_QUEUE_SIZE)")
+
+    def flush(self, terminate: bool = False):
+        """Wait until every queued task has been exported or spooled."""
+        if self._worker is not None:
+            self._queue.join()
+
+    def is_active(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    # ---------- Counters ----------
+
+    def _count(self, task, outcome: str):
+        with self._lock:
+            self._spans[outcome] += _task_spans(task)
+            if _task_kind(task) == "_log_trace":
+                self._traces[outcome] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "spans": dict(self._spans),
+                "traces": dict(self._traces),
+                "span_batches": dict(self._span_batches),
+                "queued": self._queue.qsize(),
+                "server_up": self._server_up,
+                "spool_bytes": os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0,
+            }
+
+    # ---------- Worker ----------
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._worker.start()
+
+    def _next_batch(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if self._tracking_server_up():
+                    if self._export(batch):
+                        self._replay_spool()
+                else:
+                    for task in batch:
+                        self._spool(task)
+            except Exception as e:
+                logger.warning(f"Trace export batch failed: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _export(self, batch: List) -> bool:
+        """Send a batch, spooling traces that fail; True when every trace was sent."""
+        # Incremental span batches for the same experiment go out as one request
+        span_groups = defaultdict(list)
+        for task in batch:
+            if _task_kind(task) == "_log_spans":
+                exporter = task.handler.__self__
+                experiment_id, spans, workspace = task.args
+                span_groups[(exporter, experiment_id, workspace)].append(task)
+        for (exporter, experiment_id, workspace), tasks in span_groups.items():
+            spans = [span for task in tasks for span in task.args[1]]
+            try:
+                # The exporter's client raises where exporter._log_spans would only log at debug level
+                from mlflow.utils.workspace_context import ServerWorkspaceContext
+
+                with ServerWorkspaceContext(workspace) if workspace else nullcontext():
+                    exporter._client.log_spans(experiment_id, spans)
+                outcome = "exported"
+            except NotImplementedError:
+                # The store has no span logging; stop queueing span batches, as the exporter itself would
+                exporter._store_supports_log_spans = False
+                outcome = "failed"
+            except Exception as e:
+                # Their spans are part of their trace, which is exported or spooled whole
+                logger.debug(f"Exporting a span batch failed: {e}")
+                outcome = "failed"
+            with self._lock:
+                self._span_batches[outcome] += len(tasks)
+        sent_all = True
+        for task in batch:
+            if _task_kind(task) == "_log_spans":
+                continue
+            try:
+                # Not Task.handle, which swallows failures
+                with _raising(task):
+                    task.handler(*task.args)
+            except Exception as e:
+                logger.warning(f"Trace export failed, spooling the trace: {e}")
+                # Probe the server again before the next batch rather than failing each trace on a timeout
+                self._last_probe = 0.0
+                self._spool(task)
+                sent_all = False
+                continue
+            self._count(task, "exported")
+        return sent_all
+
+    def _tracking_server_up(self) -> bool:
+        if not self.tracking_uri.startswith(("http://", "https://")):
+            # Local stores (file, sqlite) are always reachable
+            return True
+        now = time.monotonic()
+        if self._server_up is not None and now - self._last_probe < self.health_interval:
+            return self._server_up
+        self._last_probe = now
+        try:
+            up = httpx.get(f"{self.tracking_uri.rstrip('/')}/health", timeout=2.0).status_code == 200
+        except httpx.HTTPError:
+            up = False
+        if up != self._server_up:
+            print("✅ MLflow tracking server reachable, exporting traces" if up
+                  else f"⚠️  MLflow tracking server unreachable, spooling traces to {self.spool_path}")
+        self._server_up = up
+        return up
+
+    # ---------- Spool ----------
+
+    def _spool(self, task):
+        if _task_kind(task) != "_log_trace" or task.args[0] is None:
+            # Incremental span batches are contained in their trace, which is spooled whole
+            return
+        line = task.args[0].to_json() + "\n"
+        with self._spool_lock:
+            size = os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0
+            if size + len(line) > self.spool_max_bytes:
+                self._count(task, "dropped")
+                return
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        self._count(task, "spooled")
+
+    def _replay_spool(self):
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path) or os.path.getsize(self.spool_path) == 0:
+                return
+            replaying = f"{self.spool_path}.replaying"
+            os.replace(self.spool_path, replaying)
+        sent, spans, failed = replay_spool(replaying, self.spool_path, self._spool_lock)
+        with self._lock:
+            self._traces["exported"] += sent
+            self._spans["exported"] += spans
+        print(f"📤 Replayed {sent} spooled traces ({failed} kept for later)")
+
+
+def replay_spool(path: str, retry_path: Optional[str] = None, lock: Optional[threading.Lock] = None):
+    """Log every trace in a spool file; traces that fail again are appended to ``retry_path``.
+
+    Returns (traces sent, spans sent, traces failed).
+    """
+    from mlflow.entities import Trace
+
+    client = mlflow.MlflowClient()
+    sent, spans, failed = 0, 0, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                trace = Trace.from_json(line)
+                client._log_trace(trace)
+                sent += 1
+                spans += len(trace.data.spans)
+            except Exception as e:
+                logger.debug(f"Replaying spooled trace failed: {e}")
+                failed.append(line)
+    if failed and retry_path:
+        with lock or threading.Lock():
+            with open(retry_path, "a", encoding="utf-8") as f:
+                f.writelines(failed)
+    os.remove(path)
+    return sent, spans, len(failed)
+
+
+_export_queue: Optional[TraceExportQueue] = None
+
+
+def install(tracking_uri: Optional[str] = None) -> Optional[TraceExportQueue]:
+    """Route MLflow trace export through a TraceExportQueue; call before the first trace is started.
+
+    Returns None, leaving MLflow's own export queue in place, when this MLflow
+    version lacks the internals the queue needs.
+    """
+    global _export_queue
+    # Head sampling: unsampled turns never build spans at all
+    os.environ.setdefault("MLFLOW_TRACE_SAMPLING_RATIO", os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+    os.environ["MLFLOW_ENABLE_ASYNC_TRACE_LOGGING"] = "true"
+    # Fail fast rather than retrying for minutes; undelivered traces are spooled
+    os.environ.setdefault("MLFLOW_HTTP_REQUEST_MAX_RETRIES", "1")
+    os.environ.setdefault("MLFLOW_HTTP_REQUEST_TIMEOUT", "10")
+
+    if MISSING_HOOKS:
+        logger.warning(f"MLflow {mlflow.__version__} lacks {', '.join(MISSING_HOOKS)}; "
+                       "using MLflow's own trace export queue, without spooling")
+        os.environ.setdefault("MLFLOW_ASYNC_TRACE_LOGGING_MAX_QUEUE_SIZE",
+                              os.environ.get("TRACE_EXPORT_QUEUE_SIZE", "1000"))
+        os.environ.setdefault("MLFLOW_ASYNC_TRACE_LOGGING_MAX_SPAN_BATCH_SIZE",
+                              os.environ.get("TRACE_EXPORT_BATCH_SIZE", "50"))
+        os.environ.setdefault("MLFLOW_ASYNC_TRACE_LOGGING_MAX_INTERVAL_MILLIS",
+                              str(int(float(os.environ.get("TRACE_EXPORT_FLUSH_SECONDS", "2")) * 1000)))
+        return None
+
+    from mlflow.tracing.export import mlflow_v3
+
+    if _export_queue is None:
+        _export_queue = TraceExportQueue(tracking_uri)
+    # The exporter creates its queue when the tracer provider is first initialized
+    mlflow_v3.AsyncTraceExportQueue = lambda: _export_queue
+    return _export_queue
+
+
+def export_stats() -> Optional[Dict]:
+    """Counters of the installed export queue, or None when tracing export is not installed."""
+    return _export_queue.stats() if _export_queue is not None else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Send spooled MLflow traces to the tracking server")
+    parser.add_argument("command", choices=["replay"])
+    parser.add_argument("--spool", default=os.environ.get("TRACE_SPOOL_PATH", "/tmp/mlflow-trace-spool.jsonl"))
+    args = parser.parse_args()
+
+    mlflow.set_tracking_uri(os.environ.get("MLFLOW_TRACKING_URI", "http://localhost:5000"))
+    if not os.path.exists(args.spool):
+        print(f"Nothing to replay, {args.spool} does not exist")
+    else:
+        replaying = f"{args.spool}.replaying"
+        os.replace(args.spool, replaying)
+        sent, spans, failed = replay_spool(replaying, args.spool)
+        print(json.dumps({"traces": sent, "spans": spans, "failed": failed}))
@@ -0,0 +1,466 @@
+"""Incremental ingestion on top of an immutable PatientStore.
+
+``VersionedStore`` keeps the bulk data in a base PatientStore that is never
+modified, plus a small delta of patients, conditions and labs ingested since
+the last compaction. Both are published together as one immutable view, so
+readers pick up the current view with a single attribute read and never take
+a lock; writers build a new delta and swap it in.
+
+Every ingested batch increments the data version, and each patient records
+the version of the last batch that touched it, so caches can drop exactly
+what changed. ``compact()`` folds the delta into a new base: an in-memory
+store, or for snapshot-backed stores following a change log a new snapshot
+file. One process writes it; the others map it and replay only the batches
+after it from the log, instead of each rebuilding the data set.
+
+With a change log, ingested batches are appended to a JSON lines file before
+they are applied, and ``sync()`` applies batches other processes appended.
+Every process following the log sees the same batches under the same
+versions, and a restarted process replays the log over its base data.
+"""
+import fcntl
+import glob
+import heapq
+import json
+import os
+import threading
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from patient_store import (
+    CONDITION_FIELDS, LAB_FIELDS, PATIENT_FIELDS, PatientStore, day_ordinal, normalize_record, write_snapshot,
+)
+
+
+class _DeltaLabs(NamedTuple):
+    arrived: Tuple[Dict, ...]   # in ingestion order, so compaction can tell which rows it folded
+    ordered: Tuple[Dict, ...]   # by collection date, as the base keeps them
+    days: Tuple[int, ...]       # collection day ordinals of ``ordered``
+
+
+class _Delta(NamedTuple):
+    version: int
+    patients: Dict[str, Dict]
+    conditions: Dict[str, Tuple[Dict, ...]]
+    labs: Dict[str, _DeltaLabs]
+    rows: int
+
+
+class _View(NamedTuple):
+    base: PatientStore
+    delta: _Delta
+
+
+_EMPTY_DELTA = _Delta(0, {}, {}, {}, 0)
+
+
+class ListenerError(Exception):
+    """Listeners failed after batches were applied; the batches themselves are committed at ``version``."""
+
+    def __init__(self, version: int, errors: List[Exception]):
+        super().__init__(f"{len(errors)} change listener call(s) failed, first: {errors[0]!r}")
+        self.version = version
+        self.errors = errors
+
+
+def _collection_date(lab: Dict) -> str:
+    return lab["collection_date"]
+
+
+def _delta_labs(arrived: Tuple[Dict, ...]) -> _DeltaLabs:
+    # Stable sort: results collected on the same day stay in arrival order, after the base's
+    ordered = tuple(sorted(arrived, key=_collection_date))
+    return _DeltaLabs(arrived, ordered, tuple(day_ordinal(lab["collection_date"]) for lab in ordered))
+
+
+class VersionedStore:
+    """PatientStore read interface over an immutable base plus an append-only delta."""
+
+    def __init__(self, base: PatientStore, change_log: Optional[str] = None,
+                 snapshot_path: Optional[str] = None):
+        self._view = _View(base, _EMPTY_DELTA)
+        self.change_log = change_log
+        # Base of compacted snapshots, written as <snapshot_path>.v<version>; without it, or without
+        # a change log to replay the batches after a snapshot from, compaction happens in memory
+        self.snapshot_path = snapshot_path
+        self._base_version = 0
+        self._log_offset = 0
+        self._patient_versions: Dict[str, int] = {}
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self.compactions = 0
+
+    # ---------- Versions ----------
+
+    @property
+    def version(self) -> int:
+        """Number of batches ingested since the base data was loaded; only ever increases."""
+        return self._view.delta.version
+
+    def patient_version(self, patient_id: str) -> int:
+        """Version of the last batch that changed this patient, 0 if none has."""
+        return self._patient_versions.get(patient_id, 0)
+
+    def changed_since(self, version: int) -> Dict[str, int]:
+        """Patients changed by batches after ``version``, with the version of their last change."""
+        return {pid: v for pid, v in list(self._patient_versions.items()) if v > version}
+
+    @property
+    def base(self) -> PatientStore:
+        return self._view.base
+
+    @property
+    def delta_rows(self) -> int:
+        """Patients, conditions and labs waiting to be compacted into the base."""
+        return self._view.delta.rows
+
+    def delta_labs(self, patient_id: str) -> List[Dict]:
+        """Labs of a patient ingested since the base was loaded or compacted, in arrival order."""
+        delta = self._view.delta.labs.get(patient_id)
+        return [dict(lab) for lab in delta.arrived] if delta else []
+
+    def delta_changes(self) -> List[Tuple[str, str]]:
+        """(kind, patient_id) of everything in the delta, as listeners were told about it."""
+        delta = self._view.delta
+        return ([("patient", pid) for pid in delta.patients] + [("conditions", pid) for pid in delta.conditions]
+                + [("labs", pid) for pid in delta.labs])
+
+    # ---------- Reads ----------
+
+    def __len__(self) -> int:
+        view = self._view
+        return len(view.base) + len(view.delta.patients)
+
+    def __contains__(self, patient_id: str) -> bool:
+        view = self._view
+        return patient_id in view.base or patient_id in view.delta.patients
+
+    def patient_ids(self) -> Iterator[str]:
+        view = self._view
+        # Published delta dicts are never modified, so iterating one is safe while writers run
+        return chain(view.base.patient_ids(), iter(view.delta.patients))
+
+    def get_patient(self, patient_id: str) -> Optional[Dict]:
+        view = self._view
+        patient = view.base.get_patient(patient_id)
+        if patient is None and patient_id in view.delta.patients:
+            patient = dict(view.delta.patients[patient_id])
+        return patient
+
+    def get_conditions(self, patient_id: str) -> List[Dict]:
+        view = self._view
+        return view.base.get_conditions(patient_id) + [dict(c) for c in view.delta.conditions.get(patient_id, ())]
+
+    def get_labs(self, patient_id: str) -> List[Dict]:
+        """Lab results for a patient, oldest collection date first."""
+        view = self._view
+        delta = view.delta.labs.get(patient_id)
+        if delta is None:
+            return view.base.get_labs(patient_id)
+        return self._merge(view.base.get_labs(patient_id), delta, 0)
+
+    def labs_since(self, patient_id: str, since_day: int, offset: int = 0,
+                   limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Labs collected on or after day ordinal ``since_day``, oldest first, as ``PatientStore.labs_since``."""
+        view = self._view
+        delta = view.delta.labs.get(patient_id)
+        if delta is None:
+            return view.base.labs_since(patient_id, since_day, offset, limit)
+        window = self._merge(view.base.labs_since(patient_id, since_day)[0], delta, since_day)
+        start = max(offset, 0)
+        end = len(window) if limit is None else start + max(limit, 0)
+        return window[start:end], len(window)
+
+    def iter_lab_pages(self, patient_id: str, since_day: int, offset: int = 0,
+                       page_size: int = 100) -> Iterator[List[Dict]]:
+        view = self._view
+        delta = view.delta.labs.get(patient_id)
+        if delta is None:
+            yield from view.base.iter_lab_pages(patient_id, since_day, offset, page_size)
+            return
+        # A patient's delta is small, so the merged window is built once and sliced
+        window = self._merge(view.base.labs_since(patient_id, since_day)[0], delta, since_day)
+        for start in range(max(offset, 0), len(window), max(page_size, 1)):
+            yield window[start:start + page_size]
+
+    def lab_count_since(self, patient_id: str, since_day: int) -> int:
+        view = self._view
+        delta = view.delta.labs.get(patient_id)
+        count = view.base.lab_count_since(patient_id, since_day)
+        return count if delta is None else count + sum(day >= since_day for day in delta.days)
+
+    @staticmethod
+    def _merge(base_labs: List[Dict], delta: _DeltaLabs, since_day: int) -> List[Dict]:
+        recent = [dict(lab) for lab, day in zip(delta.ordered, delta.days) if day >= since_day]
+        return list(heapq.merge(base_labs, recent, key=_collection_date))
+
+    # ---------- Ingestion ----------
+
+    def subscribe(self, callback: Callable[[str, str], None]):
+        """Register callback(kind, patient_id), called after every applied batch."""
+        self._listeners.append(callback)
+
+    def ingest(self, patients: Iterable[Dict] = (), conditions: Iterable[Dict] = (),
+               labs: Iterable[Dict] = ()) -> int:
+        """Append a batch of new patients, conditions and labs and return its data version.
+
+        Condition and lab rows carry a patient_id, which must be an existing
+        patient or one added in the same batch. Raises ValueError (or KeyError
+        for unknown patients) without applying anything when the batch is invalid,
+        and ListenerError when the batch was applied but a listener failed.
+        """
+        batch = {
+            "patients": [normalize_record(PATIENT_FIELDS, p) for p in patients],
+            "conditions": [{"patient_id": str(c.get("patient_id")), **normalize_record(CONDITION_FIELDS, c)}
+                           for c in conditions],
+            "labs": [{"patient_id": str(lab.get("patient_id")), **normalize_record(LAB_FIELDS, lab)}
+                     for lab in labs],
+        }
+        changes: List[Tuple[str, str]] = []
+        try:
+            with self._write_lock:
+                if self.change_log:
+                    with open(self.change_log, "ab+") as log:
+                        fcntl.flock(log, fcntl.LOCK_EX)
+                        try:
+                            # Another process may have appended since our last sync; its batches come first
+                            changes += self._read_log(log)
+                            self._validate(batch)
+                            entry = {"version": self.version + 1, **batch}
+                            log.write(json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n")
+                            log.flush()
+                            os.fsync(log.fileno())
+                            self._log_offset = log.tell()
+                        finally:
+                            fcntl.flock(log, fcntl.LOCK_UN)
+                else:
+                    self._validate(batch)
+                    entry = {"version": self.version + 1, **batch}
+                changes += self._apply(entry)
+        finally:
+            errors = self._notify(changes)
+        if errors:
+            raise ListenerError(entry["version"], errors)
+        return entry["version"]
+
+    def sync(self) -> int:
+        """Apply batches other processes appended to the change log; returns how many were applied."""
+        if not self.change_log or not os.path.exists(self.change_log):
+            return 0
+        with self._write_lock:
+            version = self.version
+            with open(self.change_log, "rb") as log:
+                changes = self._read_log(log)
+        errors = self._notify(changes)
+        if errors:
+            raise ListenerError(self.version, errors)
+        return self.version - version
+
+    def _read_log(self, log) -> List[Tuple[str, str]]:
+        log.seek(self._log_offset)
+        data = log.read()
+        # A batch still being written has no trailing newline yet; it is picked up next time
+        complete = data[:data.rfind(b"\n") + 1]
+        changes = []
+        for line in complete.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                if entry["version"] > self.version:
+                    changes += self._apply(entry)
+        self._log_offset += len(complete)
+        return changes
+
+    def _validate(self, batch: Dict):
+        new = set()
+        for patient in batch["patients"]:
+            patient_id = patient["patient_id"]
+            if not patient_id:
+                raise ValueError("Patient without a patient_id")
+            if patient_id in self or patient_id in new:
+                raise ValueError(f"Duplicate patient {patient_id}")
+            new.add(patient_id)
+        for row in chain(batch["conditions"], batch["labs"]):
+            if row["patient_id"] not in self and row["patient_id"] not in new:
+                raise KeyError(f"Patient {row['patient_id']} not found")
+
+    def _apply(self, entry: Dict) -> List[Tuple[str, str]]:
+        """Publish a new view with the batch added; returns the (kind, patient_id) changes for listeners."""
+        view, changes = _with_batch(self._view, entry)
+        # One assignment, so readers see the whole batch or none of it
+        self._view = view
+        # Bumped after publishing: a reader may pair new rows with an old version, never the reverse
+        for _, patient_id in changes:
+            self._patient_versions[patient_id] = entry["version"]
+        return changes
+
+    def _notify(self, changes: Sequence[Tuple[str, str]]) -> List[Exception]:
+        """Call every listener for every change, even after one fails; returns the failures."""
+        errors = []
+        for kind, patient_id in changes:
+            for callback in self._listeners:
+                try:
+                    callback(kind, patient_id)
+                except Exception as e:
+                    errors.append(e)
+        return errors
+
+    # ---------- Compaction ----------
+
+    def compact(self) -> bool:
+        """Fold the current delta into a new immutable base; False when there was nothing to fold.
+
+        The new base is built without blocking readers or ingestion. Batches
+        ingested meanwhile stay in the delta.
+        """
+        with self._compact_lock:
+            folded = self._view
+            if folded.delta.rows == 0:
+                return False
+            if self.snapshot_path and self.change_log:
+                self._compact_shared(folded)
+            else:
+                base = _merged_store(folded)
+                with self._write_lock:
+                    self._view = _View(base, _remaining(self._view.delta, folded.delta))
+                self._base_version = folded.delta.version
+            self.compactions += 1
+        return True
+
+    def _compact_shared(self, folded: _View):
+        """Map the newest snapshot another process compacted to, or write one when there is none newer than ours."""
+        with open(self.snapshot_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Snapshots past our version hold batches we have not synced yet
+            versions = [v for v in self._snapshot_versions() if v <= folded.delta.version]
+            latest = max(versions, default=0)
+            if latest > self._base_version:
+                self._adopt_snapshot(latest)
+                return
+
+            path = f"{self.snapshot_path}.v{folded.delta.version}"
+            write_snapshot(_merged_store(folded), path)
+            base = PatientStore.open_snapshot(path)
+            with self._write_lock:
+                self._view = _View(base, _remaining(self._view.delta, folded.delta))
+            self._base_version = folded.delta.version
+            for version in versions:
+                # Processes still mapping an unlinked file keep reading it until they switch
+                os.remove(f"{self.snapshot_path}.v{version}")
+
+    def _snapshot_versions(self) -> List[int]:
+        versions = []
+        for path in glob.glob(f"{glob.escape(self.snapshot_path)}.v*"):
+            suffix = path.rsplit(".v", 1)[1]
+            if suffix.isdigit():
+                versions.append(int(suffix))
+        return versions
+
+    def _adopt_snapshot(self, version: int):
+        """Switch to the snapshot compacted at ``version``, replaying the batches we applied after it from the log."""
+        base = PatientStore.open_snapshot(f"{self.snapshot_path}.v{version}")
+        with self._write_lock:
+            view = _View(base, _Delta(version, {}, {}, {}, 0))
+            with open(self.change_log, "rb") as log:
+                applied = log.read(self._log_offset)
+            for line in applied.splitlines():
+                if line.strip() and _entry_version(line) > version:
+                    view, _ = _with_batch(view, json.loads(line))
+            # Same rows as before, so listeners and patient versions are unaffected
+            self._view = view
+        self._base_version = version
+
+    def stats(self) -> Dict:
+        view = self._view
+        return {
+            "data_version": view.delta.version,
+            "base_patients": len(view.base),
+            "delta_patients": len(view.delta.patients),
+            "delta_rows": view.delta.rows,
+            "compactions": self.compactions,
+        }
+
+
+def _entry_version(line: bytes) -> int:
+    """Version of a change log line, without parsing the whole batch."""
+    prefix = b'{"version":'
+    if line.startswith(prefix):
+        return int(line[len(prefix):line.index(b",")])
+    return json.loads(line)["version"]
+
+
+def _with_batch(view: _View, entry: Dict) -> Tuple[_View, List[Tuple[str, str]]]:
+    """``view`` with a change log batch added, and the (kind, patient_id) changes it made."""
+    delta = view.delta
+    patients = dict(delta.patients)
+    changes = {}
+    for patient in entry["patients"]:
+        patient_id = patient["patient_id"]
+        if patient_id not in view.base and patient_id not in patients:
+            patients[patient_id] = patient
+            changes[("patient", patient_id)] = None
+
+    conditions = dict(delta.conditions)
+    added_conditions: Dict[str, List[Dict]] = {}
+    for row in entry["conditions"]:
+        patient_id, condition = row["patient_id"], {f: row[f] for f in CONDITION_FIELDS}
+        if patient_id in view.base or patient_id in patients:
+            added_conditions.setdefault(patient_id, []).append(condition)
+    for patient_id, rows in added_conditions.items():
+        conditions[patient_id] = conditions.get(patient_id, ()) + tuple(rows)
+        changes[("conditions", patient_id)] = None
+
+    labs = dict(delta.labs)
+    added_labs: Dict[str, List[Dict]] = {}
+    for row in entry["labs"]:
+        patient_id, lab = row["patient_id"], {f: row[f] for f in LAB_FIELDS}
+        if patient_id in view.base or patient_id in patients:
+            added_labs.setdefault(patient_id, []).append(lab)
+    for patient_id, rows in added_labs.items():
+        previous = labs.get(patient_id)
+        labs[patient_id] = _delta_labs((previous.arrived if previous else ()) + tuple(rows))
+        changes[("labs", patient_id)] = None
+
+    added = (len(patients) - len(delta.patients) + sum(map(len, added_conditions.values()))
+             + sum(map(len, added_labs.values())))
+    return _View(view.base, _Delta(entry["version"], patients, conditions, labs, delta.rows + added)), list(changes)
+
+
+def _merged_store(view: _View) -> PatientStore:
+    base, delta = view
+    patient_ids = list(chain(base.patient_ids(), delta.patients))
+
+    def patients():
+        for patient_id in patient_ids:
+            yield base.get_patient(patient_id) or delta.patients[patient_id]
+
+    def conditions():
+        for patient_id in patient_ids:
+            for row in chain(base.get_conditions(patient_id), delta.conditions.get(patient_id, ())):
+                yield {"patient_id": patient_id, **row}
+
+    def labs():
+        for patient_id in patient_ids:
+            added = delta.labs.get(patient_id)
+            for row in chain(base.get_labs(patient_id), added.arrived if added else ()):
+                yield {"patient_id": patient_id, **row}
+
+    # from_records sorts labs stably by date, so same-day delta rows stay after the base's as readers saw them
+    return PatientStore.from_records(patients(), conditions(), labs())
+
+
+def _remaining(current: _Delta, folded: _Delta) -> _Delta:
+    """Rows of ``current`` that were ingested after ``folded``; deltas only ever grow by appending."""
+    patients = {pid: p for pid, p in current.patients.items() if pid not in folded.patients}
+    conditions = {}
+    for patient_id, rows in current.conditions.items():
+        rest = rows[len(folded.conditions.get(patient_id, ())):]
+        if rest:
+            conditions[patient_id] = rest
+    labs = {}
+    for patient_id, delta in current.labs.items():
+        previous = folded.labs.get(patient_id)
+        rest = delta.arrived[len(previous.arrived) if previous else 0:]
+        if rest:
+            labs[patient_id] = _delta_labs(rest)
+    return _Delta(current.version, patients, conditions, labs, current.rows - folded.rows)
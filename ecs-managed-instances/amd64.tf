@@ -0,0 +1,123 @@
+# ---------- x86_64 Baseline Service ----------
+#
+# Runs the same pricing service on the amd64 capacity provider behind ALB port
+# 8081, so one Locust scenario can be run against both architectures and the
+# results compared with locust_compare.py. Unlike the Graviton service it does
+# not auto-scale, keeping its vCPU count fixed for requests-per-vCPU figures.
+# amd64_image must provide a linux/amd64 image, either as a separate tag or as
+# part of a multi-arch manifest; apply checks this before creating the service.
+
+variable "amd64_desired_count" {
+  description = "Tasks of the x86_64 baseline service"
+  default     = 2
+}
+
+variable "amd64_image" {
+  description = "Pricing service image with a linux/amd64 variant (a separate x86_64 tag or a multi-arch manifest)"
+  default     = "public.ecr.aws/j4m3t0a6/asianoptions:latest"
+}
+
+resource "null_resource" "amd64_image_check" {
+  triggers = {
+    image = var.amd64_image
+  }
+
+  # Fails the apply instead of leaving the service unable to pull an arm64-only image
+  provisioner "local-exec" {
+    command = <<-EOT
+      docker manifest inspect --verbose ${var.amd64_image} | grep -q '"architecture": *"amd64"' || {
+        echo "${var.amd64_image} has no linux/amd64 image; push an x86_64 build and set amd64_image" >&2
+        exit 1
+      }
+    EOT
+  }
+}
+
+resource "aws_lb_target_group" "amd64" {
+  name        = "${var.cluster_name}-amd64-tg"
+  port        = 8080
+  protocol    = "HTTP"
+  vpc_id      = aws_vpc.main.id
+  target_type = "ip"
+
+  health_check {
+    path                = "/pricing"
+    healthy_threshold   = 2
+    unhealthy_threshold = 3
+    interval            = 30
+  }
+}
+
+resource "aws_lb_listener" "amd64" {
+  load_balancer_arn = aws_lb.main.arn
+  port              = 8081
+  protocol          = "HTTP"
+
+  default_action {
+    type             = "forward"
+    target_group_arn = aws_lb_target_group.amd64.arn
+  }
+}
+
+resource "aws_ecs_task_definition" "app_amd64" {
+  family                   = "${var.service_name}-amd64"
+  network_mode             = "awsvpc"
+  requires_compatibilities = ["EC2"]
+  cpu                      = "512"
+  memory                   = "1024"
+  execution_role_arn       = aws_iam_role.task_execution.arn
+
+  runtime_platform {
+    operating_system_family = "LINUX"
+    cpu_architecture        = "X86_64"
+  }
+
+  container_definitions = jsonencode([{
+    name      = "asianoptions"
+    image     = var.amd64_image
+    essential = true
+    portMappings = [{
+      containerPort = 8080
+      protocol      = "tcp"
+    }]
+    logConfiguration = {
+      logDriver = "awslogs"
+      options = {
+        "awslogs-group"         = aws_cloudwatch_log_group.ecs.name
+        "awslogs-region"        = var.region
+        "awslogs-stream-prefix" = "ecs-amd64"
+      }
+    }
+  }])
+}
+
+resource "aws_ecs_service" "app_amd64" {
+  name                 = "${var.service_name}-amd64"
+  cluster              = aws_ecs_cluster.main.id
+  task_definition      = aws_ecs_task_definition.app_amd64.arn
+  desired_count        = var.amd64_desired_count
+  force_new_deployment = true
+
+  capacity_provider_strategy {
+    capacity_provider = aws_ecs_capacity_provider.amd64.name
+    weight            = 1
+    base              = 1
+  }
+
+  network_configuration {
+    subnets         = aws_subnet.private[*].id
+    security_groups = [aws_security_group.ecs.id]
+  }
+
+  load_balancer {
+    target_group_arn = aws_lb_target_group.amd64.arn
+    container_name   = "asianoptions"
+    container_port   = 8080
+  }
+
+  depends_on = [aws_lb_listener.amd64, aws_ecs_cluster_capacity_providers.main, null_resource.amd64_image_check]
+}
+
+output "alb_amd64_url" {
+  value = "http://${aws_lb.main.dns_name}:8081"
+}
@@ -1,7 +1,71 @@
 # ---------- Locust Load Generator ----------
 #
 # Drives load against the asianoptions ALB to trigger auto-scaling.
-# Runs in headless mode with 500 users to push CPU above 50%.
+# Runs in headless, distributed mode: one master that owns the test and
+# aggregates statistics, and locust_workers workers that generate the load,
+# so the load generator does not saturate before the service does. Runs 500
+# users to push CPU above 50%, or follows a step/ramp/spike load shape when
+# locust_load_shape is set (see locustfile.py). locust_target selects the
+# Graviton service or the x86_64 baseline (amd64.tf). The master logs a
+# "Results summary" JSON line that locust_compare.py --results can read.
+# Locust runs on its own capacity provider, so load generators never share
+# instances (and CPU) with either service under test.
+
+variable "locust_load_shape" {
+  description = "Load shape for the Locust run: \"\" (constant 500 users), \"step\", \"ramp\" or \"spike\""
+  default     = ""
+}
+
+variable "locust_workers" {
+  description = "Number of Locust worker tasks"
+  default     = 4
+}
+
+variable "locust_target" {
+  description = "Service to load: \"graviton\" (ALB port 80) or \"amd64\" (ALB port 8081)"
+  default     = "graviton"
+}
+
+variable "locust_pricing_mix" {
+  description = "Weights of the quote/standard/risk pricing request classes"
+  default     = "quote=6,standard=3,risk=1"
+}
+
+resource "aws_ecs_capacity_provider" "loadgen" {
+  name    = "${var.cluster_name}-loadgen-cp"
+  cluster = aws_ecs_cluster.main.name
+
+  managed_instances_provider {
+    infrastructure_role_arn = aws_iam_role.ecs_infrastructure.arn
+
+    instance_launch_template {
+      ec2_instance_profile_arn = aws_iam_instance_profile.ecs_instance.arn
+      monitoring               = "BASIC"
+
+      network_configuration {
+        subnets         = aws_subnet.private[*].id
+        security_groups = [aws_security_group.ecs.id]
+      }
+
+      storage_configuration {
+        storage_size_gib = 30
+      }
+
+      instance_requirements {
+        vcpu_count {
+          min = 2
+          max = 8
+        }
+        memory_mib {
+          min = 4096
+          max = 16384
+        }
+        cpu_manufacturers    = ["intel", "amd"] # The Locust image is built for linux/amd64
+        instance_generations = ["current"]
+      }
+    }
+  }
+}
 
 resource "aws_ecr_repository" "locust" {
   name         = "locust-loadtest"
@@ -29,6 +93,47 @@ resource "aws_cloudwatch_log_group" "locust" {
   retention_in_days = 7
 }
 
+locals {
+  locust_host = var.locust_target == "amd64" ? "http://${aws_lb.main.dns_name}:8081" : "http://${aws_lb.main.dns_name}"
+  locust_environment = [
+    { name = "LOAD_SHAPE", value = var.locust_load_shape },
+    { name = "PRICING_MIX", value = var.locust_pricing_mix },
+    { name = "SHAPE_MAX_USERS", value = "500" },
+    { name = "SHAPE_RUN_SECONDS", value = "900" },
+  ]
+  locust_log_configuration = {
+    logDriver = "awslogs"
+    options = {
+      "awslogs-group"         = aws_cloudwatch_log_group.locust.name
+      "awslogs-region"        = var.region
+      "awslogs-stream-prefix" = "ecs"
+    }
+  }
+}
+
+# Workers find the master through Cloud Map DNS: master.locust.local
+resource "aws_service_discovery_private_dns_namespace" "locust" {
+  name = "locust.local"
+  vpc  = aws_vpc.main.id
+}
+
+resource "aws_service_discovery_service" "locust_master" {
+  name = "master"
+
+  dns_config {
+    namespace_id = aws_service_discovery_private_dns_namespace.locust.id
+
+    dns_records {
+      ttl  = 10
+      type = "A"
+    }
+  }
+
+  health_check_custom_config {
+    failure_threshold = 1
+  }
+}
+
 resource "aws_ecs_task_definition" "locust" {
   family                   = "locust-loadtest"
   network_mode             = "awsvpc"
@@ -48,20 +153,50 @@ resource "aws_ecs_task_definition" "locust" {
     essential = true
     command = [
       "-f", "/home/locust/locustfile.py",
+      "--master",
       "--headless",
-      "--host", "http://${aws_lb.main.dns_name}",
+      "--expect-workers", tostring(var.locust_workers),
+      "--host", local.locust_host,
       "-u", "500",
       "-r", "50",
-      "--run-time", "15m"
+      "--run-time", "15m",
+      "--results-prefix", "/tmp/results"
     ]
-    logConfiguration = {
-      logDriver = "awslogs"
-      options = {
-        "awslogs-group"         = aws_cloudwatch_log_group.locust.name
-        "awslogs-region"        = var.region
-        "awslogs-stream-prefix" = "ecs"
-      }
-    }
+    environment = local.locust_environment
+    portMappings = [{
+      containerPort = 5557
+      protocol      = "tcp"
+    }]
+    logConfiguration = local.locust_log_configuration
+  }])
+
+  depends_on = [null_resource.locust_image]
+}
+
+resource "aws_ecs_task_definition" "locust_worker" {
+  family                   = "locust-loadtest-worker"
+  network_mode             = "awsvpc"
+  requires_compatibilities = ["EC2"]
+  cpu                      = "1024"
+  memory                   = "1024"
+  execution_role_arn       = aws_iam_role.task_execution.arn
+
+  runtime_platform {
+    operating_system_family = "LINUX"
+    cpu_architecture        = "X86_64"
+  }
+
+  container_definitions = jsonencode([{
+    name      = "locust-worker"
+    image     = "${aws_ecr_repository.locust.repository_url}:latest"
+    essential = true
+    command = [
+      "-f", "/home/locust/locustfile.py",
+      "--worker",
+      "--master-host", "master.locust.local"
+    ]
+    environment      = local.locust_environment
+    logConfiguration = local.locust_log_configuration
   }])
 
   depends_on = [null_resource.locust_image]
@@ -75,7 +210,7 @@ resource "aws_ecs_service" "locust" {
   force_new_deployment = true
 
   capacity_provider_strategy {
-    capacity_provider = aws_ecs_capacity_provider.amd64.name
+    capacity_provider = aws_ecs_capacity_provider.loadgen.name
     weight            = 1
   }
 
@@ -84,5 +219,29 @@ resource "aws_ecs_service" "locust" {
     security_groups = [aws_security_group.ecs.id]
   }
 
+  service_registries {
+    registry_arn = aws_service_discovery_service.locust_master.arn
+  }
+
   depends_on = [aws_ecs_cluster_capacity_providers.main]
 }
+
+resource "aws_ecs_service" "locust_worker" {
+  name                 = "locust-loadtest-worker"
+  cluster              = aws_ecs_cluster.main.id
+  task_definition      = aws_ecs_task_definition.locust_worker.arn
+  desired_count        = var.locust_workers
+  force_new_deployment = true
+
+  capacity_provider_strategy {
+    capacity_provider = aws_ecs_capacity_provider.loadgen.name
+    weight            = 1
+  }
+
+  network_configuration {
+    subnets         = aws_subnet.private[*].id
+    security_groups = [aws_security_group.ecs.id]
+  }
+
+  depends_on = [aws_ecs_service.locust]
+}
@@ -0,0 +1,158 @@
+"""Run one Locust scenario against two targets and report them side by side.
+
+    python locust_compare.py \\
+        --target graviton=http://<alb>,vcpus=1 \\
+        --target x86=http://<alb>:8081,vcpus=1 \\
+        --users 200 --spawn-rate 50 --run-time 5m --processes 4
+
+Each target is loaded in turn with locustfile.py in distributed mode
+(--processes forks one master and that many local workers), using the same
+users, duration and LOAD_SHAPE/PRICING_MIX settings. Results already collected
+elsewhere, such as the "Results summary" line an ECS master logs, can be
+compared without running anything:
+
+    python locust_compare.py --results graviton=graviton.log,vcpus=1 --results x86=x86.json,vcpus=1
+
+The report lists throughput, latency percentiles and failure rate per request
+class, plus requests per second per vCPU of each target (vCPUs are the tasks
+serving the target times their vCPUs, e.g. 2 tasks x 0.5). It is printed as
+Markdown and saved as comparison.md and comparison.json in --output-dir.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+LOCUSTFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locustfile.py")
+RESULTS_MARKER = "Results summary: "
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms", "failure_rate")
+
+
+def parse_spec(spec: str) -> Dict:
+    """"label=location[,vcpus=N]" into {"label", "location", "vcpus"}."""
+    label, _, rest = spec.partition("=")
+    location, *options = rest.split(",")
+    parsed = {"label": label, "location": location, "vcpus": None}
+    for option in options:
+        key, _, value = option.partition("=")
+        if key == "vcpus":
+            parsed["vcpus"] = float(value)
+    if not label or not location:
+        raise argparse.ArgumentTypeError(f"Expected label=location[,vcpus=N], got '{spec}'")
+    return parsed
+
+
+def load_results(path: str) -> Dict:
+    """Read a --results-prefix JSON file, or the last results line of a Locust master log."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    lines = [line for line in text.splitlines() if RESULTS_MARKER in line]
+    if not lines:
+        raise ValueError(f"No Locust results found in {path}")
+    return json.loads(lines[-1].split(RESULTS_MARKER, 1)[1])
+
+
+def run_locust(target: Dict, args) -> Dict:
+    prefix = os.path.join(args.output_dir, target["label"])
+    command = [
+        "locust", "-f", LOCUSTFILE, "--headless", "--only-summary",
+        "--host", target["location"],
+        "-u", str(args.users), "-r", str(args.spawn_rate), "--run-time", args.run_time,
+        "--results-prefix", prefix,
+    ]
+    if args.processes:
+        command += ["--processes", str(args.processes)]
+    print(f"🚀 Loading {target['label']} at {target['location']}", flush=True)
+    # Locust exits non-zero when any request failed; failures are part of the report
+    subprocess.run(command, check=False, stdout=sys.stderr if args.quiet else None, stderr=sys.stderr)
+    return load_results(f"{prefix}.json")
+
+
+def compare(targets: List[Dict], results: List[Dict]) -> Dict:
+    classes = list(dict.fromkeys(name for result in results for name in result["classes"]))
+    comparison = {"targets": [], "classes": {}}
+    for target, result in zip(targets, results):
+        total = result["classes"].get("Aggregated", {})
+        comparison["targets"].append({
+            "label": target["label"],
+            "host": result.get("host"),
+            "vcpus": target["vcpus"],
+            "rps": total.get("rps"),
+            "rps_per_vcpu": round(total["rps"] / target["vcpus"], 2) if target["vcpus"] and total else None,
+        })
+    for name in classes:
+        comparison["classes"][name] = {
+            target["label"]: {metric: result["classes"].get(name, {}).get(metric) for metric in METRICS}
+            for target, result in zip(targets, results)
+        }
+    return comparison
+
+
+def _change(base, other) -> str:
+    if not base or other is None:
+        return ""
+    return f"{100 * (other - base) / base:+.1f}%"
+
+
+def to_markdown(comparison: Dict) -> str:
+    labels = [target["label"] for target in comparison["targets"]]
+    lines = ["| target | host | vCPUs | req/s | req/s per vCPU |", "|---|---|---:|---:|---:|"]
+    for target in comparison["targets"]:
+        lines.append(f"| {target['label']} | {target['host']} | {target['vcpus'] or '-'} | {target['rps']} "
+                     f"| {target['rps_per_vcpu'] if target['rps_per_vcpu'] is not None else '-'} |")
+    base, other = comparison["targets"][0], comparison["targets"][-1]
+    if len(labels) > 1 and base["rps_per_vcpu"] and other["rps_per_vcpu"] is not None:
+        lines.append(f"\n{other['label']} vs {base['label']}: "
+                     f"{_change(base['rps_per_vcpu'], other['rps_per_vcpu'])} requests per vCPU")
+
+    for name, by_target in comparison["classes"].items():
+        lines += ["", f"**{name}**", "",
+                  "| metric | " + " | ".join(labels) + (" | change |" if len(labels) > 1 else ""),
+                  "|---|" + "---:|" * (len(labels) + (1 if len(labels) > 1 else 0))]
+        for metric in METRICS:
+            values = [by_target[label][metric] for label in labels]
+            row = f"| {metric} | " + " | ".join("-" if value is None else str(value) for value in values) + " |"
+            if len(labels) > 1:
+                row += f" {_change(values[0], values[-1])} |"
+            lines.append(row)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--target", type=parse_spec, action="append", help="label=url[,vcpus=N]; repeat")
+    sources.add_argument("--results", type=parse_spec, action="append", help="label=path[,vcpus=N]; repeat")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--spawn-rate", type=float, default=50)
+    parser.add_argument("--run-time", default="5m")
+    parser.add_argument("--processes", type=int, default=4, help="local Locust workers, 0 for one process")
+    parser.add_argument("--output-dir", default="locust-results")
+    parser.add_argument("--quiet", action="store_true", help="send Locust's own output to stderr")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.target:
+        targets = args.target
+        results = [run_locust(target, args) for target in targets]
+    else:
+        targets = args.results
+        results = [load_results(target["location"]) for target in targets]
+
+    comparison = compare(targets, results)
+    report = to_markdown(comparison)
+    print("\n" + report)
+    with open(os.path.join(args.output_dir, "comparison.md"), "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    with open(os.path.join(args.output_dir, "comparison.json"), "w", encoding="utf-8") as f:
+        json.dump(comparison, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
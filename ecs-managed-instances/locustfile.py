@@ -1,8 +1,185 @@
-from locust import HttpUser, task, between
+"""Load model for the Asian options pricing service.
+
+Each request prices one option with randomized strike, maturity and Monte
+Carlo size. Requests fall into classes of increasing cost ("quote",
+"standard", "risk") that are mixed by weight and reported separately, e.g.
+"/pricing [risk]". Set LOAD_SHAPE to "step", "ramp" or "spike" to drive the
+user count from a load shape instead of -u/-r. Pass --results-prefix to write
+per-class latency percentiles as CSV and JSON when the test ends.
+
+Settings (environment variables):
+    PRICING_MIX          class weights, default "quote=6,standard=3,risk=1"
+    WAIT_MIN, WAIT_MAX   seconds between requests per user, default 0.1 and 0.5
+    LOAD_SHAPE           "", "step", "ramp" or "spike"
+    SHAPE_MAX_USERS      peak users of the shape, default 500
+    SHAPE_SPAWN_RATE     users started/stopped per second, default 50
+    SHAPE_RUN_SECONDS    total duration of the shape, default 900
+    SHAPE_STEP_USERS     users added per step, default 50
+    SHAPE_STEP_SECONDS   duration of each step, default 60
+    SHAPE_BASE_USERS     users outside a spike, default 50
+    SHAPE_SPIKE_AT       seconds before each spike, default 300
+    SHAPE_SPIKE_SECONDS  duration of each spike, default 60
+"""
+import csv
+import json
+import logging
+import os
+import random
+
+from locust import HttpUser, LoadTestShape, between, events
+from locust.runners import WorkerRunner
+
+# Option parameters per request class: (paths range, steps range)
+REQUEST_CLASSES = {
+    "quote": {"paths": (1_000, 5_000), "steps": (12, 52)},
+    "standard": {"paths": (10_000, 50_000), "steps": (52, 252)},
+    "risk": {"paths": (100_000, 200_000), "steps": (252, 252)},
+}
+SPOT = 100.0
+PERCENTILES = (0.5, 0.75, 0.9, 0.95, 0.99, 0.999)
+
+
+def _weights(mix: str):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() in REQUEST_CLASSES and int(weight or 1) > 0:
+            weights[name.strip()] = int(weight or 1)
+    return weights
+
+
+def pricing_params(request_class: str, rng: random.Random = random):
+    """Randomized option for a request class: strike within 20% of spot, maturity of 3 months to 2 years."""
+    spec = REQUEST_CLASSES[request_class]
+    return {
+        "spot": SPOT,
+        "strike": round(SPOT * rng.uniform(0.8, 1.2), 2),
+        "maturity": round(rng.uniform(0.25, 2.0), 2),
+        "volatility": round(rng.uniform(0.1, 0.5), 2),
+        "rate": 0.03,
+        "paths": rng.randint(*spec["paths"]),
+        "steps": rng.randint(*spec["steps"]),
+    }
+
+
+def _pricing_task(request_class: str):
+    def task(user):
+        user.client.get("/pricing", params=pricing_params(request_class), name=f"/pricing [{request_class}]")
+    task.__name__ = f"pricing_{request_class}"
+    return task
+
 
 class AsianOptionsUser(HttpUser):
-    wait_time = between(0.1, 0.5)
+    wait_time = between(float(os.environ.get("WAIT_MIN", "0.1")), float(os.environ.get("WAIT_MAX", "0.5")))
+    tasks = {
+        _pricing_task(request_class): weight
+        for request_class, weight in _weights(os.environ.get("PRICING_MIX", "quote=6,standard=3,risk=1")).items()
+    }
+
+
+# ---------- Load shapes ----------
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)))
+
+
+class StepLoadShape(LoadTestShape):
+    """Add SHAPE_STEP_USERS every SHAPE_STEP_SECONDS up to SHAPE_MAX_USERS, then hold."""
+    abstract = True
+
+    def tick(self):
+        run_time = self.get_run_time()
+        if run_time > _env_int("SHAPE_RUN_SECONDS", 900):
+            return None
+        step = int(run_time // _env_int("SHAPE_STEP_SECONDS", 60)) + 1
+        users = min(step * _env_int("SHAPE_STEP_USERS", 50), _env_int("SHAPE_MAX_USERS", 500))
+        return users, _env_int("SHAPE_SPAWN_RATE", 50)
+
+
+class RampLoadShape(LoadTestShape):
+    """Ramp linearly to SHAPE_MAX_USERS over the first half of the run, hold, then ramp down in the last tenth."""
+    abstract = True
+
+    def tick(self):
+        run_time = self.get_run_time()
+        duration = _env_int("SHAPE_RUN_SECONDS", 900)
+        if run_time > duration:
+            return None
+        max_users = _env_int("SHAPE_MAX_USERS", 500)
+        if run_time < duration / 2:
+            users = max_users * run_time / (duration / 2)
+        elif run_time > duration * 0.9:
+            users = max_users * (duration - run_time) / (duration * 0.1)
+        else:
+            users = max_users
+        return max(int(users), 1), _env_int("SHAPE_SPAWN_RATE", 50)
+
+
+class SpikeLoadShape(LoadTestShape):
+    """Hold SHAPE_BASE_USERS, jumping to SHAPE_MAX_USERS for SHAPE_SPIKE_SECONDS after every SHAPE_SPIKE_AT seconds."""
+    abstract = True
+
+    def tick(self):
+        run_time = self.get_run_time()
+        if run_time > _env_int("SHAPE_RUN_SECONDS", 900):
+            return None
+        spike_at = _env_int("SHAPE_SPIKE_AT", 300)
+        in_spike = run_time % (spike_at + _env_int("SHAPE_SPIKE_SECONDS", 60)) >= spike_at
+        users = _env_int("SHAPE_MAX_USERS", 500) if in_spike else _env_int("SHAPE_BASE_USERS", 50)
+        # Spikes arrive at once rather than at the usual spawn rate
+        return users, max(users, 1) if in_spike else _env_int("SHAPE_SPAWN_RATE", 50)
+
+
+LOAD_SHAPES = {"step": StepLoadShape, "ramp": RampLoadShape, "spike": SpikeLoadShape}
+
+_load_shape = os.environ.get("LOAD_SHAPE", "")
+if _load_shape:
+    # Locust runs the first concrete shape class it finds, so only the selected one is concrete
+    class SelectedLoadShape(LOAD_SHAPES[_load_shape]):
+        abstract = False
+
+
+# ---------- Results export ----------
+
+@events.init_command_line_parser.add_listener
+def _add_arguments(parser):
+    parser.add_argument("--results-prefix", default=os.environ.get("RESULTS_PREFIX", ""),
+                        help="Write per-request-class results to <prefix>.json and <prefix>.csv")
+
+
+def results_summary(stats) -> dict:
+    """Per-request-class counts, throughput and latency percentiles from a Locust stats object."""
+    entries = sorted(stats.entries.values(), key=lambda entry: (entry.method, entry.name)) + [stats.total]
+    summary = {}
+    for entry in entries:
+        summary[entry.name] = {
+            "requests": entry.num_requests,
+            "failures": entry.num_failures,
+            "failure_rate": round(entry.fail_ratio, 4),
+            "rps": round(entry.total_rps, 2),
+            "avg_ms": round(entry.avg_response_time, 2),
+            "max_ms": round(entry.max_response_time, 2),
+            **{f"p{round(p * 100, 1):g}_ms": entry.get_response_time_percentile(p) for p in PERCENTILES},
+        }
+    return summary
+
 
-    @task
-    def pricing(self):
-        self.client.get("/pricing")
+@events.test_stop.add_listener
+def _export_results(environment, **kwargs):
+    prefix = environment.parsed_options.results_prefix if environment.parsed_options else ""
+    if not prefix or isinstance(environment.runner, WorkerRunner):
+        # Workers only forward their stats; the master holds the aggregate
+        return
+    results = {"host": environment.host, "load_shape": _load_shape or None,
+               "classes": results_summary(environment.stats)}
+    summary = results["classes"]
+    with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    # Also logged, for runs whose files are not kept (e.g. ECS tasks)
+    logging.info(f"Results summary: {json.dumps(results)}")
+    with open(f"{prefix}.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        columns = list(next(iter(summary.values())).keys())
+        writer.writerow(["name"] + columns)
+        for name, row in summary.items():
+            writer.writerow([name] + [row[column] for column in columns])
@@ -110,6 +110,14 @@ resource "aws_security_group" "ecs" {
     security_groups = [aws_security_group.alb.id]
   }
 
+  # Locust workers connect to the master
+  ingress {
+    from_port = 5557
+    to_port   = 5557
+    protocol  = "tcp"
+    self      = true
+  }
+
   egress {
     from_port   = 0
     to_port     = 0
@@ -129,6 +137,14 @@ resource "aws_security_group" "alb" {
     cidr_blocks = ["0.0.0.0/0"]
   }
 
+  # x86_64 baseline service (amd64.tf)
+  ingress {
+    from_port   = 8081
+    to_port     = 8081
+    protocol    = "tcp"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+
   egress {
     from_port   = 0
     to_port     = 0
@@ -323,7 +339,11 @@ resource "aws_ecs_capacity_provider" "amd64" {
 
 resource "aws_ecs_cluster_capacity_providers" "main" {
   cluster_name       = aws_ecs_cluster.main.name
-  capacity_providers = [aws_ecs_capacity_provider.graviton.name, aws_ecs_capacity_provider.amd64.name]
+  capacity_providers = [
+    aws_ecs_capacity_provider.graviton.name,
+    aws_ecs_capacity_provider.amd64.name,
+    aws_ecs_capacity_provider.loadgen.name,
+  ]
 
   default_capacity_provider_strategy {
     capacity_provider = aws_ecs_capacity_provider.graviton.name
@@ -0,0 +1,46 @@
+"""Stand-in for the pricing service, for trying the Locust setup locally.
+
+    python stub_pricing.py --port 8090 --ms-per-million-paths 500
+
+Latency grows with the requested number of Monte Carlo paths, so the request
+classes in locustfile.py behave like they do against the real service. Run two
+instances with different --ms-per-million-paths to rehearse a comparison.
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_handler(seconds_per_path: float):
+    class PricingHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/pricing":
+                self.send_error(404)
+                return
+            query = parse_qs(url.query)
+            paths = int(query.get("paths", ["10000"])[0])
+            time.sleep(paths * seconds_per_path)
+            body = json.dumps({"price": 4.2, "paths": paths}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PricingHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--ms-per-million-paths", type=float, default=500)
+    args = parser.parse_args()
+    print(f"Stub pricing service on http://{args.host}:{args.port}/pricing")
+    ThreadingHTTPServer((args.host, args.port), make_handler(args.ms_per_million_paths / 1e9)).serve_forever()